@@ -2,20 +2,65 @@
 Address Validation with Commercial POI Detection
 Validates geocoded addresses using Google Places API for commercial activity
 """
+import asyncio
 import os
 import requests
 import time
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
+
+import aiohttp
+from diskcache import Cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from common.geocode import AsyncTokenBucket
 from common.google_geocoder import GoogleGeocoder
 
 
+# Places responses for a (lat, lng, radius) rarely change; keep them for 30 days
+POI_CACHE_TTL_SEC = 30 * 24 * 60 * 60
+
+# Bump when the cached summary's meaning changes: v2 counts any nearby place
+# from Places (New) searchNearby, v1 (unprefixed) counted legacy
+# nearbysearch type=establishment hits
+POI_CACHE_KEY_VERSION = 'v2'
+
+# Only request the place fields _summarize_places reads (types + name for the
+# retail check); the response shrinks to a fraction of the full place payload
+PLACES_FIELD_MASK = 'places.types,places.displayName'
+
+# Retry policy shared by the sync session (urllib3 Retry) and the aiohttp
+# path: PLACES_RETRIES retries on these statuses, exponential backoff from
+# PLACES_BACKOFF seconds, Retry-After honoured
+PLACES_RETRY_STATUSES = (429, 500, 502, 503, 504)
+PLACES_RETRIES = 3
+PLACES_BACKOFF = 0.5
+
+# Steady-state Places requests per second for the async batch path
+# (Google's default searchNearby quota is 600 per minute)
+PLACES_MAX_QPS = float(os.getenv("PLACES_MAX_QPS", "10"))
+
+
 class AddressValidator:
     """Validates geocoded addresses using commercial POI detection"""
 
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, enable_cache: bool = True,
+                 cache_dir: Optional[str] = None):
         self.api_key = api_key or os.getenv("GOOGLE_GEOCODING_API_KEY")
         self.geocoder = GoogleGeocoder(api_key=self.api_key)
-        self.places_url = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
+        self.places_url = "https://places.googleapis.com/v1/places:searchNearby"
+        self.poi_cache = Cache(cache_dir or os.getenv("POI_CACHE_DIR", "/tmp/poi_cache")) if enable_cache else None
+
+        # Pooled keep-alive session so repeated Places calls reuse TCP/TLS connections
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(
+            pool_connections=25,
+            pool_maxsize=25,
+            # allowed_methods=None: the Places (New) searchNearby call is a POST,
+            # which urllib3 does not retry by default
+            max_retries=Retry(total=PLACES_RETRIES, backoff_factor=PLACES_BACKOFF,
+                              status_forcelist=list(PLACES_RETRY_STATUSES), allowed_methods=None),
+        ))
 
     def validate_range_address(self, start_addr: str, end_addr: str, city: str) -> Dict[str, Any]:
         """
@@ -107,69 +152,202 @@ class AddressValidator:
                 'confidence_boost': int (0-25)
             }
         """
-        params = {
-            'key': self.api_key,
-            'location': f'{latitude},{longitude}',
-            'radius': radius,
-            'type': 'establishment'  # Any commercial establishment
-        }
+        cache_key = self._poi_cache_key(latitude, longitude, radius)
+        cached = self._get_cached_poi(cache_key)
+        if cached is not None:
+            return cached
 
         try:
-            response = requests.get(self.places_url, params=params)
+            response = self.session.post(self.places_url,
+                                         json=self._places_body(latitude, longitude, radius),
+                                         headers=self._places_headers())
             response.raise_for_status()
-            data = response.json()
+            return self._summarize_and_cache(cache_key, response.json())
 
-            if data.get('status') != 'OK':
-                return {
-                    'poi_count': 0,
-                    'commercial_types': [],
-                    'has_retail': False,
-                    'confidence_boost': 0
+        except Exception as e:
+            print(f"  ⚠️ Places API error: {str(e)}")
+            return self._empty_poi_result()
+
+    async def check_commercial_activity_async(self, session: aiohttp.ClientSession,
+                                              latitude: float, longitude: float,
+                                              radius: int = 100,
+                                              limiter: Optional[AsyncTokenBucket] = None) -> Optional[Dict[str, Any]]:
+        """
+        Async variant of check_commercial_activity using a shared aiohttp session.
+
+        429/5xx responses are retried with the same policy as the sync
+        session (PLACES_RETRIES, exponential backoff, Retry-After honoured). Unlike the sync method, a lookup that still fails
+        returns None rather than an empty result, so callers can tell it
+        apart from a location with no POIs; failures are never cached.
+
+        Args:
+            session: Shared aiohttp session
+            latitude, longitude: Location to check
+            radius: Search radius in meters (default 100m)
+            limiter: Token bucket capping request starts across all callers
+        """
+        cache_key = self._poi_cache_key(latitude, longitude, radius)
+        cached = self._get_cached_poi(cache_key)
+        if cached is not None:
+            return cached
+
+        error = None
+        attempts = PLACES_RETRIES + 1
+        for attempt in range(attempts):
+            delay = PLACES_BACKOFF * (2 ** attempt)
+            if limiter is not None:
+                await limiter.acquire()
+            try:
+                async with session.post(self.places_url,
+                                        json=self._places_body(latitude, longitude, radius),
+                                        headers=self._places_headers(),
+                                        timeout=aiohttp.ClientTimeout(total=10)) as response:
+                    if response.status == 200:
+                        return self._summarize_and_cache(cache_key, await response.json())
+                    error = f"HTTP {response.status}"
+                    if response.status not in PLACES_RETRY_STATUSES:
+                        break
+                    retry_after = response.headers.get("Retry-After")
+                    if retry_after and retry_after.isdigit():
+                        delay = max(delay, float(retry_after))
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                error = str(e)
+            if attempt < attempts - 1:
+                await asyncio.sleep(delay)
+
+        print(f"  ⚠️ Places API error: {error}")
+        return None
+
+    def check_commercial_activity_batch(self, points: List[Tuple[Any, float, float]],
+                                        radius: int = 100,
+                                        max_concurrency: int = 25,
+                                        max_qps: float = PLACES_MAX_QPS) -> Dict[Any, Dict[str, Any]]:
+        """
+        Check commercial activity for a batch of locations
+
+        Points sharing the same coordinates (after cache-key rounding) are
+        looked up once; the unique lookups run concurrently. Keys whose
+        lookup failed are left out of the result (and nothing is cached for
+        them), so callers can report them as unchecked.
+
+        Args:
+            points: List of (key, latitude, longitude) tuples
+            radius: Search radius in meters (default 100m)
+            max_concurrency: Maximum in-flight Places requests (default 25)
+            max_qps: Steady-state Places requests per second, retries included
+                (0 = unlimited)
+
+        Returns:
+            {key: check_commercial_activity result} for successful lookups
+        """
+        unique_coords = {}
+        for _, lat, lng in points:
+            unique_coords.setdefault(self._poi_cache_key(lat, lng, radius), (lat, lng))
+
+        async def run() -> List[Optional[Dict[str, Any]]]:
+            semaphore = asyncio.Semaphore(max_concurrency)
+            limiter = AsyncTokenBucket(max_qps, burst=max_concurrency)
+
+            async with aiohttp.ClientSession() as session:
+                async def check(latitude: float, longitude: float) -> Optional[Dict[str, Any]]:
+                    async with semaphore:
+                        return await self.check_commercial_activity_async(session, latitude, longitude,
+                                                                          radius, limiter=limiter)
+
+                return await asyncio.gather(*(check(lat, lng) for lat, lng in unique_coords.values()))
+
+        if not points:
+            return {}
+
+        by_coord = {coord: result for coord, result in zip(unique_coords, asyncio.run(run()))
+                    if result is not None}
+        results = {}
+        for key, lat, lng in points:
+            result = by_coord.get(self._poi_cache_key(lat, lng, radius))
+            if result is not None:
+                results[key] = result
+        return results
+
+    def _places_headers(self) -> Dict[str, str]:
+        return {
+            'X-Goog-Api-Key': self.api_key,
+            'X-Goog-FieldMask': PLACES_FIELD_MASK,
+        }
+
+    @staticmethod
+    def _places_body(latitude: float, longitude: float, radius: int) -> Dict[str, Any]:
+        return {
+            'locationRestriction': {
+                'circle': {
+                    'center': {'latitude': float(latitude), 'longitude': float(longitude)},
+                    'radius': float(radius),
                 }
+            },
+            'maxResultCount': 20,
+        }
 
-            results = data.get('results', [])
+    @staticmethod
+    def _poi_cache_key(latitude: float, longitude: float, radius: int) -> str:
+        return f"{POI_CACHE_KEY_VERSION}:{float(latitude):.5f}:{float(longitude):.5f}:{radius}"
 
-            # Filter for commercial types
-            commercial_types = set()
-            retail_keywords = ['store', 'restaurant', 'cafe', 'shop', 'retail', 'mall']
-            has_retail = False
+    def _get_cached_poi(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        if self.poi_cache is None:
+            return None
+        return self.poi_cache.get(cache_key)
 
-            for place in results:
-                types = place.get('types', [])
-                commercial_types.update(types)
+    def _summarize_and_cache(self, cache_key: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        # Only successful (2xx) responses reach here, so the summary is safe to cache
+        summary = self._summarize_places(data)
+        if self.poi_cache is not None:
+            self.poi_cache.set(cache_key, summary, expire=POI_CACHE_TTL_SEC)
+        return summary
 
-                # Check if name or types suggest retail
-                name = place.get('name', '').lower()
-                if any(keyword in name or keyword in ' '.join(types) for keyword in retail_keywords):
-                    has_retail = True
+    @staticmethod
+    def _empty_poi_result() -> Dict[str, Any]:
+        return {
+            'poi_count': 0,
+            'commercial_types': [],
+            'has_retail': False,
+            'confidence_boost': 0
+        }
 
-            poi_count = len(results)
+    def _summarize_places(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Reduce a Places searchNearby response to POI counts and confidence boost"""
+        # No nearby places -> empty body
+        results = data.get('places', [])
 
-            # Confidence boost based on commercial activity
-            if poi_count >= 5 and has_retail:
-                confidence_boost = 25
-            elif poi_count >= 3:
-                confidence_boost = 15
-            elif poi_count >= 1:
-                confidence_boost = 5
-            else:
-                confidence_boost = 0
+        # Filter for commercial types
+        commercial_types = set()
+        retail_keywords = ['store', 'restaurant', 'cafe', 'shop', 'retail', 'mall']
+        has_retail = False
 
-            return {
-                'poi_count': poi_count,
-                'commercial_types': list(commercial_types),
-                'has_retail': has_retail,
-                'confidence_boost': confidence_boost
-            }
+        for place in results:
+            types = place.get('types', [])
+            commercial_types.update(types)
 
-        except Exception as e:
-            print(f"  ⚠️ Places API error: {str(e)}")
-            return {
-                'poi_count': 0,
-                'commercial_types': [],
-                'has_retail': False,
-                'confidence_boost': 0
-            }
+            # Check if name or types suggest retail
+            name = place.get('displayName', {}).get('text', '').lower()
+            if any(keyword in name or keyword in ' '.join(types) for keyword in retail_keywords):
+                has_retail = True
+
+        poi_count = len(results)
+
+        # Confidence boost based on commercial activity
+        if poi_count >= 5 and has_retail:
+            confidence_boost = 25
+        elif poi_count >= 3:
+            confidence_boost = 15
+        elif poi_count >= 1:
+            confidence_boost = 5
+        else:
+            confidence_boost = 0
+
+        return {
+            'poi_count': poi_count,
+            'commercial_types': list(commercial_types),
+            'has_retail': has_retail,
+            'confidence_boost': confidence_boost
+        }
 
     def validate_geocoded_address(self, geocode_result: Dict[str, Any]) -> Dict[str, Any]:
         """
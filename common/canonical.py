@@ -1,6 +1,7 @@
 import hashlib
 import re
-from typing import Optional
+from functools import lru_cache
+from typing import Optional, Tuple
 
 
 _SPACE_RE = re.compile(r"\s+")
@@ -40,3 +41,11 @@ def hash_canonical_address(address_line1: Optional[str], city: Optional[str], pr
     s = _SPACE_RE.sub(" ", s).strip()
     return hashlib.sha256(s.encode("utf-8")).hexdigest()
 
+
+@lru_cache(maxsize=200_000)
+def canonicalize_and_hash(address_line1: Optional[str], city: Optional[str], province: Optional[str], country: Optional[str] = "CA") -> Tuple[str, str]:
+    # Memoized (canonical, hash) pair; units in the same building share inputs
+    return (
+        canonicalize_address(address_line1, city, province, country),
+        hash_canonical_address(address_line1, city, province, country),
+    )
@@ -6,16 +6,18 @@ import os
 import time
 import requests
 from typing import Optional, Dict, Any
-from common.google_geocoder import GoogleGeocoder
+from common.google_geocoder import GoogleGeocoder, TokenBucket
 
 
 class EnhancedGeocoder:
     """Enhanced geocoder with automatic fallback to Text Search for problematic addresses"""
 
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, limiter: Optional[TokenBucket] = None):
         self.api_key = api_key or os.getenv("GOOGLE_GEOCODING_API_KEY")
         self.geocoder = GoogleGeocoder(api_key=self.api_key)
         self.text_search_url = "https://maps.googleapis.com/maps/api/place/textsearch/json"
+        # Shared bucket charged once per Google request (geocode and text search)
+        self.limiter = limiter
 
     def geocode_with_fallback(self, address: str, region: str = "CA") -> Dict[str, Any]:
         """
@@ -35,6 +37,7 @@ class EnhancedGeocoder:
         }
         """
         # Try regular geocoding first
+        self._acquire()
         geocode_result = self.geocoder.geocode(address, region=region)
 
         if not geocode_result:
@@ -81,6 +84,7 @@ class EnhancedGeocoder:
         }
 
         try:
+            self._acquire()
             response = requests.get(self.text_search_url, params=params)
             response.raise_for_status()
             data = response.json()
@@ -131,6 +135,10 @@ class EnhancedGeocoder:
                 'error': str(e)
             }
 
+    def _acquire(self) -> None:
+        if self.limiter is not None:
+            self.limiter.acquire()
+
     def _parse_formatted_address(self, formatted_addr: str) -> Dict[str, str]:
         """Parse formatted address into components"""
         # Example: "9226 ON-93, Midland, ON L4R 4K4, Canada"
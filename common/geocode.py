@@ -1,14 +1,62 @@
+import asyncio
 import os
-import time
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 
+import aiohttp
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+GEOCODIO_URL = "https://api.geocod.io/v1.7/geocode"
+GEOCODIO_BATCH_MAX = 10000
+
+
+class AsyncTokenBucket:
+    """Token-bucket limiter: allows `burst` immediate starts, then `rate` per second."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            if self.updated is not None:
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                # only wait for the part of the interval that hasn't already elapsed
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.tokens = 1.0
+                self.updated = loop.time()
+            self.tokens -= 1
 
 
 class Geocoder:
     def __init__(self, api_key: Optional[str] = None, timeout: int = 15):
         self.api_key = api_key or os.getenv("GEOCODIO_API_KEY")
         self.timeout = timeout
+        # Pooled keep-alive session so repeated lookups reuse TCP/TLS connections;
+        # the adapter retries 429/5xx with backoff (honouring Retry-After)
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(
+            pool_connections=64,
+            pool_maxsize=64,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.5,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=None,
+                raise_on_status=False,
+            ),
+        ))
 
     def available(self) -> bool:
         return bool(self.api_key)
@@ -16,29 +64,116 @@ class Geocoder:
     def geocode(self, query: str, country: str = "CA") -> Optional[Dict[str, Any]]:
         if not self.available():
             return None
-        base = "https://api.geocod.io/v1.7/geocode"
+        base = GEOCODIO_URL
         params = {
             "q": query,
             "api_key": self.api_key,
             "country": country,
             "limit": 1,
         }
-        # simple retry/backoff
-        for attempt in range(3):
-            try:
-                r = requests.get(base, params=params, timeout=self.timeout)
-                if r.status_code == 200:
-                    data = r.json()
-                    results = data.get("results") or []
-                    if results:
-                        return results[0]
-                    return None
-                # backoff on 429/5xx
-                if r.status_code in (429, 500, 502, 503, 504):
-                    time.sleep(1.5 * (attempt + 1))
-                    continue
-                return None
-            except requests.RequestException:
-                time.sleep(1.5 * (attempt + 1))
+        try:
+            r = self.session.get(base, params=params, timeout=self.timeout)
+        except requests.RequestException:
+            return None
+        if r.status_code != 200:
+            return None
+        results = r.json().get("results") or []
+        if results:
+            return results[0]
         return None
 
+    def geocode_batch(self, queries: List[str], country: str = "CA") -> List[Optional[Dict[str, Any]]]:
+        """Geocode up to GEOCODIO_BATCH_MAX addresses in one POST; results are in input order."""
+        if not self.available() or not queries:
+            return [None] * len(queries)
+        self._check_batch_size(queries)
+        try:
+            # batches are much slower than single lookups
+            r = self.session.post(GEOCODIO_URL, params=self._batch_params(country), json=list(queries),
+                                  timeout=self.timeout * 20)
+        except requests.RequestException:
+            return [None] * len(queries)
+        if r.status_code != 200:
+            return [None] * len(queries)
+        return self._batch_results(r.json(), len(queries))
+
+    async def geocode_batch_async(self, session: aiohttp.ClientSession, queries: List[str],
+                                  country: str = "CA") -> List[Optional[Dict[str, Any]]]:
+        """Async variant of geocode_batch using a shared aiohttp session."""
+        if not self.available() or not queries:
+            return [None] * len(queries)
+        self._check_batch_size(queries)
+        timeout = aiohttp.ClientTimeout(total=self.timeout * 20)
+        # exponential backoff on 429/5xx, honouring Retry-After when sent
+        for attempt in range(4):
+            delay = 1.5 * (2 ** attempt)
+            try:
+                async with session.post(GEOCODIO_URL, params=self._batch_params(country),
+                                        json=list(queries), timeout=timeout) as r:
+                    if r.status == 200:
+                        return self._batch_results(await r.json(), len(queries))
+                    if r.status not in (429, 500, 502, 503, 504):
+                        return [None] * len(queries)
+                    retry_after = r.headers.get("Retry-After")
+                    if retry_after and retry_after.isdigit():
+                        delay = max(delay, float(retry_after))
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+            await asyncio.sleep(delay)
+        return [None] * len(queries)
+
+    def geocode_many(self, queries: List[str], country: str = "CA", batch_size: int = 1000,
+                     max_concurrency: int = 4, min_interval: float = 0.0) -> List[Optional[Dict[str, Any]]]:
+        """
+        Geocode any number of addresses as concurrent batch requests.
+
+        Args:
+            queries: Addresses to geocode
+            country: Country code passed to Geocodio
+            batch_size: Addresses per batch POST (capped at GEOCODIO_BATCH_MAX)
+            max_concurrency: Maximum batch requests in flight
+            min_interval: Steady-state seconds between batch request starts; up to
+                max_concurrency requests may start at once when the bucket is full
+
+        Returns:
+            One result (or None) per query, in input order
+        """
+        if not self.available() or not queries:
+            return [None] * len(queries)
+        batch_size = max(1, min(batch_size, GEOCODIO_BATCH_MAX))
+        chunks = [queries[i:i + batch_size] for i in range(0, len(queries), batch_size)]
+
+        async def run() -> List[List[Optional[Dict[str, Any]]]]:
+            semaphore = asyncio.Semaphore(max_concurrency)
+            limiter = AsyncTokenBucket(1.0 / min_interval if min_interval > 0 else 0, burst=max_concurrency)
+
+            async with aiohttp.ClientSession() as session:
+                async def fetch(chunk: List[str]) -> List[Optional[Dict[str, Any]]]:
+                    async with semaphore:
+                        await limiter.acquire()
+                        return await self.geocode_batch_async(session, chunk, country=country)
+
+                return await asyncio.gather(*(fetch(chunk) for chunk in chunks))
+
+        return [result for chunk_results in asyncio.run(run()) for result in chunk_results]
+
+    @staticmethod
+    def _check_batch_size(queries: List[str]) -> None:
+        if len(queries) > GEOCODIO_BATCH_MAX:
+            raise ValueError(f"Geocodio batch is limited to {GEOCODIO_BATCH_MAX} addresses")
+
+    def _batch_params(self, country: str) -> Dict[str, Any]:
+        return {
+            "api_key": self.api_key,
+            "country": country,
+            "limit": "1",
+        }
+
+    @staticmethod
+    def _batch_results(data: Dict[str, Any], expected: int) -> List[Optional[Dict[str, Any]]]:
+        out: List[Optional[Dict[str, Any]]] = []
+        for item in data.get("results") or []:
+            results = (item.get("response") or {}).get("results") or []
+            out.append(results[0] if results else None)
+        # pad defensively so callers can always zip by index
+        return out + [None] * (expected - len(out))
@@ -0,0 +1,208 @@
+"""
+Bulk writes of Google geocoding results.
+
+Shared by the scripts/geocoding loaders: results are buffered as row tuples
+and streamed into google_geocoded_addresses / transaction_address_links with
+one COPY per table instead of one INSERT per address. Ids are generated
+client-side so links can reference their geocode row without a RETURNING
+round-trip.
+"""
+import io
+import uuid
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import orjson
+from psycopg2.extras import execute_values
+
+from common.address import normalize_raw_address
+from common.address_parser import extract_unit_number
+
+
+GEOCODED_COLUMNS = (
+    "id",
+    "source_table",
+    "source_id",
+    "input_address",
+    "google_formatted_address",
+    "google_street_number",
+    "google_street",
+    "google_city",
+    "google_province",
+    "google_postal_code",
+    "google_latitude",
+    "google_longitude",
+    "google_place_id",
+    "google_confidence",
+    "geocode_success",
+    "geocode_error",
+    "google_raw_response",
+)
+
+LINK_COLUMNS = (
+    "transaction_id",
+    "geocoded_address_id",
+    "is_multi_property",
+    "original_address",
+    "pattern_type",
+    "address_position",
+    "is_primary",
+)
+
+
+def geocoded_row(source_table: str, source_id: Any, input_address: str,
+                 result: Optional[Dict[str, Any]]) -> tuple:
+    """
+    Build a google_geocoded_addresses row (in GEOCODED_COLUMNS order).
+
+    Args:
+        source_table: Table the input address came from
+        source_id: Id of the source row
+        input_address: Address string sent to Google
+        result: GoogleGeocoder result, or None when geocoding failed
+
+    Returns:
+        Row tuple whose first field is the new row's id; failures only carry
+        the source, input and error columns
+    """
+    row_id = str(uuid.uuid4())
+    if not result:
+        return (row_id, source_table, source_id, input_address) + (None,) * 10 + (
+            False, 'No result from Google API', None)
+
+    components = result.get('components', {})
+    location = result.get('location', {})
+    return (
+        row_id,
+        source_table,
+        source_id,
+        input_address,
+        result.get('formatted_address'),
+        components.get('street_number'),
+        components.get('street'),
+        components.get('city'),
+        components.get('province'),
+        components.get('postal_code'),
+        location.get('lat'),
+        location.get('lng'),
+        result.get('place_id'),
+        result.get('confidence'),
+        True,
+        None,
+        # COPY casts the serialized text to jsonb server-side
+        orjson.dumps(result.get('raw')).decode(),
+    )
+
+
+def _copy_field(value) -> str:
+    """Render one value in COPY text format."""
+    if value is None:
+        return "\\N"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def copy_rows(cur, table: str, columns: Sequence[str], rows: Sequence[tuple]) -> None:
+    """Stream rows into table with one COPY FROM STDIN."""
+    if not rows:
+        return
+    buf = io.StringIO()
+    for row in rows:
+        buf.write("\t".join(_copy_field(v) for v in row))
+        buf.write("\n")
+    buf.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buf)
+
+
+def write_geocoded(cur, geo_rows: Sequence[tuple], link_rows: Sequence[tuple] = ()) -> None:
+    """
+    Write buffered geocode rows and the transaction links that point at them.
+
+    Args:
+        cur: psycopg2 cursor
+        geo_rows: Tuples from geocoded_row()
+        link_rows: Tuples in LINK_COLUMNS order, geocoded_address_id taken
+            from the matching geocoded_row()[0]
+    """
+    copy_rows(cur, "google_geocoded_addresses", GEOCODED_COLUMNS, geo_rows)
+    copy_rows(cur, "transaction_address_links", LINK_COLUMNS, link_rows)
+
+
+def cache_key(address: str) -> str:
+    """Normalize an input address for geocode_cache: no unit, uppercase, no punctuation."""
+    street, _unit = extract_unit_number(address)
+    return normalize_raw_address(street, None)
+
+
+class GeocodeCache:
+    """
+    Read-through cache of Google results backed by the geocode_cache table.
+
+    Only successful results are cached; failures are retried on later runs.
+    """
+
+    def __init__(self, cur):
+        self.cur = cur
+        self.pending: Dict[str, Dict[str, Any]] = {}
+
+    def lookup(self, keys: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        """Fetch cached results for keys with one query."""
+        if not keys:
+            return {}
+        self.cur.execute(
+            "SELECT normalized_input, result FROM geocode_cache WHERE normalized_input = ANY(%s)",
+            (list(set(keys)),),
+        )
+        return dict(self.cur.fetchall())
+
+    def geocode_iter(self, geocoder, addresses: List[str], **opts) -> Iterator[Optional[Dict[str, Any]]]:
+        """
+        Yield one result per address in order, calling Google only for cache misses.
+
+        Addresses sharing a cache key are geocoded once and the result is
+        fanned back out to every one of them.
+
+        Args:
+            geocoder: GoogleGeocoder (or an open GeocodeRun, to share one
+                rate limit across calls) used for misses
+            addresses: Addresses to geocode
+            **opts: Passed through to geocoder.geocode_iter()
+        """
+        keys = [cache_key(address) for address in addresses]
+        known: Dict[str, Optional[Dict[str, Any]]] = self.lookup(keys)
+
+        # First address seen for each missing key, in first-occurrence order
+        misses: Dict[str, str] = {}
+        for address, key in zip(addresses, keys):
+            if key not in known:
+                misses.setdefault(key, address)
+        fresh = zip(misses, geocoder.geocode_iter(list(misses.values()), **opts))
+
+        for key in keys:
+            if key not in known:
+                # an unseen key is always the next first occurrence
+                _, result = next(fresh)
+                known[key] = result
+                if result:
+                    self.pending[key] = result
+            yield known[key]
+
+    def flush(self) -> None:
+        """Persist results fetched since the last flush (commit with the caller's batch)."""
+        if not self.pending:
+            return
+        execute_values(
+            self.cur,
+            """
+            INSERT INTO geocode_cache (normalized_input, result)
+            VALUES %s
+            ON CONFLICT (normalized_input) DO NOTHING
+            """,
+            [(key, orjson.dumps(result).decode()) for key, result in self.pending.items()],
+            template="(%s, %s::jsonb)",
+        )
+        self.pending.clear()
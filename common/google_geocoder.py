@@ -1,7 +1,41 @@
+import asyncio
 import os
+import threading
 import time
-from typing import Optional, Dict, Any
+from itertools import islice
+from typing import Optional, Dict, Any, Iterable, Iterator, List
+
+import aiohttp
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from common.geocode import AsyncTokenBucket
+
+
+class TokenBucket:
+    """Thread-safe token-bucket limiter: allows `burst` immediate calls, then `rate` per second."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                # holding the lock while sleeping keeps waiters in FIFO-ish order
+                time.sleep((1 - self.tokens) / self.rate)
+                self.tokens = 1.0
+                self.updated = time.monotonic()
+            self.tokens -= 1
 
 
 class GoogleGeocoder:
@@ -11,6 +45,15 @@ class GoogleGeocoder:
         self.api_key = api_key or os.getenv("GOOGLE_GEOCODING_API_KEY")
         self.base_url = "https://maps.googleapis.com/maps/api/geocode/json"
 
+        # Pooled keep-alive session so sync geocode() calls (including from
+        # worker threads) reuse TCP/TLS connections instead of reconnecting
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=32,
+            max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]),
+        ))
+
     def available(self) -> bool:
         return bool(self.api_key)
 
@@ -29,40 +72,175 @@ class GoogleGeocoder:
         }
 
         try:
-            response = requests.get(self.base_url, params=params, timeout=10)
+            response = self.session.get(self.base_url, params=params, timeout=10)
             response.raise_for_status()
-            data = response.json()
-
-            if data.get("status") == "OK" and data.get("results"):
-                result = data["results"][0]
-
-                # Extract components
-                components = {}
-                for comp in result.get("address_components", []):
-                    types = comp.get("types", [])
-                    if "street_number" in types:
-                        components["street_number"] = comp["long_name"]
-                    if "route" in types:
-                        components["street"] = comp["long_name"]
-                    if "locality" in types:
-                        components["city"] = comp["long_name"]
-                    if "administrative_area_level_1" in types:
-                        components["province"] = comp["short_name"]
-                    if "postal_code" in types:
-                        components["postal_code"] = comp["long_name"]
-
-                # Return structured result
-                return {
-                    "formatted_address": result.get("formatted_address"),
-                    "components": components,
-                    "location": result.get("geometry", {}).get("location", {}),
-                    "place_id": result.get("place_id"),
-                    "confidence": "high" if result.get("geometry", {}).get("location_type") == "ROOFTOP" else "medium",
-                    "raw": result
-                }
+            return self._parse_response(response.json())
 
+        except Exception as e:
+            print(f"Geocoding error: {e}")
             return None
 
-        except Exception as e:
+    async def geocode_async(self, session: aiohttp.ClientSession, address: str,
+                            region: str = "CA") -> Optional[Dict[str, Any]]:
+        """Async variant of geocode() using a shared aiohttp session."""
+        if not self.available():
+            return None
+
+        params = {
+            "address": address,
+            "region": region,
+            "key": self.api_key
+        }
+
+        try:
+            async with session.get(self.base_url, params=params,
+                                   timeout=aiohttp.ClientTimeout(total=10)) as response:
+                response.raise_for_status()
+                data = await response.json()
+            return self._parse_response(data)
+
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
             print(f"Geocoding error: {e}")
             return None
+
+    async def geocode_all(self, session: aiohttp.ClientSession, addresses: List[str], region: str = "CA",
+                          max_concurrency: int = 10,
+                          limiter: Optional[AsyncTokenBucket] = None) -> List[Optional[Dict[str, Any]]]:
+        """
+        Geocode addresses concurrently over one aiohttp session.
+
+        Args:
+            session: Shared aiohttp session
+            addresses: Addresses to geocode
+            region: Region bias passed to Google
+            max_concurrency: Maximum requests in flight
+            limiter: Token bucket capping request starts across all callers
+
+        Returns:
+            One result (or None) per address, in input order
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def fetch(address: str) -> Optional[Dict[str, Any]]:
+            async with semaphore:
+                if limiter is not None:
+                    await limiter.acquire()
+                return await self.geocode_async(session, address, region=region)
+
+        return await asyncio.gather(*(fetch(address) for address in addresses))
+
+    def open_run(self, max_concurrency: int = 10, max_qps: float = 0.0) -> "GeocodeRun":
+        """
+        Open a GeocodeRun sharing one session and rate limiter across geocode_iter() calls.
+
+        Use it as a context manager when a run geocodes in several rounds
+        (e.g. per streamed chunk) so the max_qps cap holds for the whole run.
+        """
+        return GeocodeRun(self, max_concurrency=max_concurrency, max_qps=max_qps)
+
+    def geocode_iter(self, addresses: Iterable[str], region: str = "CA", chunk_size: int = 500,
+                     max_concurrency: int = 10, max_qps: float = 0.0) -> Iterator[Optional[Dict[str, Any]]]:
+        """
+        Geocode addresses concurrently, yielding results in input order.
+
+        One-shot wrapper around open_run(); callers geocoding in several
+        rounds should open a run themselves so the rate limit is shared.
+
+        Args:
+            addresses: Addresses to geocode (any iterable)
+            region: Region bias passed to Google
+            chunk_size: Addresses geocoded per concurrent round
+            max_concurrency: Maximum requests in flight
+            max_qps: Steady-state Google requests per second (0 = unlimited);
+                up to max_concurrency requests may start at once
+
+        Yields:
+            One result (or None) per address
+        """
+        with self.open_run(max_concurrency=max_concurrency, max_qps=max_qps) as run:
+            yield from run.geocode_iter(addresses, region=region, chunk_size=chunk_size)
+
+    @staticmethod
+    def _parse_response(data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Structure the first result of a Geocoding API response."""
+        if data.get("status") == "OK" and data.get("results"):
+            result = data["results"][0]
+
+            # Extract components
+            components = {}
+            for comp in result.get("address_components", []):
+                types = comp.get("types", [])
+                if "street_number" in types:
+                    components["street_number"] = comp["long_name"]
+                if "route" in types:
+                    components["street"] = comp["long_name"]
+                if "locality" in types:
+                    components["city"] = comp["long_name"]
+                if "administrative_area_level_1" in types:
+                    components["province"] = comp["short_name"]
+                if "postal_code" in types:
+                    components["postal_code"] = comp["long_name"]
+
+            # Return structured result
+            return {
+                "formatted_address": result.get("formatted_address"),
+                "components": components,
+                "location": result.get("geometry", {}).get("location", {}),
+                "place_id": result.get("place_id"),
+                "confidence": "high" if result.get("geometry", {}).get("location_type") == "ROOFTOP" else "medium",
+                "raw": result
+            }
+
+        return None
+
+
+class GeocodeRun:
+    """One event loop, aiohttp session and token bucket shared by every geocode_iter() call."""
+
+    def __init__(self, geocoder: GoogleGeocoder, max_concurrency: int = 10, max_qps: float = 0.0):
+        async def open_session() -> aiohttp.ClientSession:
+            return aiohttp.ClientSession()
+
+        self.geocoder = geocoder
+        self.max_concurrency = max_concurrency
+        self.limiter = AsyncTokenBucket(max_qps, burst=max_concurrency)
+        self.loop = asyncio.new_event_loop()
+        self.session = self.loop.run_until_complete(open_session())
+
+    def geocode_iter(self, addresses: Iterable[str], region: str = "CA",
+                     chunk_size: int = 500) -> Iterator[Optional[Dict[str, Any]]]:
+        """
+        Geocode addresses concurrently, yielding results in input order.
+
+        Addresses are pulled chunk_size at a time and each chunk is geocoded
+        with geocode_all() over the run's session, so callers keep a plain
+        synchronous loop.
+
+        Args:
+            addresses: Addresses to geocode (any iterable)
+            region: Region bias passed to Google
+            chunk_size: Addresses geocoded per concurrent round
+
+        Yields:
+            One result (or None) per address
+        """
+        addresses = iter(addresses)
+        while True:
+            chunk = list(islice(addresses, chunk_size))
+            if not chunk:
+                break
+            yield from self.loop.run_until_complete(self.geocoder.geocode_all(
+                self.session, chunk, region=region,
+                max_concurrency=self.max_concurrency, limiter=self.limiter,
+            ))
+
+    def close(self) -> None:
+        if not self.loop.is_closed():
+            self.loop.run_until_complete(self.session.close())
+            self.loop.close()
+
+    def __enter__(self) -> "GeocodeRun":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
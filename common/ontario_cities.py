@@ -1408,3 +1408,24 @@ def extract_city_from_canonical(canonical: str | None) -> str | None:
             return normalize_city(part_clean)
 
     return None
+
+
+def seed_city_fix_rules(cur) -> None:
+    """
+    Load the city rules above into the tables read by the fix_city() SQL port.
+
+    See config/supabase/migrations/20261016_city_fix_functions.sql. Reseeding on
+    every run keeps this module the single source of truth for the rules.
+
+    Args:
+        cur: Open psycopg2 cursor (caller commits)
+    """
+    from psycopg2.extras import execute_values
+
+    cur.execute("TRUNCATE city_fix_valid, city_fix_alias, city_fix_suffix")
+    execute_values(cur, "INSERT INTO city_fix_valid (name) VALUES %s",
+                   [(name,) for name in VALID_ONTARIO_CITIES])
+    execute_values(cur, "INSERT INTO city_fix_alias (alias, city) VALUES %s",
+                   list(AMALGAMATED_CITIES.items()))
+    execute_values(cur, "INSERT INTO city_fix_suffix (position, suffix) VALUES %s",
+                   list(enumerate(SUB_MUNICIPALITY_SUFFIXES)))
@@ -16,6 +16,9 @@ Date: 2025-10-03
 """
 
 from typing import Optional, List
+
+from psycopg2.extras import execute_values
+
 from .db import connect_with_retries
 
 
@@ -107,20 +110,21 @@ def queue_properties_batch(
         if not to_queue:
             return 0
 
-        # Insert batch
-        values = [(pid, priority) for pid in to_queue]
+        # Insert batch (one multi-row INSERT per page instead of one per row)
+        values = [(pid, priority, 'pending') for pid in to_queue]
 
-        cursor.executemany("""
+        inserted = execute_values(cursor, """
             INSERT INTO nar_validation_queue (
                 property_id,
                 priority,
                 status
             )
-            VALUES (%s, %s, 'pending')
-        """, values)
+            VALUES %s
+            RETURNING id
+        """, values, page_size=1000, fetch=True)
 
         conn.commit()
-        return len(to_queue)
+        return len(inserted)
 
     except Exception as e:
         print(f"Warning: Failed to queue properties batch: {e}")
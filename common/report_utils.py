@@ -0,0 +1,3 @@
+def pct(n: float, d: float) -> float:
+    """Fraction n/d, or 0.0 when d is zero (format with :.1%)."""
+    return (n / d) if d else 0.0
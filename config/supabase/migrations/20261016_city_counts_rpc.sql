@@ -0,0 +1,17 @@
+-- Per-city property counts for analysis scripts
+-- Lets callers pull (city, count) pairs via supabase.rpc('city_counts', ...)
+-- instead of fetching every property row and counting client-side.
+
+CREATE OR REPLACE FUNCTION city_counts(province TEXT DEFAULT 'ON')
+RETURNS TABLE (city TEXT, count BIGINT)
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT p.city, COUNT(*) AS count
+  FROM properties p
+  WHERE p.province = city_counts.province
+    AND p.city IS NOT NULL
+    AND p.city <> ''
+  GROUP BY p.city
+  ORDER BY count DESC;
+$$;
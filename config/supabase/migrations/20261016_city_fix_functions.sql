@@ -0,0 +1,160 @@
+-- Server-side port of common.address_parser.parse_and_validate_city and
+-- common.address.hash_address_raw, so apply_city_fixes_sql.py --sql can fix
+-- every property in one UPDATE without shipping rows to the client.
+--
+-- The rule tables are (re)seeded from common/ontario_cities.py by the script
+-- on each --sql run, so the Python constants stay the single source of truth.
+
+CREATE TABLE IF NOT EXISTS city_fix_valid (
+  name TEXT PRIMARY KEY
+);
+
+CREATE TABLE IF NOT EXISTS city_fix_alias (
+  alias TEXT PRIMARY KEY,
+  city TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS city_fix_suffix (
+  position INT PRIMARY KEY,
+  suffix TEXT NOT NULL
+);
+
+-- str.upper(): Postgres upper() leaves a few characters alone that Python
+-- expands to ASCII (ß -> SS, ligatures, ...). Map those first so the hash and
+-- the rule matches agree with the Python side. upper() itself follows the
+-- database locale, so everything built on this is STABLE, not IMMUTABLE.
+CREATE OR REPLACE FUNCTION city_fix_upper(s TEXT)
+RETURNS TEXT
+LANGUAGE plpgsql STABLE PARALLEL SAFE AS $$
+DECLARE
+  m RECORD;
+BEGIN
+  IF s ~ U&'[\00DF\0131\0149\017F\01F0\1E96-\1E9A\FB00-\FB06]' THEN
+    FOR m IN
+      SELECT * FROM (VALUES
+        (U&'\00DF', 'SS'), (U&'\0131', 'I'), (U&'\0149', U&'\02BCN'), (U&'\017F', 'S'),
+        (U&'\01F0', U&'J\030C'), (U&'\1E96', U&'H\0331'), (U&'\1E97', U&'T\0308'),
+        (U&'\1E98', U&'W\030A'), (U&'\1E99', U&'Y\030A'), (U&'\1E9A', U&'A\02BE'),
+        (U&'\FB00', 'FF'), (U&'\FB01', 'FI'), (U&'\FB02', 'FL'), (U&'\FB03', 'FFI'),
+        (U&'\FB04', 'FFL'), (U&'\FB05', 'ST'), (U&'\FB06', 'ST')
+      ) AS v(c, u)
+    LOOP
+      s := replace(s, m.c, m.u);
+    END LOOP;
+  END IF;
+  RETURN upper(s);
+END $$;
+
+-- normalize_city(): uppercase, strip sub-municipality suffixes, map aliases
+CREATE OR REPLACE FUNCTION city_fix_normalize(raw TEXT)
+RETURNS TEXT
+LANGUAGE plpgsql STABLE PARALLEL SAFE AS $$
+DECLARE
+  c TEXT := city_fix_upper(regexp_replace(coalesce(raw, ''), '^\s+|\s+$', '', 'g'));
+  s TEXT;
+BEGIN
+  IF raw IS NULL OR raw = '' THEN
+    RETURN NULL;
+  END IF;
+  FOR s IN SELECT suffix FROM city_fix_suffix ORDER BY position LOOP
+    IF strpos(c, s) > 0 THEN
+      c := regexp_replace(replace(c, s, ''), '^\s+|\s+$', '', 'g');
+    END IF;
+  END LOOP;
+  c := coalesce((SELECT a.city FROM city_fix_alias a WHERE a.alias = c), c);
+  RETURN nullif(c, '');
+END $$;
+
+-- is_valid_city(): normalizes its argument again before the lookup
+CREATE OR REPLACE FUNCTION city_fix_is_valid(city TEXT)
+RETURNS BOOLEAN
+LANGUAGE sql STABLE PARALLEL SAFE AS $$
+  SELECT EXISTS (SELECT 1 FROM city_fix_valid v WHERE v.name = city_fix_normalize(city))
+$$;
+
+-- is_likely_unit_or_address()
+CREATE OR REPLACE FUNCTION city_fix_is_unit_or_address(city TEXT)
+RETURNS BOOLEAN
+LANGUAGE sql STABLE PARALLEL SAFE AS $$
+  SELECT coalesce(city, '') <> ''
+     AND city_fix_upper(regexp_replace(city, '^\s+|\s+$', '', 'g')) ~ (
+           '\y(UNIT|SUITE|APT|APARTMENT|STREET|ROAD|AVENUE|BOULEVARD|BLVD|DRIVE|LANE|COURT'
+           '|CRESCENT|CRES|PLACE|TRAIL|WAY|CIRCLE|PKWY|PARKWAY|HWY|HIGHWAY)\y'
+           '|#[0-9]|^[0-9]'
+         )
+$$;
+
+-- extract_city_from_canonical()
+CREATE OR REPLACE FUNCTION city_fix_from_canonical(canonical TEXT)
+RETURNS TEXT
+LANGUAGE plpgsql STABLE PARALLEL SAFE AS $$
+DECLARE
+  parts TEXT[];
+  n INT;
+  i INT;
+BEGIN
+  IF canonical IS NULL OR canonical = '' THEN
+    RETURN NULL;
+  END IF;
+
+  SELECT array_agg(regexp_replace(p, '^\s+|\s+$', '', 'g') ORDER BY ord)
+    INTO parts
+    FROM unnest(string_to_array(canonical, ',')) WITH ORDINALITY AS t(p, ord);
+  n := array_length(parts, 1);
+
+  IF n < 3 THEN
+    RETURN NULL;
+  END IF;
+
+  -- "STREET, CITY, ON, COUNTRY": city is the part before the province
+  IF city_fix_upper(parts[n - 1]) IN ('ON', 'ONTARIO') AND n > 3
+     AND city_fix_is_valid(parts[n - 2]) THEN
+    RETURN city_fix_normalize(parts[n - 2]);
+  END IF;
+
+  -- "STREET, CITY, COUNTRY"
+  IF city_fix_is_valid(parts[n - 1]) THEN
+    RETURN city_fix_normalize(parts[n - 1]);
+  END IF;
+
+  -- Any valid city after the street part
+  FOR i IN 2..n LOOP
+    IF city_fix_is_valid(parts[i]) THEN
+      RETURN city_fix_normalize(parts[i]);
+    END IF;
+  END LOOP;
+
+  RETURN NULL;
+END $$;
+
+-- parse_and_validate_city() (address/province are unused by the Python rules)
+CREATE OR REPLACE FUNCTION fix_city(city_raw TEXT, canonical TEXT)
+RETURNS TEXT
+LANGUAGE plpgsql STABLE PARALLEL SAFE AS $$
+DECLARE
+  normalized TEXT;
+BEGIN
+  IF city_fix_is_unit_or_address(city_raw) THEN
+    RETURN city_fix_from_canonical(canonical);
+  END IF;
+
+  normalized := city_fix_normalize(city_raw);
+  IF normalized IS NOT NULL AND city_fix_is_valid(normalized) THEN
+    RETURN normalized;
+  END IF;
+
+  RETURN city_fix_from_canonical(canonical);
+END $$;
+
+-- hash_address_raw(): sha256 over the normalize_raw_address() string
+CREATE OR REPLACE FUNCTION hash_address_raw(address TEXT, city TEXT)
+RETURNS TEXT
+LANGUAGE sql STABLE PARALLEL SAFE AS $$
+  SELECT encode(sha256(convert_to(
+    btrim(regexp_replace(
+      regexp_replace(city_fix_upper(concat_ws(' ', nullif(address, ''), nullif(city, ''))), '[^A-Z0-9 ]+', ' ', 'g'),
+      ' +', ' ', 'g'
+    )),
+    'UTF8'
+  )), 'hex')
+$$;
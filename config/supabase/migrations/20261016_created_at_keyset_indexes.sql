@@ -0,0 +1,8 @@
+-- Keyset indexes for the geocoding loaders' --after resume point: each run
+-- walks (created_at, id) from where the previous one stopped instead of
+-- sorting the whole table
+CREATE INDEX IF NOT EXISTS idx_transactions_created_id
+  ON transactions (created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_address_expansion_created_id
+  ON transaction_address_expansion_parse (created_at, id);
@@ -0,0 +1,8 @@
+-- Persistent Google geocode results keyed by normalized input address
+-- (common.geocode_store.cache_key), so the geocoding scripts only call
+-- Google for addresses no earlier run has resolved
+CREATE TABLE IF NOT EXISTS geocode_cache (
+  normalized_input TEXT PRIMARY KEY,
+  result JSONB NOT NULL,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
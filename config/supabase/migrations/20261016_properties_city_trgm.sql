@@ -0,0 +1,7 @@
+-- Enable trigram search if not present
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Trigram index on properties.city so substring / regex probes used by the
+-- city audits (ILIKE '%unit%', city ~* '...') can use an index instead of
+-- scanning the whole table
+CREATE INDEX IF NOT EXISTS trgm_properties_city ON properties USING GIN (city gin_trgm_ops);
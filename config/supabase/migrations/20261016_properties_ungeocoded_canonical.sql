@@ -0,0 +1,6 @@
+-- Partial index for standardize_properties Phase B: finding ungeocoded
+-- canonicals and joining the staged geocodes back on address_canonical
+-- only ever touches rows that still have no latitude
+CREATE INDEX IF NOT EXISTS idx_properties_canonical_ungeocoded
+  ON properties (address_canonical)
+  WHERE latitude IS NULL;
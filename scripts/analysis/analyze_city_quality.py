@@ -5,10 +5,12 @@ City Data Quality Analysis
 Analyzes the quality of city data to identify normalization issues.
 """
 
+import heapq
 import os
+import sys
+from collections import defaultdict
 from supabase import create_client, Client
 from dotenv import load_dotenv
-from collections import Counter
 import re
 
 load_dotenv()
@@ -18,19 +20,30 @@ SUPABASE_KEY = os.getenv('SUPABASE_SERVICE_KEY') or os.getenv('SUPABASE_ANON_KEY
 
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+# Precompiled city checks. UNIT/DIGITS run on the pre-lowered name; the postal
+# code pattern is case-sensitive and runs on the raw city.
+UNIT_PATTERN = re.compile(r'\bunit\b|\bu\b|#\d+')
+DIGITS_PATTERN = re.compile(r'\d{3,}')
+POSTAL_CODE_PATTERN = re.compile(r'[A-Z]\d[A-Z]\s*\d[A-Z]\d')
+PARENTHESES_PATTERN = re.compile(r'\s*\([^)]*\)')
+
 def analyze_city_quality():
     """Analyze city data quality issues"""
     print("\n" + "="*80)
     print("CITY DATA QUALITY ANALYSIS")
     print("="*80)
 
-    # Get all unique cities from properties
-    result = supabase.table('properties').select('city').eq('province', 'ON').limit(20000).execute()
+    # Get per-city property counts (aggregated server-side, ordered by count desc)
+    result = supabase.rpc('city_counts', {'province': 'ON'}).execute()
+
+    cities_with_counts = [(row['city'], row['count']) for row in result.data]
+    city_counts = dict(cities_with_counts)
 
-    cities = [prop['city'] for prop in result.data if prop.get('city')]
+    print(f"\nTotal properties analyzed: {sum(city_counts.values())}")
+    print(f"Unique city values: {len(city_counts)}")
 
-    print(f"\nTotal properties analyzed: {len(cities)}")
-    print(f"Unique city values: {len(set(cities))}")
+    # Lowercase each distinct city once and reuse it for every check
+    unique_cities = [(city, sys.intern(city.lower())) for city in city_counts]
 
     # Identify issues
     issues = {
@@ -47,22 +60,17 @@ def analyze_city_quality():
                        'drive', 'dr', 'lane', 'ln', 'way', 'court', 'ct', 'place', 'pl',
                        'crescent', 'cres', 'circle', 'terrace']
 
-    for city in set(cities):
-        if not city:
-            continue
-
-        city_lower = city.lower()
-
+    for city, city_lower in unique_cities:
         # Check for parentheses (sub-municipalities)
         if '(' in city or ')' in city:
             issues['has_parentheses'].append(city)
 
         # Check for unit numbers
-        if re.search(r'\bunit\b|\bu\b|#\d+', city_lower):
+        if UNIT_PATTERN.search(city_lower):
             issues['has_unit_number'].append(city)
 
         # Check for excessive digits (might be street number or postal code)
-        if re.search(r'\d{3,}', city):
+        if DIGITS_PATTERN.search(city_lower):
             issues['has_digits'].append(city)
 
         # Check for street keywords
@@ -78,7 +86,7 @@ def analyze_city_quality():
             issues['has_comma'].append(city)
 
         # Check for postal code pattern
-        if re.search(r'[A-Z]\d[A-Z]\s*\d[A-Z]\d', city):
+        if POSTAL_CODE_PATTERN.search(city):
             issues['has_postal_code'].append(city)
 
     # Print results
@@ -99,32 +107,26 @@ def analyze_city_quality():
     print("="*80)
 
     # Find cities with parentheses and their base names
-    city_groups = {}
-    for city in set(cities):
-        if not city:
-            continue
+    city_groups = defaultdict(list)
+    for city, _ in unique_cities:
         # Extract base name (remove parentheses content)
-        base_name = re.sub(r'\s*\([^)]*\)', '', city).strip()
-        if base_name not in city_groups:
-            city_groups[base_name] = []
+        base_name = PARENTHESES_PATTERN.sub('', city).strip()
         city_groups[base_name].append(city)
 
     # Show groups with multiple variations
     duplicates = {k: v for k, v in city_groups.items() if len(v) > 1}
     print(f"\nFound {len(duplicates)} cities with multiple variations")
     print("\nTop duplicate groups:")
-    for base_name, variations in sorted(duplicates.items(), key=lambda x: len(x[1]), reverse=True)[:10]:
+    for base_name, variations in heapq.nlargest(10, duplicates.items(), key=lambda x: len(x[1])):
         print(f"\n  {base_name} ({len(variations)} variations):")
         for var in sorted(variations):
-            count = cities.count(var)
-            print(f"    - {var} ({count} properties)")
+            print(f"    - {var} ({city_counts[var]} properties)")
 
     # Most common cities
     print("\n" + "="*80)
     print("MOST COMMON CITIES (TOP 20)")
     print("="*80)
-    city_counts = Counter(cities)
-    for city, count in city_counts.most_common(20):
+    for city, count in cities_with_counts[:20]:
         print(f"  {city}: {count} properties")
 
     return issues, duplicates
@@ -150,16 +152,14 @@ def sample_bad_addresses():
     # Get properties with digits in city
     result = supabase.table('properties').select(
         'id, address_line1, city, province, postal_code, address_canonical'
-    ).eq('province', 'ON').or_('city.like.%0%,city.like.%1%,city.like.%2%,city.like.%3%').limit(5).execute()
+    ).eq('province', 'ON').filter('city', 'match', '[0-9]').limit(5).execute()
 
     print("\n\nProperties with digits in city field (sample):")
-    for prop in result.data[:5]:
-        city = prop.get('city', '')
-        if re.search(r'\d', city):
-            print(f"\n  ID: {prop['id']}")
-            print(f"  Address Line 1: {prop.get('address_line1')}")
-            print(f"  City: {city}")
-            print(f"  Canonical: {prop.get('address_canonical')}")
+    for prop in result.data:
+        print(f"\n  ID: {prop['id']}")
+        print(f"  Address Line 1: {prop.get('address_line1')}")
+        print(f"  City: {prop.get('city')}")
+        print(f"  Canonical: {prop.get('address_canonical')}")
 
 def main():
     issues, duplicates = analyze_city_quality()
@@ -4,51 +4,68 @@ Export city mismatch data for manual review
 import os
 import sys
 import psycopg2
-import csv
 
 sys.path.insert(0, '/Users/brandonolsen23/Development/cleo-project-REBOOT')
 
+OUTPUT_CSV = '/tmp/unresolved_city_mismatches.csv'
+
+MISMATCH_FROM = """
+        FROM google_geocoded_addresses g
+        JOIN transaction_address_expansion_parse p ON p.id = g.source_id
+        WHERE g.source_table = 'transaction_address_expansion_parse'
+            AND p.original_city_raw IS NOT NULL
+            AND p.original_city_raw != g.google_city
+            AND (g.is_amalgamation_match = FALSE OR g.is_amalgamation_match IS NULL)
+        ORDER BY p.original_city_raw, g.google_city
+"""
+
+
 def export_city_mismatches():
     conn = psycopg2.connect(os.environ['DATABASE_URL'])
     cur = conn.cursor()
 
-    cur.execute("""
+    # Console preview: first 50 rows plus the full match count
+    cur.execute(f"""
         SELECT
             p.original_address_raw,
-            p.expanded_full_address,
             p.original_city_raw as original_city,
             g.google_city as geocoded_city,
             g.google_formatted_address,
-            g.google_postal_code
-        FROM google_geocoded_addresses g
-        JOIN transaction_address_expansion_parse p ON p.id = g.source_id
-        WHERE g.source_table = 'transaction_address_expansion_parse'
-            AND p.original_city_raw IS NOT NULL
-            AND p.original_city_raw != g.google_city
-            AND (g.is_amalgamation_match = FALSE OR g.is_amalgamation_match IS NULL)
-        ORDER BY p.original_city_raw, g.google_city
+            COUNT(*) OVER () as total
+        {MISMATCH_FROM}
+        LIMIT 50
     """)
 
     rows = cur.fetchall()
+    total = rows[0][4] if rows else 0
 
-    # Print to console
-    print(f"CITY MISMATCH REVIEW - {len(rows)} addresses")
+    print(f"CITY MISMATCH REVIEW - {total} addresses (showing first {len(rows)})")
     print("=" * 150)
     print(f"{'Original City':<20} {'Geocoded City':<20} {'Original Address':<40} {'Geocoded Address':<50}")
     print("-" * 150)
 
-    for row in rows:
-        orig_addr, expanded, orig_city, geo_city, formatted, postal = row
-        print(f"{orig_city:<20} {geo_city:<20} {orig_addr:<40} {formatted[:48] if formatted else 'N/A':<50}")
+    sys.stdout.write(''.join(
+        f"{orig_city:<20} {geo_city:<20} {orig_addr:<40} {formatted[:48] if formatted else 'N/A':<50}\n"
+        for (orig_addr, orig_city, geo_city, formatted, _) in rows
+    ))
 
-    # Also save to CSV
-    with open('/tmp/unresolved_city_mismatches.csv', 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(['Original Address', 'Expanded Address', 'Original City', 'Geocoded City', 'Google Formatted Address', 'Postal Code'])
-        writer.writerows(rows)
+    # Stream the full result straight into the CSV
+    with open(OUTPUT_CSV, 'wb') as f:
+        cur.copy_expert(f"""
+            COPY (
+                SELECT
+                    p.original_address_raw as "Original Address",
+                    p.expanded_full_address as "Expanded Address",
+                    p.original_city_raw as "Original City",
+                    g.google_city as "Geocoded City",
+                    g.google_formatted_address as "Google Formatted Address",
+                    g.google_postal_code as "Postal Code"
+                {MISMATCH_FROM}
+            ) TO STDOUT WITH CSV HEADER
+        """, f)
 
     print()
-    print(f"Data also saved to: /tmp/unresolved_city_mismatches.csv")
+    print(f"Full data saved to: {OUTPUT_CSV}")
 
     cur.close()
     conn.close()
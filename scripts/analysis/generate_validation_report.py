@@ -25,6 +25,7 @@ from datetime import datetime
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../..'))
 
 from common.db import connect_with_retries
+from common.report_utils import pct
 
 
 def generate_validation_report(output_file: str = None, limit: int = None):
@@ -48,10 +49,10 @@ def generate_validation_report(output_file: str = None, limit: int = None):
     cursor = conn.cursor()
 
     try:
-        # Fetch completed validations with property data
-        limit_clause = f"LIMIT {limit}" if limit else ""
+        # Fetch completed validations with property data (LIMIT NULL = all)
+        limit = limit or None
 
-        cursor.execute(f"""
+        cursor.execute("""
             SELECT
                 -- Property data
                 p.id,
@@ -79,8 +80,8 @@ def generate_validation_report(output_file: str = None, limit: int = None):
             JOIN properties p ON q.property_id = p.id
             WHERE q.status = 'completed'
             ORDER BY q.completed_at DESC
-            {limit_clause}
-        """)
+            LIMIT %s
+        """, (limit,))
 
         rows = cursor.fetchall()
 
@@ -155,34 +156,58 @@ def generate_validation_report(output_file: str = None, limit: int = None):
         print("📈 SUMMARY STATISTICS")
         print("-" * 70)
 
-        # New column positions: (prop_id, address, city_before, postal_before, nar_city, nar_postal, confidence, nar_found, city_final, postal_final, lat, lon, geo_updated, completed_at)
-        found_count = sum(1 for r in rows if r[7])  # nar_found
-        high_conf = sum(1 for r in rows if r[6] and r[6] >= 90)  # confidence >= 90
-        city_updated = sum(1 for r in rows if r[2] != r[8])  # city_before != city_final
-        postal_updated = sum(1 for r in rows if r[3] != r[9] and r[9])  # postal updated
-        geo_updated = sum(1 for r in rows if r[12])  # geocoding_updated
-
-        print(f"  Total validations:     {len(rows):>6,}")
-        print(f"  Found in NAR:          {found_count:>6,} ({found_count/len(rows)*100:5.1f}%)")
-        print(f"  High confidence (≥90): {high_conf:>6,} ({high_conf/len(rows)*100:5.1f}%)")
-        print(f"  City updated:          {city_updated:>6,} ({city_updated/len(rows)*100:5.1f}%)")
-        print(f"  Postal code updated:   {postal_updated:>6,} ({postal_updated/len(rows)*100:5.1f}%)")
-        print(f"  Geocoding updated:     {geo_updated:>6,} ({geo_updated/len(rows)*100:5.1f}%)")
+        # Aggregate over the same (optionally limited) set of rows server-side
+        cursor.execute("""
+            SELECT
+                COUNT(*) AS total,
+                COUNT(*) FILTER (WHERE nar_found) AS found,
+                COUNT(*) FILTER (WHERE confidence_score >= 90) AS high_conf,
+                COUNT(*) FILTER (WHERE city_before IS DISTINCT FROM city_final) AS city_updated,
+                COUNT(*) FILTER (
+                    WHERE postal_code_before IS DISTINCT FROM postal_final
+                      AND COALESCE(postal_final, '') <> ''
+                ) AS postal_updated,
+                COUNT(*) FILTER (WHERE geocoding_updated) AS geo_updated,
+                COUNT(*) FILTER (WHERE confidence_score = 100) AS conf_100,
+                COUNT(*) FILTER (WHERE confidence_score = 90) AS conf_90,
+                COUNT(*) FILTER (WHERE confidence_score = 70) AS conf_70,
+                COUNT(*) FILTER (WHERE confidence_score = 0) AS conf_0
+            FROM (
+                SELECT
+                    q.nar_found,
+                    q.confidence_score,
+                    q.city_before,
+                    q.postal_code_before,
+                    q.geocoding_updated,
+                    p.city AS city_final,
+                    p.postal_code AS postal_final
+                FROM nar_validation_queue q
+                JOIN properties p ON q.property_id = p.id
+                WHERE q.status = 'completed'
+                ORDER BY q.completed_at DESC
+                LIMIT %s
+            ) r
+        """, (limit,))
+
+        (total, found_count, high_conf, city_updated, postal_updated, geo_updated,
+         conf_100, conf_90, conf_70, conf_0) = cursor.fetchone()
+
+        print(f"  Total validations:     {total:>6,}")
+        print(f"  Found in NAR:          {found_count:>6,} ({pct(found_count, total):6.1%})")
+        print(f"  High confidence (≥90): {high_conf:>6,} ({pct(high_conf, total):6.1%})")
+        print(f"  City updated:          {city_updated:>6,} ({pct(city_updated, total):6.1%})")
+        print(f"  Postal code updated:   {postal_updated:>6,} ({pct(postal_updated, total):6.1%})")
+        print(f"  Geocoding updated:     {geo_updated:>6,} ({pct(geo_updated, total):6.1%})")
         print()
 
         # Confidence distribution
         print("📊 CONFIDENCE DISTRIBUTION")
         print("-" * 70)
 
-        conf_100 = sum(1 for r in rows if r[6] == 100)
-        conf_90 = sum(1 for r in rows if r[6] == 90)
-        conf_70 = sum(1 for r in rows if r[6] == 70)
-        conf_0 = sum(1 for r in rows if r[6] == 0)
-
-        print(f"  100 (Postal + Address): {conf_100:>6,} ({conf_100/len(rows)*100:5.1f}%)")
-        print(f"   90 (City + Address):   {conf_90:>6,} ({conf_90/len(rows)*100:5.1f}%)")
-        print(f"   70 (Fuzzy):            {conf_70:>6,} ({conf_70/len(rows)*100:5.1f}%)")
-        print(f"    0 (Not found):        {conf_0:>6,} ({conf_0/len(rows)*100:5.1f}%)")
+        print(f"  100 (Postal + Address): {conf_100:>6,} ({pct(conf_100, total):6.1%})")
+        print(f"   90 (City + Address):   {conf_90:>6,} ({pct(conf_90, total):6.1%})")
+        print(f"   70 (Fuzzy):            {conf_70:>6,} ({pct(conf_70, total):6.1%})")
+        print(f"    0 (Not found):        {conf_0:>6,} ({pct(conf_0, total):6.1%})")
         print()
 
     finally:
@@ -8,7 +8,6 @@ import os
 import sys
 
 import psycopg2
-from psycopg2.extras import RealDictCursor
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../..'))
 
@@ -16,11 +15,17 @@ from common.db import connect_with_service_role
 from common.ontario_cities import is_valid_city, is_likely_unit_or_address
 
 
+def format_city_row(city: str, count: int) -> str:
+    is_valid = "✅ YES" if is_valid_city(city) else "❌ NO"
+    is_issue = "⚠️ UNIT/ADDR" if is_likely_unit_or_address(city) else ""
+    return f"{city:<40} {count:<10} {is_valid:<10} {is_issue}\n"
+
+
 def main():
     conn = connect_with_service_role()
 
     with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        with conn.cursor() as cur:
             # Get all unique cities with counts
             cur.execute("""
                 SELECT
@@ -41,13 +46,7 @@ def main():
     print(f"{'City Name':<40} {'Count':<10} {'Valid?':<10} {'Issue?'}")
     print("=" * 80)
 
-    for city_row in cities[:100]:  # Top 100
-        city = city_row['city']
-        count = city_row['count']
-        is_valid = "✅ YES" if is_valid_city(city) else "❌ NO"
-        is_issue = "⚠️ UNIT/ADDR" if is_likely_unit_or_address(city) else ""
-
-        print(f"{city:<40} {count:<10} {is_valid:<10} {is_issue}")
+    sys.stdout.write(''.join(format_city_row(city, count) for city, count in cities[:100]))  # Top 100
 
 
 if __name__ == "__main__":
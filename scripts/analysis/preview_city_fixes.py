@@ -7,20 +7,22 @@ Outputs results to JSON file for review.
 Date: 2025-10-03
 """
 
-import json
+import heapq
 import os
 import sys
 from collections import defaultdict
+from multiprocessing import Pool
 from typing import Dict, List, Optional
 
+import orjson
 import psycopg2
-from psycopg2.extras import RealDictCursor
 
 # Add parent directory to path for imports
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../..'))
 
 from common.address_parser import parse_and_validate_city
 from common.db import connect_with_service_role
+from common.report_utils import pct
 from common.ontario_cities import (
     is_likely_unit_or_address,
     is_valid_city,
@@ -28,6 +30,17 @@ from common.ontario_cities import (
 )
 
 
+def _parse_worker(candidate: tuple) -> Optional[str]:
+    """Pool worker: run parse_and_validate_city for one candidate row."""
+    _, address_line1, city, province, canonical, _ = candidate
+    return parse_and_validate_city(
+        address=address_line1 or "",
+        city_raw=city or "",
+        province=province or "ON",
+        canonical=canonical
+    )
+
+
 def analyze_properties(cur) -> Dict:
     """Analyze properties table and preview fixes."""
 
@@ -44,8 +57,7 @@ def analyze_properties(cur) -> Dict:
         ORDER BY id
     """)
 
-    properties = cur.fetchall()
-    total_count = len(properties)
+    total_count = cur.rowcount
     print(f"✅ Loaded {total_count:,} properties\n")
 
     # Analysis results
@@ -63,14 +75,9 @@ def analyze_properties(cur) -> Dict:
 
     print("Analyzing city data quality...\n")
 
-    for i, prop in enumerate(properties):
-        if i % 1000 == 0 and i > 0:
-            print(f"  Progress: {i:,} / {total_count:,} ({i/total_count*100:.1f}%)")
-
-        prop_id = prop['id']
-        city = prop['city']
-        canonical = prop['address_canonical']
-
+    # Pass 1: classify rows; only invalid cities need the (expensive) parser
+    candidates = []
+    for prop_id, address_line1, city, city_backup, canonical, province in cur:
         # Check if city is valid
         if is_valid_city(city):
             results["already_valid"] += 1
@@ -93,43 +100,48 @@ def analyze_properties(cur) -> Dict:
             results["issue_types"]["other"] += 1
             issue_type = "other"
 
-        # Try to fix
-        fixed_city = parse_and_validate_city(
-            address=prop['address_line1'] or "",
-            city_raw=city or "",
-            province=prop['province'] or "ON",
-            canonical=canonical
-        )
-
-        if fixed_city:
-            results["would_fix"] += 1
-
-            # Track the change
-            change_key = f"{city} → {fixed_city}"
-            results["city_changes"][change_key].append(prop_id)
-
-            # Add to sample fixes (first 20)
-            if len(results["sample_fixes"]) < 20:
-                results["sample_fixes"].append({
-                    "property_id": prop_id,
-                    "address": prop['address_line1'],
-                    "current_city": city,
-                    "fixed_city": fixed_city,
-                    "canonical": canonical,
-                    "issue_type": issue_type
-                })
-        else:
-            results["no_fix_available"] += 1
-
-            # Add to unfixable samples (first 20)
-            if len(results["unfixable_samples"]) < 20:
-                results["unfixable_samples"].append({
-                    "property_id": prop_id,
-                    "address": prop['address_line1'],
-                    "current_city": city,
-                    "canonical": canonical,
-                    "issue_type": issue_type
-                })
+        candidates.append((prop_id, address_line1, city, province, canonical, issue_type))
+
+    # Pass 2: try to fix each candidate across all cores
+    issue_count = len(candidates)
+    with Pool(processes=os.cpu_count()) as pool:
+        fixes = pool.imap(_parse_worker, candidates, chunksize=500)
+
+        for i, (candidate, fixed_city) in enumerate(zip(candidates, fixes)):
+            if i % 1000 == 0 and i > 0:
+                print(f"  Progress: {i:,} / {issue_count:,} ({pct(i, issue_count):.1%})")
+
+            prop_id, address_line1, city, _, canonical, issue_type = candidate
+
+            if fixed_city:
+                results["would_fix"] += 1
+
+                # Track the change
+                change_key = f"{city} → {fixed_city}"
+                results["city_changes"][change_key].append(prop_id)
+
+                # Add to sample fixes (first 20)
+                if len(results["sample_fixes"]) < 20:
+                    results["sample_fixes"].append({
+                        "property_id": prop_id,
+                        "address": address_line1,
+                        "current_city": city,
+                        "fixed_city": fixed_city,
+                        "canonical": canonical,
+                        "issue_type": issue_type
+                    })
+            else:
+                results["no_fix_available"] += 1
+
+                # Add to unfixable samples (first 20)
+                if len(results["unfixable_samples"]) < 20:
+                    results["unfixable_samples"].append({
+                        "property_id": prop_id,
+                        "address": address_line1,
+                        "current_city": city,
+                        "canonical": canonical,
+                        "issue_type": issue_type
+                    })
 
     print(f"\n✅ Analysis complete!\n")
 
@@ -146,13 +158,13 @@ def print_summary(results: Dict):
 
     print(f"📊 Overall Stats:")
     print(f"   Total properties:     {results['total_properties']:,}")
-    print(f"   Already valid:        {results['already_valid']:,} ({results['already_valid']/results['total_properties']*100:.1f}%)")
-    print(f"   Issues found:         {results['issues_found']:,} ({results['issues_found']/results['total_properties']*100:.1f}%)")
+    print(f"   Already valid:        {results['already_valid']:,} ({pct(results['already_valid'], results['total_properties']):.1%})")
+    print(f"   Issues found:         {results['issues_found']:,} ({pct(results['issues_found'], results['total_properties']):.1%})")
     print()
 
     print(f"🔧 Fix Analysis:")
-    print(f"   Would fix:            {results['would_fix']:,} ({results['would_fix']/results['issues_found']*100:.1f}% of issues)")
-    print(f"   No fix available:     {results['no_fix_available']:,} ({results['no_fix_available']/results['issues_found']*100:.1f}% of issues)")
+    print(f"   Would fix:            {results['would_fix']:,} ({pct(results['would_fix'], results['issues_found']):.1%} of issues)")
+    print(f"   No fix available:     {results['no_fix_available']:,} ({pct(results['no_fix_available'], results['issues_found']):.1%} of issues)")
     print()
 
     print(f"🏷️  Issue Types:")
@@ -161,8 +173,8 @@ def print_summary(results: Dict):
     print()
 
     print(f"🔄 Top City Changes (showing up to 10):")
-    sorted_changes = sorted(results['city_changes'].items(), key=lambda x: len(x[1]), reverse=True)
-    for change, prop_ids in sorted_changes[:10]:
+    top_changes = heapq.nlargest(10, results['city_changes'].items(), key=lambda x: len(x[1]))
+    for change, prop_ids in top_changes:
         print(f"   {change:50s} ({len(prop_ids):,} properties)")
     print()
 
@@ -205,7 +217,7 @@ def main():
         sys.exit(1)
 
     with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        with conn.cursor() as cur:
             results = analyze_properties(cur)
 
     conn.close()
@@ -221,15 +233,15 @@ def main():
         "no_fix_available": results["no_fix_available"],
         "already_valid": results["already_valid"],
         "issue_types": dict(results["issue_types"]),
-        "city_changes": {k: v for k, v in results["city_changes"].items()},
+        "city_changes": dict(results["city_changes"]),
         "sample_fixes": results["sample_fixes"],
         "unfixable_samples": results["unfixable_samples"],
     }
 
     # Save to file
     output_file = "scripts/analysis/city_fix_preview.json"
-    with open(output_file, 'w') as f:
-        json.dump(results_json, f, indent=2)
+    with open(output_file, 'wb') as f:
+        f.write(orjson.dumps(results_json, default=str, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
 
     print(f"📁 Detailed results saved to: {output_file}")
     print()
@@ -5,6 +5,7 @@ Tests the 6 problematic HWY addresses with commercial POI detection
 import os
 import sys
 import psycopg2
+from psycopg2.extras import RealDictCursor
 
 sys.path.insert(0, '/Users/brandonolsen23/Development/cleo-project-REBOOT')
 from common.address_validator import AddressValidator
@@ -14,7 +15,7 @@ def test_highway_addresses():
     """Test validation on the 6 highway addresses"""
 
     conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cur = conn.cursor()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
 
     validator = AddressValidator()
 
@@ -25,60 +26,74 @@ def test_highway_addresses():
     print("Testing Highway Address Validation")
     print("=" * 100)
 
-    # Get the 6 highway addresses that were problematic
+    # Get the 6 highway addresses that were problematic, grouped by original
+    # address server-side for range validation
     cur.execute("""
         SELECT
-            p.id,
-            p.expanded_full_address,
             p.original_address_raw,
-            p.is_multi_property,
-            p.pattern_type,
-            g.google_postal_code,
-            g.google_latitude,
-            g.google_longitude,
-            g.google_formatted_address
+            (bool_or(p.is_multi_property)
+             AND max(p.pattern_type) = 'range_dash'
+             AND count(*) = 2) as is_range,
+            json_agg(json_build_object(
+                'id', p.id,
+                'expanded_full_address', p.expanded_full_address,
+                'google_postal_code', g.google_postal_code,
+                'google_latitude', g.google_latitude,
+                'google_longitude', g.google_longitude,
+                'google_formatted_address', g.google_formatted_address
+            ) ORDER BY p.address_position) as addresses
         FROM transaction_address_expansion_parse p
         JOIN google_geocoded_addresses g ON g.source_id = p.id
         WHERE g.source_table = 'transaction_address_expansion_parse'
             AND (p.expanded_full_address LIKE '%HWY%' OR p.expanded_full_address LIKE '%HIGHWAY%')
-        ORDER BY p.original_address_raw, p.address_position
+        GROUP BY p.original_address_raw
+        ORDER BY p.original_address_raw
     """)
 
-    addresses = cur.fetchall()
-    total = len(addresses)
+    grouped = cur.fetchall()
+    total = sum(len(group['addresses']) for group in grouped)
 
     print(f"Found {total} highway addresses to validate\n")
 
-    # Group by original address for range validation
-    from collections import defaultdict
-    grouped = defaultdict(list)
-
-    for addr_data in addresses:
-        original = addr_data[2]  # original_address_raw
-        grouped[original].append(addr_data)
+    # Collect every coordinate that needs a POI check and resolve them in one batch
+    poi_points = []
+    for group in grouped:
+        addr_list = group['addresses']
+        if group['is_range']:
+            # Ranges only fall back to POIs when neither end has a postal code
+            if addr_list[0]['google_postal_code'] or addr_list[1]['google_postal_code']:
+                continue
+        poi_points.extend(
+            (addr_data['id'], addr_data['google_latitude'], addr_data['google_longitude'])
+            for addr_data in addr_list
+            if addr_data['google_latitude'] and addr_data['google_longitude']
+        )
+
+    poi_results = validator.check_commercial_activity_batch(poi_points, radius=200)
 
     validation_results = []
+    unchecked = []  # addresses whose POI lookup failed
+
+    for group in grouped:
+        original_addr = group['original_address_raw']
+        addr_list = group['addresses']
 
-    for original_addr, addr_list in grouped.items():
         print(f"\n{'='*100}")
         print(f"Original: {original_addr}")
         print(f"Expanded to {len(addr_list)} addresses")
         print(f"{'='*100}\n")
 
-        # Check if this is a multi-property range
-        is_multi = addr_list[0][3]  # is_multi_property
-        pattern = addr_list[0][4]  # pattern_type
-
-        if is_multi and pattern == 'range_dash' and len(addr_list) == 2:
+        # Multi-property range with exactly two ends (computed server-side)
+        if group['is_range']:
             # Apply range validation
             start_data = addr_list[0]
             end_data = addr_list[1]
 
-            start_addr = start_data[1]  # expanded_full_address
-            end_addr = end_data[1]
+            start_addr = start_data['expanded_full_address']
+            end_addr = end_data['expanded_full_address']
 
-            start_postal = start_data[5]
-            end_postal = end_data[5]
+            start_postal = start_data['google_postal_code']
+            end_postal = end_data['google_postal_code']
 
             print(f"  RANGE VALIDATION:")
             print(f"  Start: {start_addr}")
@@ -112,13 +127,17 @@ def test_highway_addresses():
 
                 # Check commercial activity for both
                 for i, addr_data in enumerate([start_data, end_data]):
-                    lat = addr_data[6]  # google_latitude
-                    lng = addr_data[7]  # google_longitude
-                    formatted = addr_data[8]  # google_formatted_address
+                    lat = addr_data['google_latitude']
+                    lng = addr_data['google_longitude']
+                    formatted = addr_data['google_formatted_address']
 
                     if lat and lng:
                         print(f"\n  Checking {'START' if i == 0 else 'END'}: {formatted}")
-                        poi_data = validator.check_commercial_activity(lat, lng, radius=200)
+                        poi_data = poi_results.get(addr_data['id'])
+                        if poi_data is None:
+                            print(f"    ⚠️ POI lookup failed - unchecked")
+                            unchecked.append(addr_data['expanded_full_address'])
+                            continue
                         print(f"    POIs found: {poi_data['poi_count']}")
                         print(f"    Has retail: {poi_data['has_retail']}")
                         print(f"    Confidence boost: +{poi_data['confidence_boost']}")
@@ -139,18 +158,23 @@ def test_highway_addresses():
         else:
             # Single address or non-range multi-property
             for addr_data in addr_list:
-                expanded = addr_data[1]
-                postal = addr_data[5]
-                lat = addr_data[6]
-                lng = addr_data[7]
-                formatted = addr_data[8]
+                expanded = addr_data['expanded_full_address']
+                postal = addr_data['google_postal_code']
+                lat = addr_data['google_latitude']
+                lng = addr_data['google_longitude']
+                formatted = addr_data['google_formatted_address']
 
                 print(f"  Address: {expanded}")
                 print(f"  Postal: {postal or 'NO POSTAL'}")
 
                 if lat and lng:
                     print(f"  Checking commercial activity...")
-                    poi_data = validator.check_commercial_activity(lat, lng, radius=200)
+                    poi_data = poi_results.get(addr_data['id'])
+                    if poi_data is None:
+                        # Failed lookup, not "no commercial activity"
+                        print(f"    ⚠️ POI lookup failed - unchecked")
+                        unchecked.append(expanded)
+                        continue
                     print(f"    POIs found: {poi_data['poi_count']}")
                     print(f"    Has retail: {poi_data['has_retail']}")
                     print(f"    Confidence boost: +{poi_data['confidence_boost']}")
@@ -188,15 +212,23 @@ def test_highway_addresses():
     print(f"High confidence (≥75): {len(high_confidence)}")
     print(f"Medium confidence (50-74): {len(medium_confidence)}")
     print(f"Low confidence (<50): {len(low_confidence)}")
+    print(f"Unchecked (POI lookup failed): {len(unchecked)}")
 
     if low_confidence:
         print(f"\n⚠️ LOW CONFIDENCE ADDRESSES REQUIRING REVIEW:")
         for result in low_confidence:
             print(f"  - {result.get('original', result.get('address'))}")
 
+    if unchecked:
+        print(f"\n⚠️ UNCHECKED ADDRESSES (re-run to retry the POI lookup):")
+        for address in unchecked:
+            print(f"  - {address}")
+
     cur.close()
     conn.close()
 
 
 if __name__ == "__main__":
+    # Block-buffer stdout; these reports print many lines per row
+    sys.stdout.reconfigure(line_buffering=False)
     test_highway_addresses()
@@ -13,7 +13,11 @@ from psycopg2.extras import RealDictCursor
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../..'))
 
 from common.db import connect_with_service_role
-from common.ontario_cities import is_likely_unit_or_address, is_valid_city
+from common.ontario_cities import (
+    VALID_ONTARIO_CITIES,
+    is_likely_unit_or_address,
+    is_valid_city,
+)
 
 
 def main():
@@ -26,15 +30,24 @@ def main():
     print("✅ Connected to database\n")
 
     with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        # Test 1: Count properties with unit/suite in city field
-        print("1️⃣  Checking for unit/suite indicators in city field...")
+        # Tests 1, 2, 3, 5 and 8 share one scan of properties
         cur.execute("""
-            SELECT COUNT(*) as count
+            SELECT
+                COUNT(*) FILTER (WHERE city ~* '\\b(unit|suite|#\\d+|apt|apartment)\\b') as unit_count,
+                COUNT(*) FILTER (WHERE city ~* '(street|road|avenue|blvd|boulevard|drive|lane|court)\\b') as street_count,
+                COUNT(DISTINCT city) as unique_cities,
+                COUNT(*) FILTER (WHERE city IS NULL OR city = '') as null_count,
+                COUNT(*) as total,
+                COUNT(city) as with_city,
+                COUNT(city_backup) as with_backup,
+                COUNT(*) FILTER (WHERE city != city_backup) as changed
             FROM properties
-            WHERE city ~* '\\b(unit|suite|#\\d+|apt|apartment)\\b'
         """)
-        result = cur.fetchone()
-        unit_count = result['count']
+        stats = cur.fetchone()
+
+        # Test 1: Count properties with unit/suite in city field
+        print("1️⃣  Checking for unit/suite indicators in city field...")
+        unit_count = stats['unit_count']
         if unit_count == 0:
             print(f"   ✅ PASS: No unit/suite indicators found in city field\n")
         else:
@@ -42,13 +55,7 @@ def main():
 
         # Test 2: Count properties with street indicators in city field
         print("2️⃣  Checking for street addresses in city field...")
-        cur.execute("""
-            SELECT COUNT(*) as count
-            FROM properties
-            WHERE city ~* '(street|road|avenue|blvd|boulevard|drive|lane|court)\\b'
-        """)
-        result = cur.fetchone()
-        street_count = result['count']
+        street_count = stats['street_count']
         if street_count == 0:
             print(f"   ✅ PASS: No street addresses found in city field\n")
         else:
@@ -56,13 +63,7 @@ def main():
 
         # Test 3: Check unique city count
         print("3️⃣  Counting unique city values...")
-        cur.execute("""
-            SELECT COUNT(DISTINCT city) as count
-            FROM properties
-            WHERE city IS NOT NULL
-        """)
-        result = cur.fetchone()
-        unique_cities = result['count']
+        unique_cities = stats['unique_cities']
         print(f"   📊 Unique cities: {unique_cities:,}")
         if unique_cities < 250:
             print(f"   ✅ GOOD: Reasonable number of unique cities\n")
@@ -91,28 +92,25 @@ def main():
 
         # Test 5: Check for null cities
         print("5️⃣  Checking for null/empty cities...")
-        cur.execute("""
-            SELECT COUNT(*) as count
-            FROM properties
-            WHERE city IS NULL OR city = ''
-        """)
-        result = cur.fetchone()
-        null_count = result['count']
+        null_count = stats['null_count']
         print(f"   📊 Null/empty cities: {null_count:,}\n")
 
         # Test 6: Sample invalid cities
         print("6️⃣  Sampling invalid cities (showing up to 20)...")
+        # Drop exact reference-list matches server-side (always valid); only the
+        # remainder needs the full normalize/regex checks in Python
         cur.execute("""
-            SELECT DISTINCT city, COUNT(*) as count
+            SELECT city, COUNT(*) as count
             FROM properties
             WHERE city IS NOT NULL
+              AND NOT (upper(trim(city)) = ANY(%s))
             GROUP BY city
             ORDER BY count DESC
-        """)
-        all_cities = cur.fetchall()
+        """, (sorted(VALID_ONTARIO_CITIES),))
+        candidate_cities = cur.fetchall()
 
         invalid_cities = []
-        for city_row in all_cities:
+        for city_row in candidate_cities:
             city = city_row['city']
             if not is_valid_city(city) and not is_likely_unit_or_address(city):
                 invalid_cities.append(city_row)
@@ -151,16 +149,6 @@ def main():
 
         # Test 8: Final summary stats
         print("8️⃣  Summary Statistics...")
-        cur.execute("""
-            SELECT
-                COUNT(*) as total,
-                COUNT(city) as with_city,
-                COUNT(city_backup) as with_backup,
-                COUNT(*) FILTER (WHERE city != city_backup) as changed
-            FROM properties
-        """)
-        stats = cur.fetchone()
-
         print(f"   Total properties:     {stats['total']:,}")
         print(f"   With city:            {stats['with_city']:,} ({stats['with_city']/stats['total']*100:.1f}%)")
         print(f"   With backup:          {stats['with_backup']:,}")
@@ -188,4 +176,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # Block-buffer stdout; these reports print many lines per row
+    sys.stdout.reconfigure(line_buffering=False)
     main()
@@ -2,6 +2,7 @@
 Validate geocoded addresses without requiring Places API
 Uses postal codes, duplicate coordinates, and formatted address analysis
 """
+import itertools
 import os
 import sys
 import psycopg2
@@ -13,109 +14,101 @@ def validate_geocoded_addresses():
     """Validate all geocoded addresses and assign confidence scores"""
 
     conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cur = conn.cursor()
+
+    # Server-side cursor: stream rows instead of materializing the whole join
+    cur = conn.cursor(name='geo_val_stream')
+    cur.itersize = 2000
 
     print("Validating Geocoded Addresses")
     print("=" * 100)
 
-    # Get all geocoded addresses from expansion table
+    # Get all geocoded addresses from expansion table, with confidence and the
+    # range duplicate-coordinate check computed server-side
     cur.execute("""
+        WITH geo AS (
+            SELECT
+                p.original_address_raw,
+                p.expanded_full_address,
+                p.address_position,
+                g.google_formatted_address,
+                g.google_postal_code,
+                g.google_latitude,
+                g.google_longitude,
+                COUNT(*) OVER w as group_size,
+                first_value(p.is_multi_property) OVER w as group_is_multi,
+                first_value(p.pattern_type) OVER w as group_pattern,
+                -- First vs last end; NULL coords count as equal, as in the Python check
+                (first_value(g.google_latitude) OVER w IS NOT DISTINCT FROM last_value(g.google_latitude) OVER w
+                 AND first_value(g.google_longitude) OVER w IS NOT DISTINCT FROM last_value(g.google_longitude) OVER w
+                ) as same_coords,
+                -- Formatted address with a digit before the first comma has a street number
+                COALESCE(g.google_formatted_address ~ '^[^,]*[0-9][^,]*,', FALSE) as has_street_num
+            FROM transaction_address_expansion_parse p
+            JOIN google_geocoded_addresses g ON g.source_id = p.id
+            WHERE g.source_table = 'transaction_address_expansion_parse'
+            WINDOW w AS (
+                PARTITION BY p.original_address_raw
+                ORDER BY p.address_position
+                ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+            )
+        )
         SELECT
-            p.id,
-            p.expanded_full_address,
-            p.original_address_raw,
-            p.is_multi_property,
-            p.pattern_type,
-            p.address_position,
-            g.google_formatted_address,
-            g.google_postal_code,
-            g.google_latitude,
-            g.google_longitude,
-            g.google_confidence
-        FROM transaction_address_expansion_parse p
-        JOIN google_geocoded_addresses g ON g.source_id = p.id
-        WHERE g.source_table = 'transaction_address_expansion_parse'
-        ORDER BY p.original_address_raw, p.address_position
+            original_address_raw,
+            expanded_full_address,
+            google_formatted_address,
+            google_postal_code,
+            google_latitude,
+            google_longitude,
+            -- Range whose two ends geocoded to the same point = Google guessing
+            COALESCE(group_is_multi AND group_pattern = 'range_dash'
+                     AND group_size = 2 AND same_coords, FALSE) as dup_coords,
+            CASE
+                WHEN google_postal_code IS NOT NULL AND google_postal_code <> '' AND has_street_num THEN 'HIGH'
+                WHEN google_postal_code IS NOT NULL AND google_postal_code <> '' THEN 'MEDIUM'
+                WHEN has_street_num THEN 'MEDIUM'
+                ELSE 'LOW'
+            END as confidence
+        FROM geo
+        ORDER BY original_address_raw, address_position
     """)
 
-    addresses = cur.fetchall()
-    total = len(addresses)
+    total = 0
+    high_conf = 0
+    medium_conf = 0
+    low_conf = []
 
-    print(f"Found {total} geocoded addresses to validate\n")
+    # Rows arrive ordered by original_address_raw, so each group is contiguous
+    for original_addr, group in itertools.groupby(cur, key=lambda r: r[0]):
+        addr_list = list(group)
+        total += len(addr_list)
 
-    # Group by original address
-    from collections import defaultdict
-    grouped = defaultdict(list)
-    for addr_data in addresses:
-        original = addr_data[2]  # original_address_raw
-        grouped[original].append(addr_data)
+        if addr_list[0][6]:  # dup_coords
+            print(f"⚠️ DUPLICATE COORDS: {original_addr}")
+            print(f"   Both addresses geocoded to same point: {addr_list[0][4]}, {addr_list[0][5]}")
+            print(f"   Google is guessing - LOW CONFIDENCE\n")
+            low_conf.extend(addr_list)
+            continue
 
-    high_conf = []
-    medium_conf = []
-    low_conf = []
-    failed = []
-
-    for original_addr, addr_list in grouped.items():
-        is_multi = addr_list[0][3]
-        pattern = addr_list[0][4]
-
-        # Check for range addresses with duplicate coordinates
-        if is_multi and pattern == 'range_dash' and len(addr_list) == 2:
-            start_data = addr_list[0]
-            end_data = addr_list[1]
-
-            start_lat = start_data[8]
-            start_lng = start_data[9]
-            end_lat = end_data[8]
-            end_lng = end_data[9]
-
-            # Duplicate coordinates = Google guessing
-            if start_lat == end_lat and start_lng == end_lng:
-                print(f"⚠️ DUPLICATE COORDS: {original_addr}")
-                print(f"   Both addresses geocoded to same point: {start_lat}, {start_lng}")
-                print(f"   Google is guessing - LOW CONFIDENCE\n")
-                low_conf.extend(addr_list)
-                continue
-
-        # Validate each address individually
         for addr_data in addr_list:
-            parsed_id = addr_data[0]
-            expanded = addr_data[1]
-            formatted = addr_data[6]
-            postal = addr_data[7]
-            google_conf = addr_data[10]
-
-            # Confidence scoring
-            if postal:
-                # Has postal code
-                if ',' in formatted and any(char.isdigit() for char in formatted.split(',')[0]):
-                    # Formatted address has street number
-                    confidence = 'HIGH'
-                    high_conf.append(addr_data)
-                else:
-                    # Has postal but formatted address is vague
-                    confidence = 'MEDIUM'
-                    medium_conf.append(addr_data)
+            confidence = addr_data[7]
+            if confidence == 'HIGH':
+                high_conf += 1
+            elif confidence == 'MEDIUM':
+                medium_conf += 1
             else:
-                # No postal code
-                if formatted and ',' in formatted and any(char.isdigit() for char in formatted.split(',')[0]):
-                    # No postal but has detailed formatted address
-                    confidence = 'MEDIUM'
-                    medium_conf.append(addr_data)
-                else:
-                    # No postal and vague formatted address
-                    confidence = 'LOW'
-                    low_conf.append(addr_data)
+                low_conf.append(addr_data)
 
     # Summary
+    print(f"Validated {total} geocoded addresses")
+
     print("\n" + "=" * 100)
     print("VALIDATION SUMMARY")
     print("=" * 100)
 
-    print(f"\n✓ HIGH CONFIDENCE: {len(high_conf)} addresses ({len(high_conf)*100/total:.1f}%)")
+    print(f"\n✓ HIGH CONFIDENCE: {high_conf} addresses ({high_conf*100/total:.1f}%)")
     print(f"  - Has postal code + detailed formatted address")
 
-    print(f"\n~ MEDIUM CONFIDENCE: {len(medium_conf)} addresses ({len(medium_conf)*100/total:.1f}%)")
+    print(f"\n~ MEDIUM CONFIDENCE: {medium_conf} addresses ({medium_conf*100/total:.1f}%)")
     print(f"  - Has postal code OR detailed formatted address")
 
     print(f"\n⚠️ LOW CONFIDENCE: {len(low_conf)} addresses ({len(low_conf)*100/total:.1f}%)")
@@ -127,8 +120,8 @@ def validate_geocoded_addresses():
         print("-" * 100)
         for addr_data in low_conf:
             expanded = addr_data[1]
-            formatted = addr_data[6]
-            postal = addr_data[7] or 'NO POSTAL'
+            formatted = addr_data[2]
+            postal = addr_data[3] or 'NO POSTAL'
             print(f"  {expanded}")
             print(f"    → {formatted}")
             print(f"    → {postal}")
@@ -149,4 +142,6 @@ def validate_geocoded_addresses():
 
 
 if __name__ == "__main__":
+    # Block-buffer stdout; these reports print many lines per row
+    sys.stdout.reconfigure(line_buffering=False)
     validate_geocoded_addresses()
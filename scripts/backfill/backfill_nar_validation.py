@@ -20,12 +20,100 @@ Date: 2025-10-03
 import os
 import sys
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from tqdm import tqdm
 
 # Add parent directory to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../..'))
 
 from common.db import connect_with_retries
-from common.queue_nar_validation import queue_properties_batch, get_queue_status
+from common.queue_nar_validation import get_queue_status
+
+
+BACKFILL_WORKERS = 4
+
+
+def queue_next_batch(cursor, priority: int, batch_limit: int, after_id: str = None,
+                     slice_index: int = 0, slice_count: int = 1) -> tuple:
+    """
+    Queue the next batch of not-yet-queued properties with one INSERT ... SELECT.
+
+    Args:
+        cursor: Open cursor (caller commits)
+        priority: Priority level (1-10)
+        batch_limit: Maximum properties to queue in this batch
+        after_id: Only consider property ids greater than this (keyset cursor)
+        slice_index: Which hash slice of properties to draw from
+        slice_count: Number of disjoint hash slices (1 = all properties)
+
+    Returns:
+        (number queued, highest property id queued or None)
+    """
+    cursor.execute("""
+        WITH queued AS (
+            INSERT INTO nar_validation_queue (property_id, priority, status)
+            SELECT p.id, %s, 'pending'
+            FROM properties p
+            WHERE (%s::uuid IS NULL OR p.id > %s::uuid)
+              AND abs(hashtext(p.id::text)::bigint) %% %s = %s
+              AND NOT EXISTS (
+                  SELECT 1 FROM nar_validation_queue q WHERE q.property_id = p.id
+              )
+            ORDER BY p.id
+            LIMIT %s
+            RETURNING property_id
+        )
+        -- max() has no uuid variant; take the top uuid so the keyset stays
+        -- in uuid (index) order rather than text order
+        SELECT COUNT(*), (SELECT property_id FROM queued ORDER BY property_id DESC LIMIT 1)
+        FROM queued
+    """, (priority, after_id, after_id, slice_count, slice_index, batch_limit))
+
+    return cursor.fetchone()
+
+
+def backfill_slice(slice_index: int, slice_count: int, priority: int,
+                   limit: int = None, pbar=None) -> int:
+    """
+    Queue every unqueued property in one hash slice on its own connection.
+
+    Args:
+        slice_index: Which hash slice this worker owns
+        slice_count: Total number of slices
+        priority: Priority level (1-10)
+        limit: Optional cap on properties queued by this worker
+        pbar: Optional shared tqdm bar to advance
+
+    Returns:
+        Number of properties queued
+    """
+    batch_size = 1000
+    total_queued = 0
+    last_id = None
+
+    conn = connect_with_retries()
+    cursor = conn.cursor()
+
+    try:
+        while limit is None or total_queued < limit:
+            batch_limit = batch_size if limit is None else min(batch_size, limit - total_queued)
+            queued, last_id = queue_next_batch(
+                cursor, priority, batch_limit, last_id, slice_index, slice_count
+            )
+            conn.commit()
+
+            total_queued += queued
+            if pbar is not None:
+                pbar.update(queued)
+
+            if queued < batch_limit:
+                break
+    finally:
+        cursor.close()
+        conn.close()
+
+    return total_queued
 
 
 def backfill_validation_queue(limit: int = None, priority: int = 5):
@@ -50,44 +138,36 @@ def backfill_validation_queue(limit: int = None, priority: int = 5):
     cursor = conn.cursor()
 
     try:
-        # Count total properties
-        cursor.execute("SELECT COUNT(*) FROM properties")
+        # Planner's row estimate is enough for the banner and avoids a full
+        # COUNT(*) scan (reltuples is -1 until the table has been analyzed)
+        cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = 'properties'::regclass")
         total_properties = cursor.fetchone()[0]
-        print(f"📊 Total properties in database: {total_properties:,}")
-
-        # Find properties not yet queued
-        limit_clause = f"LIMIT {limit}" if limit else ""
-
-        cursor.execute(f"""
-            SELECT p.id
-            FROM properties p
-            LEFT JOIN nar_validation_queue q ON p.id = q.property_id
-            WHERE q.id IS NULL
-            {limit_clause}
-        """)
+        if total_properties >= 0:
+            print(f"📊 Total properties in database: ~{total_properties:,} (estimate)")
+
+        # Queue unqueued properties in batches of 1000, entirely server-side.
+        # Without a limit, BACKFILL_WORKERS threads each own a disjoint hash
+        # slice of properties and commit their batches concurrently on their
+        # own connections, so no two workers ever insert the same property.
+        # A --limit run stays on one worker so it queues exactly N rows.
+        limit = limit or None
+        workers = 1 if limit else BACKFILL_WORKERS
+        total_queued = 0
 
-        property_ids = [row[0] for row in cursor.fetchall()]
+        with tqdm(total=limit, unit='prop', desc='   Queued', dynamic_ncols=True) as pbar:
+            with ThreadPoolExecutor(max_workers=workers) as ex:
+                futures = [
+                    ex.submit(backfill_slice, k, workers, priority, limit, pbar)
+                    for k in range(workers)
+                ]
+                for f in as_completed(futures):
+                    total_queued += f.result()
 
-        if not property_ids:
+        if not total_queued:
             print("✅ All properties already queued!")
             print()
             return
 
-        print(f"📦 Found {len(property_ids):,} properties to queue")
-        print()
-
-        # Queue in batches of 1000
-        batch_size = 1000
-        total_queued = 0
-
-        for i in range(0, len(property_ids), batch_size):
-            batch = property_ids[i:i + batch_size]
-            queued = queue_properties_batch(batch, priority=priority)
-            total_queued += queued
-
-            progress = (i + len(batch)) / len(property_ids) * 100
-            print(f"   [{progress:5.1f}%] Queued {total_queued:,} / {len(property_ids):,} properties...")
-
         print()
         print(f"✅ Queued {total_queued:,} properties for validation")
         print()
@@ -1,14 +1,20 @@
 #!/usr/bin/env python3
 import argparse
+import io
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
-from common.canonical import canonicalize_address, hash_canonical_address
+from common.canonical import canonicalize_and_hash
 from common.geocode import Geocoder
 from common.db import connect_with_retries
 
 
+# Phase A rows fetched, geocoded and written per round
+PHASE_A_CHUNK = 1000
+
+
 def get_db():
     url = os.getenv("DATABASE_URL")
     if not url:
@@ -17,15 +23,42 @@ def get_db():
     return connect_with_retries(url, attempts=6, backoff_sec=1.5, prefer_pooler=True)
 
 
-def standardize_one(cur, geocoder: Geocoder, pid: str, address_line1: Optional[str], city: Optional[str], province: Optional[str], country: Optional[str]):
+def standardize_one(pid: str, address_line1: Optional[str], city: Optional[str], province: Optional[str], country: Optional[str]) -> tuple:
+    """Compute the canonical address and hash for one property row."""
     country = country or "CA"
-    canonical = canonicalize_address(address_line1, city, province, country)
-    address_hash = hash_canonical_address(address_line1, city, province, country)
+    canonical, address_hash = canonicalize_and_hash(address_line1, city, province, country)
+    return (pid, canonical, address_hash, city, province, country)
+
+
+def geocode_standardized(geocoder: Geocoder, rows: list, do_geocode: bool = True, **batch_opts) -> list:
+    """
+    Geocode each distinct canonical once and broadcast the result to its rows.
+
+    Args:
+        geocoder: Geocoder
+        rows: standardize_one tuples
+        do_geocode: False to return rows without coordinates (no API calls)
+        **batch_opts: Passed through to Geocoder.geocode_many
 
-    lat = lng = accuracy = None
-    geocode_source = None
-    if geocoder.available():
-        result = geocoder.geocode(canonical, country=country)
+    Returns:
+        (pid, canonical, hash, lat, lng, source, accuracy, city, province, country) tuples
+    """
+    # canonical -> geocode result, looked up once per distinct (country, canonical)
+    geocoded = {}
+    if do_geocode:
+        by_country = {}
+        for _, canonical, _, _, _, country in rows:
+            by_country.setdefault(country, {}).setdefault(canonical, None)
+        for country, unique in by_country.items():
+            canonicals = list(unique)
+            results = geocoder.geocode_many(canonicals, country=country, **batch_opts)
+            geocoded.update(((country, c), r) for c, r in zip(canonicals, results))
+
+    out = []
+    for pid, canonical, address_hash, city, province, country in rows:
+        lat = lng = accuracy = None
+        geocode_source = None
+        result = geocoded.get((country, canonical))
         if result:
             loc = result.get("location") or {}
             lat = loc.get("lat")
@@ -33,74 +66,138 @@ def standardize_one(cur, geocoder: Geocoder, pid: str, address_line1: Optional[s
             accuracy = (result.get("accuracy"))
             geocode_source = "geocodio"
             comps = (result.get("address_components") or {})
-            # backfill province/postal if missing
+            # backfill province if missing
             province_new = comps.get("state")
-            postal = comps.get("zip") or comps.get("postal_code")
             if province_new and (not province):
                 province = province_new
             # update with geocoded city if missing
             city_new = comps.get("city")
             if city_new and (not city):
                 city = city_new
+        out.append((pid, canonical, address_hash, lat, lng, geocode_source, accuracy, city, province, country))
+    return out
 
-    # Build geom WKT if lat/lng
-    if lat is not None and lng is not None:
-        cur.execute(
-            """
-            UPDATE properties
-            SET address_canonical = %s,
-                address_hash = %s,
-                latitude = %s,
-                longitude = %s,
-                geocode_source = %s,
-                geocode_accuracy = %s,
-                city = COALESCE(city, %s),
-                province = COALESCE(province, %s),
-                country = COALESCE(country, %s),
-                geom = ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography
-            WHERE id = %s
-            """,
-            (canonical, address_hash, lat, lng, geocode_source, accuracy, city, province, country, lng, lat, pid),
-        )
-    else:
-        # No coordinates; still set canonical + hash
-        cur.execute(
-            """
-            UPDATE properties
-            SET address_canonical = %s,
-                address_hash = %s,
-                city = COALESCE(city, %s),
-                province = COALESCE(province, %s),
-                country = COALESCE(country, %s)
-            WHERE id = %s
-            """,
-            (canonical, address_hash, city, province, country, pid),
-        )
+
+def geocode_chunk(geocoder: Geocoder, rows: list, do_geocode: bool, batch_opts: dict) -> tuple:
+    """Geocode one Phase A chunk; returns (rows, whether geocoding was attempted)."""
+    try:
+        return geocode_standardized(geocoder, rows, do_geocode, **batch_opts), do_geocode
+    except Exception as e:
+        print(f"Failed to geocode canonical addresses: {e}", file=sys.stderr)
+        return geocode_standardized(geocoder, rows, do_geocode=False), False
+
+
+def write_phase_a_chunk(cur, rows: list, attempted: bool) -> int:
+    """Apply one geocoded Phase A chunk; returns the number of rows written."""
+    apply_standardized(cur, rows)
+    if attempted and rows:
+        # Phase B must not spend quota re-geocoding these
+        cur.execute("INSERT INTO tmp_attempted SELECT DISTINCT canon FROM tmp_canon ON CONFLICT DO NOTHING")
+    return len(rows)
+
+
+def _copy_field(value) -> str:
+    """Render one value in COPY text format."""
+    if value is None:
+        return "\\N"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def copy_rows(cur, table: str, columns: str, rows: list) -> None:
+    """Stream rows into an (emptied) temp staging table with COPY FROM STDIN."""
+    cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS {table} ({columns}) ON COMMIT DROP")
+    cur.execute(f"TRUNCATE {table}")
+    buf = io.StringIO()
+    for row in rows:
+        buf.write("\t".join(_copy_field(v) for v in row))
+        buf.write("\n")
+    buf.seek(0)
+    cur.copy_expert(f"COPY {table} FROM STDIN", buf)
+
+
+def apply_standardized(cur, rows: list) -> None:
+    """Write standardize_one results back via a COPY-loaded staging table."""
+    if not rows:
+        return
+    copy_rows(
+        cur,
+        "tmp_canon",
+        "id uuid, canon text, h text, lat float8, lng float8, src text, acc float8, city text, prov text, ctry text",
+        rows,
+    )
+    cur.execute(
+        """
+        UPDATE properties p
+        SET address_canonical = t.canon,
+            address_hash = t.h,
+            latitude = t.lat,
+            longitude = t.lng,
+            geocode_source = t.src,
+            geocode_accuracy = t.acc,
+            city = COALESCE(p.city, t.city),
+            province = COALESCE(p.province, t.prov),
+            country = COALESCE(p.country, t.ctry),
+            geom = ST_SetSRID(ST_MakePoint(t.lng, t.lat), 4326)::geography
+        FROM tmp_canon t
+        WHERE p.id = t.id AND t.lat IS NOT NULL AND t.lng IS NOT NULL
+        """
+    )
+    # No coordinates; still set canonical + hash
+    cur.execute(
+        """
+        UPDATE properties p
+        SET address_canonical = t.canon,
+            address_hash = t.h,
+            city = COALESCE(p.city, t.city),
+            province = COALESCE(p.province, t.prov),
+            country = COALESCE(p.country, t.ctry)
+        FROM tmp_canon t
+        WHERE p.id = t.id AND (t.lat IS NULL OR t.lng IS NULL)
+        """
+    )
 
 
-def geocode_by_canonical(cur, geocoder: Geocoder, canonical: str, country: str = "CA") -> bool:
-    result = geocoder.geocode(canonical, country=country)
-    if not result:
-        return False
-    loc = result.get("location") or {}
-    lat = loc.get("lat")
-    lng = loc.get("lng")
-    accuracy = result.get("accuracy")
-    if lat is None or lng is None:
-        return False
+def apply_canonical_geocodes(cur, canonicals: list, results: list) -> int:
+    """Apply geocode results for distinct canonicals to all matching properties in one UPDATE."""
+    values = []
+    for canonical, result in zip(canonicals, results):
+        if not result:
+            continue
+        loc = result.get("location") or {}
+        lat = loc.get("lat")
+        lng = loc.get("lng")
+        if lat is None or lng is None:
+            continue
+        values.append((canonical, lat, lng, result.get("accuracy")))
+    if not values:
+        return 0
+    copy_rows(cur, "tmp_geocodes", "canonical text, lat float8, lng float8, acc float8", values)
+    # Build each point once per distinct canonical (MATERIALIZED stops the
+    # planner from inlining it and re-evaluating it for every matching property)
     cur.execute(
         """
-        UPDATE properties
-        SET latitude = %s,
-            longitude = %s,
+        WITH g AS MATERIALIZED (
+            SELECT canonical, lat, lng, acc,
+                   ST_SetSRID(ST_MakePoint(lng, lat), 4326)::geography AS geom
+            FROM tmp_geocodes
+        )
+        UPDATE properties p
+        SET latitude = g.lat,
+            longitude = g.lng,
             geocode_source = 'geocodio',
-            geocode_accuracy = %s,
-            geom = ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography
-        WHERE address_canonical = %s AND latitude IS NULL
-        """,
-        (lat, lng, accuracy, lng, lat, canonical),
+            geocode_accuracy = g.acc,
+            geom = g.geom
+        FROM g
+        WHERE p.address_canonical = g.canonical AND p.latitude IS NULL
+        """
     )
-    return True
+    return len(values)
 
 
 def main():
@@ -108,61 +205,83 @@ def main():
     ap.add_argument("--canonical-limit", type=int, default=1000, help="Max properties to canonicalize in this run")
     ap.add_argument("--geocode-limit", type=int, default=0, help="Max distinct canonical addresses to geocode in this run (0=use daily-quota)")
     ap.add_argument("--daily-quota", type=int, default=2500, help="API daily quota for geocoding (distinct canonicals)")
-    ap.add_argument("--sleep-ms", type=int, default=200, help="Sleep between geocode calls to be polite")
+    ap.add_argument("--batch-size", type=int, default=1000, help="Canonical addresses per Geocodio batch request")
+    ap.add_argument("--concurrency", type=int, default=4, help="Max Geocodio batch requests in flight")
+    ap.add_argument("--sleep-ms", type=int, default=200, help="Steady-state gap between geocode batch request starts (token bucket)")
     ap.add_argument("--country", default="CA", help="Default country code")
     ap.add_argument("--no-geocode", action="store_true", help="Skip live geocoding (compute canonical only)")
     args = ap.parse_args()
 
     geo = Geocoder() if not args.no_geocode else Geocoder(api_key=None)
+    geo_available = geo.available() and not args.no_geocode
+    batch_opts = dict(
+        batch_size=args.batch_size,
+        max_concurrency=max(1, args.concurrency),
+        min_interval=max(0, args.sleep_ms) / 1000.0,
+    )
 
     conn = get_db()
     with conn:
         with conn.cursor() as cur:
-            # Phase A: canonicalize rows missing address_hash
-            cur.execute(
-                """
-                SELECT id, address_line1, city, province, country
-                FROM properties
-                WHERE address_hash IS NULL
-                ORDER BY created_at ASC
-                LIMIT %s
-                """,
-                (args.canonical_limit,),
-            )
-            rows = cur.fetchall()
+            # Phase A: canonicalize rows missing address_hash, streamed from a
+            # server-side cursor and applied in chunks so memory stays flat
             canon_count = 0
-            for pid, addr1, city, prov, country in rows:
-                try:
-                    standardize_one(cur, geo, pid, addr1, city, prov, country or args.country)
-                    canon_count += 1
-                except Exception as e:
-                    print(f"Failed to standardize {pid}: {e}", file=sys.stderr)
+            cur.execute("CREATE TEMP TABLE tmp_attempted (canon text PRIMARY KEY) ON COMMIT DROP")
+            with conn.cursor(name="prop_stream") as stream:
+                stream.itersize = PHASE_A_CHUNK
+                stream.execute(
+                    """
+                    SELECT id, address_line1, city, province, country
+                    FROM properties
+                    WHERE address_hash IS NULL
+                    ORDER BY created_at ASC
+                    LIMIT %s
+                    """,
+                    (args.canonical_limit,),
+                )
+                # Geocode each chunk on a background thread while the main
+                # thread writes the previous chunk and fetches the next one
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    pending = None
+                    while True:
+                        rows = stream.fetchmany(PHASE_A_CHUNK)
+                        standardized = []
+                        for pid, addr1, city, prov, country in rows:
+                            try:
+                                standardized.append(standardize_one(pid, addr1, city, prov, country or args.country))
+                            except Exception as e:
+                                print(f"Failed to standardize {pid}: {e}", file=sys.stderr)
+                        future = None
+                        if standardized:
+                            future = executor.submit(geocode_chunk, geo, standardized, geo_available, batch_opts)
+                        if pending is not None:
+                            canon_count += write_phase_a_chunk(cur, *pending.result())
+                        pending = future
+                        if not rows:
+                            break
 
             # Phase B: geocode distinct canonical addresses (if enabled)
             geocode_done = 0
-            if geo.available() and not args.no_geocode:
+            if geo_available:
                 quota = args.daily_quota if args.geocode_limit == 0 else args.geocode_limit
                 cur.execute(
                     """
-                    SELECT address_canonical
-                    FROM properties
-                    WHERE address_canonical IS NOT NULL AND latitude IS NULL
-                    GROUP BY address_canonical
+                    SELECT p.address_canonical
+                    FROM properties p
+                    WHERE p.address_canonical IS NOT NULL AND p.latitude IS NULL
+                      AND NOT EXISTS (SELECT 1 FROM tmp_attempted a WHERE a.canon = p.address_canonical)
+                    GROUP BY p.address_canonical
                     ORDER BY COUNT(*) DESC
                     LIMIT %s
                     """,
                     (quota,),
                 )
                 todo = [r[0] for r in cur.fetchall()]
-                import time
-                for canonical in todo:
-                    try:
-                        ok = geocode_by_canonical(cur, geo, canonical, country=args.country)
-                        geocode_done += 1 if ok else 0
-                    except Exception as e:
-                        print(f"Failed to geocode '{canonical}': {e}", file=sys.stderr)
-                    # be polite
-                    time.sleep(max(0, args.sleep_ms) / 1000.0)
+                try:
+                    results = geo.geocode_many(todo, country=args.country, **batch_opts)
+                    geocode_done = apply_canonical_geocodes(cur, todo, results)
+                except Exception as e:
+                    print(f"Failed to geocode {len(todo)} canonical addresses: {e}", file=sys.stderr)
     conn.close()
     print(f"Canonicalized: {canon_count}. Geocoded distinct canonical addresses: {geocode_done}.")
 
@@ -43,10 +43,12 @@ def main():
 
             # 2. Copy current city values to backup
             print("2️⃣  Copying current city values to city_backup...")
+            # Rows with no city have nothing to back up; skip rewriting them
             cur.execute("""
                 UPDATE properties
                 SET city_backup = city
-                WHERE city_backup IS NULL;
+                WHERE city_backup IS NULL
+                  AND city IS NOT NULL;
             """)
             rows_updated = cur.rowcount
             print(f"   ✅ Backed up {rows_updated:,} city values\n")
@@ -64,7 +66,8 @@ def main():
             cur.execute("""
                 UPDATE transactions
                 SET city_raw_backup = city_raw
-                WHERE city_raw_backup IS NULL;
+                WHERE city_raw_backup IS NULL
+                  AND city_raw IS NOT NULL;
             """)
             rows_updated = cur.rowcount
             print(f"   ✅ Backed up {rows_updated:,} city_raw values\n")
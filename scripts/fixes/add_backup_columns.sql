@@ -4,11 +4,12 @@
 
 -- 1. Backup city field in properties table
 ALTER TABLE properties ADD COLUMN IF NOT EXISTS city_backup TEXT;
-UPDATE properties SET city_backup = city WHERE city_backup IS NULL;
+-- (rows with no city have nothing to back up; skip rewriting them)
+UPDATE properties SET city_backup = city WHERE city_backup IS NULL AND city IS NOT NULL;
 
 -- 2. Backup city_raw field in transactions table
 ALTER TABLE transactions ADD COLUMN IF NOT EXISTS city_raw_backup TEXT;
-UPDATE transactions SET city_raw_backup = city_raw WHERE city_raw_backup IS NULL;
+UPDATE transactions SET city_raw_backup = city_raw WHERE city_raw_backup IS NULL AND city_raw IS NOT NULL;
 
 -- 3. Verify backups were created
 SELECT
@@ -2,11 +2,24 @@
 """
 Apply City Fixes Using Bulk SQL UPDATE
 Faster approach using SQL CASE statement for bulk updates.
+
+Usage:
+    python3 scripts/fixes/apply_city_fixes_sql.py          # parse in Python, bulk UPDATE
+    python3 scripts/fixes/apply_city_fixes_sql.py --sql    # run the whole fix server-side
+
+Add --drop-indexes for large runs to drop the city/address_hash_raw indexes
+during the update and rebuild them CONCURRENTLY afterwards.
+
+--sql needs the fix_city()/hash_address_raw() functions from
+config/supabase/migrations/20261016_city_fix_functions.sql.
 """
 
+import argparse
 import os
 import sys
 from collections import defaultdict
+from multiprocessing import Pool
+from typing import Optional
 
 import psycopg2
 
@@ -15,22 +28,84 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../..'))
 from common.address import hash_address_raw
 from common.address_parser import parse_and_validate_city
 from common.db import connect_with_service_role
-from psycopg2.extras import RealDictCursor
+from common.ontario_cities import seed_city_fix_rules
+from psycopg2.extras import execute_values
 
 
-def main():
-    print("=" * 70)
-    print("APPLYING CITY FIXES - BULK SQL APPROACH")
-    print("=" * 70)
-    print()
+# Indexes on the columns rewritten by the fix (city, address_hash_raw)
+BULK_UPDATE_INDEXES = (
+    'idx_properties_city',
+    'trgm_properties_city',
+    'idx_properties_address_hash_raw',
+)
+
+
+def _fix_one(prop: tuple) -> Optional[tuple]:
+    """Pool worker: return (id, old_city, fixed_city, new_hash) if the city changes."""
+    prop_id, address_line1, city, canonical, province = prop
+    fixed_city = parse_and_validate_city(
+        address=address_line1 or "",
+        city_raw=city or "",
+        province=province or "ON",
+        canonical=canonical
+    )
+
+    if fixed_city and fixed_city != city:
+        return prop_id, city, fixed_city, hash_address_raw(address_line1, fixed_city)
+    return None
+
+
+def apply_fixes_server_side(conn):
+    """Compute and apply every city fix with one UPDATE inside Postgres."""
+    with conn.cursor() as cur:
+        seed_city_fix_rules(cur)
+
+        cur.execute("""
+            CREATE TEMP TABLE city_fixes ON COMMIT DROP AS
+            SELECT id, city AS old_city, fixed_city
+            FROM (
+                SELECT id, city, fix_city(coalesce(city, ''), address_canonical) AS fixed_city
+                FROM properties
+            ) f
+            WHERE fixed_city IS NOT NULL AND fixed_city IS DISTINCT FROM city
+        """)
+        print(f"✅ Found {cur.rowcount:,} properties to fix\n")
+
+        cur.execute("""
+            SELECT old_city, fixed_city, COUNT(*)
+            FROM city_fixes
+            GROUP BY old_city, fixed_city
+            ORDER BY COUNT(*) DESC
+            LIMIT 10
+        """)
+        top = cur.fetchall()
+        if top:
+            print("Top 10 changes:")
+            for old_city, fixed_city, count in top:
+                print(f"  {old_city} → {fixed_city}: {count:,}")
+            print()
+
+        cur.execute("""
+            UPDATE properties p
+            SET
+                city = f.fixed_city,
+                address_hash_raw = hash_address_raw(p.address_line1, f.fixed_city),
+                updated_at = NOW()
+            FROM city_fixes f
+            WHERE p.id = f.id
+        """)
+        total_updated = cur.rowcount
+
+    conn.commit()
+    print(f"✅ SUCCESS: Updated {total_updated:,} properties!\n")
 
-    # Connect
-    conn = connect_with_service_role()
-    print("✅ Connected to database\n")
 
+def apply_fixes_client_side(conn):
+    """Parse cities in a process pool and apply the fixes in chunked UPDATEs."""
     # Load properties
     print("Loading properties...")
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+    # Plain tuple rows: far less memory than one dict per property
+    with conn.cursor() as cur:
         cur.execute("""
             SELECT id, address_line1, city, address_canonical, province
             FROM properties
@@ -44,21 +119,18 @@ def main():
     fixes = {}
     stats = defaultdict(int)
 
-    for i, prop in enumerate(properties):
-        if i % 1000 == 0 and i > 0:
-            print(f"  Progress: {i:,} / {len(properties):,}")
+    # parse_and_validate_city is CPU-bound; spread it across all cores
+    with Pool(processes=os.cpu_count()) as pool:
+        results = pool.imap_unordered(_fix_one, properties, chunksize=2000)
 
-        fixed_city = parse_and_validate_city(
-            address=prop['address_line1'] or "",
-            city_raw=prop['city'] or "",
-            province=prop['province'] or "ON",
-            canonical=prop['address_canonical']
-        )
+        for i, result in enumerate(results):
+            if i % 1000 == 0 and i > 0:
+                print(f"  Progress: {i:,} / {len(properties):,}")
 
-        if fixed_city and fixed_city != prop['city']:
-            new_hash = hash_address_raw(prop['address_line1'], fixed_city)
-            fixes[prop['id']] = (fixed_city, new_hash)
-            stats[f"{prop['city']} → {fixed_city}"] += 1
+            if result:
+                prop_id, old_city, fixed_city, new_hash = result
+                fixes[prop_id] = (fixed_city, new_hash)
+                stats[f"{old_city} → {fixed_city}"] += 1
 
     print(f"\n✅ Found {len(fixes):,} properties to fix\n")
 
@@ -72,28 +144,19 @@ def main():
         print(f"  {change}: {count:,}")
     print()
 
-    # Apply fixes in smaller chunks
+    # Apply fixes in chunks, one parameterized UPDATE ... FROM (VALUES) each
     print("Applying fixes in chunks...")
-    chunk_size = 1000
-    prop_ids = list(fixes.keys())
+    chunk_size = 5000
+    updates = [(prop_id, city, hash_val) for prop_id, (city, hash_val) in fixes.items()]
     total_updated = 0
 
     with conn.cursor() as cur:
-        for chunk_start in range(0, len(prop_ids), chunk_size):
-            chunk_ids = prop_ids[chunk_start:chunk_start + chunk_size]
-
-            # Build VALUES for this chunk
-            values = []
-            for prop_id in chunk_ids:
-                city, hash_val = fixes[prop_id]
-                values.append(f"('{prop_id}'::uuid, '{city}', '{hash_val}')")
-
-            values_sql = ",\n".join(values)
-
-            # Single UPDATE with JOIN
-            sql = f"""
+        for chunk_start in range(0, len(updates), chunk_size):
+            execute_values(
+                cur,
+                """
                 WITH updates(id, new_city, new_hash) AS (
-                    VALUES {values_sql}
+                    VALUES %s
                 )
                 UPDATE properties p
                 SET
@@ -102,9 +165,13 @@ def main():
                     updated_at = NOW()
                 FROM updates u
                 WHERE p.id = u.id
-            """
-
-            cur.execute(sql)
+                  AND (p.city IS DISTINCT FROM u.new_city
+                       OR p.address_hash_raw IS DISTINCT FROM u.new_hash)
+                """,
+                updates[chunk_start:chunk_start + chunk_size],
+                template="(%s::uuid, %s, %s)",
+                page_size=chunk_size,
+            )
             total_updated += cur.rowcount
             conn.commit()
 
@@ -112,7 +179,79 @@ def main():
 
     print(f"\n✅ SUCCESS: Updated {total_updated:,} properties!\n")
 
-    conn.close()
+
+def drop_bulk_update_indexes(conn) -> list:
+    """
+    Drop the properties indexes on the columns this script rewrites.
+
+    Also relaxes commit durability for the session; every fix is recomputed
+    from source on a rerun, so losing the last commits on a crash is harmless.
+
+    Returns:
+        [(index name, CREATE INDEX statement)] for rebuild_indexes
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT indexname, indexdef
+            FROM pg_indexes
+            WHERE schemaname = current_schema()
+              AND tablename = 'properties'
+              AND indexname = ANY(%s)
+        """, (list(BULK_UPDATE_INDEXES),))
+        index_defs = cur.fetchall()
+        for name, _ in index_defs:
+            print(f"🗑️  Dropping index {name} for the bulk update")
+            cur.execute(f'DROP INDEX IF EXISTS "{name}"')
+        cur.execute("SET synchronous_commit = off")
+        cur.execute("SET work_mem = '256MB'")
+    conn.commit()
+    print()
+    return index_defs
+
+
+def rebuild_indexes(conn, index_defs: list):
+    """Recreate dropped indexes CONCURRENTLY (needs autocommit)."""
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("RESET synchronous_commit")
+            cur.execute("RESET work_mem")
+            for name, indexdef in index_defs:
+                print(f"🔨 Rebuilding index {name}...")
+                cur.execute(indexdef.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY IF NOT EXISTS", 1))
+    finally:
+        conn.autocommit = False
+    print("✅ Indexes rebuilt\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply city fixes to properties")
+    parser.add_argument('--sql', action='store_true',
+                        help="Run the fix entirely server-side with fix_city()")
+    parser.add_argument('--drop-indexes', action='store_true',
+                        help="Drop city/address_hash_raw indexes during the update and rebuild them after")
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("APPLYING CITY FIXES - BULK SQL APPROACH")
+    print("=" * 70)
+    print()
+
+    # Connect
+    conn = connect_with_service_role()
+    print("✅ Connected to database\n")
+
+    index_defs = drop_bulk_update_indexes(conn) if args.drop_indexes else []
+    try:
+        if args.sql:
+            apply_fixes_server_side(conn)
+        else:
+            apply_fixes_client_side(conn)
+    finally:
+        conn.rollback()
+        if index_defs:
+            rebuild_indexes(conn, index_defs)
+        conn.close()
 
 
 if __name__ == "__main__":
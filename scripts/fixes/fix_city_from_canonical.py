@@ -12,12 +12,17 @@ This script:
 Date: 2025-10-03
 """
 
+import csv
+import io
 import json
 import os
 import sys
+from collections import Counter
 from datetime import datetime
-from typing import Dict, List
+from functools import lru_cache
+from typing import Dict, List, Optional
 
+import orjson
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
@@ -27,6 +32,15 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../..'))
 from common.address import hash_address_raw
 from common.address_parser import parse_and_validate_city
 from common.db import connect_with_service_role
+from common.ontario_cities import (
+    VALID_ONTARIO_CITIES,
+    is_likely_unit_or_address,
+    normalize_city,
+    seed_city_fix_rules,
+)
+
+
+PROGRESS_EVERY = 50_000
 
 
 def load_preview_results() -> Dict:
@@ -42,16 +56,87 @@ def load_preview_results() -> Dict:
         return json.load(f)
 
 
-def apply_city_fixes(cur, dry_run: bool = False) -> Dict:
+def already_clean_cities() -> List[str]:
+    """
+    City values parse_and_validate_city always returns unchanged.
+
+    A valid city that is already in normalized form and doesn't look like a
+    unit/address is returned as-is whatever the canonical says.
+
+    Returns:
+        Sorted list of city strings
+    """
+    return sorted(
+        city for city in VALID_ONTARIO_CITIES
+        if normalize_city(city) == city and not is_likely_unit_or_address(city)
+    )
+
+
+@lru_cache(maxsize=200_000)
+def _fixed_city_cached(city_raw: str, canonical_tail: Optional[str]) -> Optional[str]:
+    canonical = f",{canonical_tail}" if canonical_tail is not None else None
+    return parse_and_validate_city(address="", city_raw=city_raw, canonical=canonical)
+
+
+def fixed_city_for(city_raw: str, canonical: Optional[str]) -> Optional[str]:
+    """
+    Memoized parse_and_validate_city for the scan loop.
+
+    The result never depends on the address, the province, or the street
+    part of the canonical (extraction skips the first comma-separated
+    part), so the cache key is the raw city plus the canonical's tail,
+    which repeats heavily across properties.
+
+    Args:
+        city_raw: City field from the property ("" when NULL)
+        canonical: Canonical address, if any
+
+    Returns:
+        Validated and normalized city name, or None if invalid
+    """
+    tail = canonical.split(',', 1)[1] if canonical and ',' in canonical else None
+    return _fixed_city_cached(city_raw, tail)
+
+
+def apply_city_fixes(cur, dry_run: bool = False, sorted_scan: bool = False) -> Dict:
     """
     Apply city corrections to properties table.
 
+    The scan is unordered unless sorted_scan is set (deterministic samples
+    for debugging at the cost of a PK-ordered scan).
+
+    Address hashes are recomputed in the UPDATE by the SQL hash_address_raw()
+    from config/supabase/migrations/20261016_city_fix_functions.sql;
+    tests/test_city_fix_sql_parity.py keeps it in step with the Python hash
+    recorded in the audit samples.
+
     Returns:
         Dict with statistics about fixes applied
     """
 
     print("Fetching properties that need fixes...")
-    cur.execute("""
+    # Rows whose city is already a clean valid name (or that have neither a
+    # city nor a canonical) can never change, so don't ship them at all
+    clean_cities = already_clean_cities()
+    candidate_filter = """
+        (city IS NULL AND address_canonical IS NOT NULL)
+        OR city <> ALL(%(clean)s)
+    """
+    cur.execute(f"""
+        SELECT
+            COUNT(*) AS total,
+            COUNT(*) FILTER (WHERE {candidate_filter}) AS candidates
+        FROM properties
+    """, {'clean': clean_cities})
+    counts = cur.fetchone()
+    total_count = counts['candidates']
+    print(f"✅ {total_count:,} of {counts['total']:,} properties can change\n")
+
+    # Server-side cursor: stream rows in chunks instead of loading the table
+    # Plain tuple rows: no per-row dict for a multi-million-row scan
+    scan = cur.connection.cursor(name="props_scan")
+    scan.itersize = 5000
+    scan.execute(f"""
         SELECT
             id,
             address_line1,
@@ -61,18 +146,15 @@ def apply_city_fixes(cur, dry_run: bool = False) -> Dict:
             province,
             address_hash_raw
         FROM properties
-        ORDER BY id
-    """)
-
-    properties = cur.fetchall()
-    total_count = len(properties)
-    print(f"✅ Loaded {total_count:,} properties\n")
+        WHERE {candidate_filter}
+        {"ORDER BY id" if sorted_scan else ""}
+    """, {'clean': clean_cities})
 
     # Stats
     stats = {
-        "properties_analyzed": total_count,
+        "properties_analyzed": counts['total'],
         "properties_fixed": 0,
-        "properties_skipped": 0,
+        "properties_skipped": counts['total'] - total_count,
         "hash_recomputed": 0,
         "fixes_by_type": {},
         "sample_changes": []  # Only keep first 100 for audit
@@ -82,23 +164,17 @@ def apply_city_fixes(cur, dry_run: bool = False) -> Dict:
 
     # Collect all updates to batch them
     updates_batch = []
+    fixes_by_type = Counter()
+    sample_changes = stats["sample_changes"]
+    samples_left = 100
 
-    for i, prop in enumerate(properties):
-        if i % 1000 == 0 and i > 0:
-            print(f"  Progress: {i:,} / {total_count:,} ({i/total_count*100:.1f}%)")
-
-        prop_id = prop['id']
-        current_city = prop['city']
-        canonical = prop['address_canonical']
-        current_hash = prop['address_hash_raw']
+    for i, (prop_id, address, current_city, city_backup, canonical, province, current_hash) in enumerate(scan):
+        if i % PROGRESS_EVERY == 0 and i > 0:
+            sys.stdout.write(f"  Progress: {i:,} / {total_count:,} ({i/total_count*100:.1f}%)\n")
+            sys.stdout.flush()
 
         # Try to get a better city
-        fixed_city = parse_and_validate_city(
-            address=prop['address_line1'] or "",
-            city_raw=current_city or "",
-            province=prop['province'] or "ON",
-            canonical=canonical
-        )
+        fixed_city = fixed_city_for(current_city or "", canonical)
 
         # Skip if no fix available or already correct
         if not fixed_city or fixed_city == current_city:
@@ -108,54 +184,142 @@ def apply_city_fixes(cur, dry_run: bool = False) -> Dict:
         # We have a fix!
         stats["properties_fixed"] += 1
 
-        # Track change type
-        change_key = f"{current_city} → {fixed_city}"
-        stats["fixes_by_type"][change_key] = stats["fixes_by_type"].get(change_key, 0) + 1
-
-        # Re-compute address hash with corrected city
-        new_hash = hash_address_raw(prop['address_line1'], fixed_city)
+        # Track change type (labelled once per distinct pair after the scan)
+        fixes_by_type[current_city, fixed_city] += 1
 
         # Log first 100 changes as samples
-        if len(stats["sample_changes"]) < 100:
-            stats["sample_changes"].append({
+        if samples_left:
+            samples_left -= 1
+            sample_changes.append({
                 "property_id": prop_id,
-                "address": prop['address_line1'],
+                "address": address,
                 "old_city": current_city,
                 "new_city": fixed_city,
                 "old_hash": current_hash,
-                "new_hash": new_hash,
+                "new_hash": hash_address_raw(address, fixed_city),
             })
 
-        # Add to batch
+        # Add to batch; the hash is recomputed server-side from the new city
         if not dry_run:
-            updates_batch.append((fixed_city, new_hash, prop_id))
+            updates_batch.append((fixed_city, prop_id))
 
+    scan.close()
+    stats["fixes_by_type"] = {f"{old} → {new}": n for (old, new), n in fixes_by_type.items()}
     print(f"\n✅ Analysis complete!\n")
 
     # Apply batch updates if not dry run
     if not dry_run and updates_batch:
         print(f"Applying {len(updates_batch):,} updates in batches...")
 
-        batch_size = 500
-        for i in range(0, len(updates_batch), batch_size):
-            batch = updates_batch[i:i + batch_size]
+        # Stream the fixes into a temp table with COPY, then one set-based UPDATE
+        cur.execute("""
+            CREATE TEMP TABLE _fix (city text, id uuid PRIMARY KEY) ON COMMIT DROP
+        """)
+        buf = io.StringIO()
+        csv.writer(buf).writerows(updates_batch)
+        buf.seek(0)
+        cur.copy_expert("COPY _fix (city, id) FROM STDIN WITH (FORMAT csv)", buf)
+
+        cur.execute("""
+            UPDATE properties AS p
+            SET
+                city = f.city,
+                address_hash_raw = hash_address_raw(p.address_line1, f.city),
+                updated_at = NOW()
+            FROM _fix f
+            WHERE p.id = f.id
+        """)
+
+        stats["hash_recomputed"] += len(updates_batch)
+
+        print(f"✅ All {len(updates_batch):,} updates applied\n")
+
+    return stats
 
-            # Use executemany for batch updates
-            cur.executemany("""
-                UPDATE properties
-                SET
-                    city = %s,
-                    address_hash_raw = %s,
-                    updated_at = NOW()
-                WHERE id = %s
-            """, batch)
 
-            stats["hash_recomputed"] += len(batch)
+def apply_city_fixes_sql(cur, dry_run: bool = False) -> Dict:
+    """
+    Apply city corrections entirely inside Postgres with fix_city().
 
-            if (i + batch_size) % 5000 == 0:
-                print(f"  Applied {i + len(batch):,} / {len(updates_batch):,} updates")
+    Same statistics as apply_city_fixes, but no property rows are shipped
+    to the client; needs config/supabase/migrations/20261016_city_fix_functions.sql.
 
-        print(f"✅ All {len(updates_batch):,} updates applied\n")
+    Returns:
+        Dict with statistics about fixes applied
+    """
+    seed_city_fix_rules(cur)
+
+    print("Computing fixes server-side...")
+    cur.execute("SELECT COUNT(*) AS total FROM properties")
+    total_count = cur.fetchone()['total']
+
+    cur.execute("""
+        CREATE TEMP TABLE _sql_fix ON COMMIT DROP AS
+        SELECT
+            id,
+            address_line1,
+            old_city,
+            new_city,
+            old_hash,
+            hash_address_raw(address_line1, new_city) AS new_hash
+        FROM (
+            SELECT
+                id,
+                address_line1,
+                city AS old_city,
+                fix_city(coalesce(city, ''), address_canonical) AS new_city,
+                address_hash_raw AS old_hash
+            FROM properties
+        ) f
+        WHERE new_city IS NOT NULL AND new_city IS DISTINCT FROM old_city
+    """)
+    fixed_count = cur.rowcount
+    print(f"✅ Analysis complete!\n")
+
+    cur.execute("""
+        SELECT old_city, new_city, COUNT(*) AS n
+        FROM _sql_fix
+        GROUP BY old_city, new_city
+    """)
+    fixes_by_type = {f"{r['old_city']} → {r['new_city']}": r['n'] for r in cur.fetchall()}
+
+    # Log first 100 changes as samples
+    cur.execute("""
+        SELECT
+            id::text AS property_id,
+            address_line1 AS address,
+            old_city,
+            new_city,
+            old_hash,
+            new_hash
+        FROM _sql_fix
+        ORDER BY id
+        LIMIT 100
+    """)
+    sample_changes = [dict(r) for r in cur.fetchall()]
+
+    stats = {
+        "properties_analyzed": total_count,
+        "properties_fixed": fixed_count,
+        "properties_skipped": total_count - fixed_count,
+        "hash_recomputed": 0,
+        "fixes_by_type": fixes_by_type,
+        "sample_changes": sample_changes,
+    }
+
+    if not dry_run and fixed_count:
+        print(f"Applying {fixed_count:,} updates...")
+        cur.execute("""
+            UPDATE properties AS p
+            SET
+                city = f.new_city,
+                address_hash_raw = f.new_hash,
+                updated_at = NOW()
+            FROM _sql_fix f
+            WHERE p.id = f.id
+        """)
+        stats["hash_recomputed"] = cur.rowcount
+        print(f"✅ All {cur.rowcount:,} updates applied\n")
 
     return stats
 
@@ -193,14 +357,29 @@ def print_summary(stats: Dict, dry_run: bool = False):
 
 
 def save_audit_log(stats: Dict, dry_run: bool = False):
-    """Save audit log to file."""
+    """
+    Save audit log to file as newline-delimited JSON.
+
+    The first line is a summary record with the counters; it is followed by
+    one "fix_type" record per change type and one "sample_change" record per
+    sampled property, so the log can be stream-parsed line by line.
+    """
 
     mode = "dry_run" if dry_run else "applied"
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    audit_file = f"scripts/fixes/city_fix_audit_{mode}_{timestamp}.json"
+    audit_file = f"scripts/fixes/city_fix_audit_{mode}_{timestamp}.ndjson"
+
+    summary = {
+        key: value for key, value in stats.items()
+        if key not in ("fixes_by_type", "sample_changes")
+    }
 
-    with open(audit_file, 'w') as f:
-        json.dump(stats, f, indent=2)
+    with open(audit_file, 'wb') as f:
+        f.write(orjson.dumps({"type": "summary", **summary}) + b"\n")
+        for change, count in stats["fixes_by_type"].items():
+            f.write(orjson.dumps({"type": "fix_type", "change": change, "count": count}) + b"\n")
+        for sample in stats["sample_changes"]:
+            f.write(orjson.dumps({"type": "sample_change", **sample}) + b"\n")
 
     print(f"📁 Audit log saved to: {audit_file}")
     print()
@@ -213,6 +392,8 @@ def main():
     parser.add_argument("--dry-run", action="store_true", help="Preview changes without applying")
     parser.add_argument("--apply", action="store_true", help="Apply changes to database")
     parser.add_argument("--skip-confirmation", action="store_true", help="Skip confirmation prompt")
+    parser.add_argument("--sql", action="store_true", help="Compute and apply fixes server-side with fix_city()")
+    parser.add_argument("--sorted", action="store_true", help="Scan properties in id order (deterministic samples)")
     args = parser.parse_args()
 
     if not args.dry_run and not args.apply:
@@ -260,7 +441,10 @@ def main():
         with conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # Apply fixes
-                stats = apply_city_fixes(cur, dry_run=dry_run)
+                if args.sql:
+                    stats = apply_city_fixes_sql(cur, dry_run=dry_run)
+                else:
+                    stats = apply_city_fixes(cur, dry_run=dry_run, sorted_scan=args.sorted)
 
                 if not dry_run:
                     # Commit changes
@@ -12,167 +12,167 @@ import os
 import sys
 import psycopg2
 import argparse
+from psycopg2.extras import execute_values
 
 sys.path.insert(0, '/Users/brandonolsen23/Development/cleo-project-REBOOT')
 
 
 # City Amalgamations - Source of Truth
-# Amalgamated city → List of former municipalities
-CITY_AMALGAMATIONS = {
-    'TORONTO': [
+# Amalgamated city → List of former municipalities (kept as pairs so duplicates are caught)
+_RAW_AMALGAMATIONS = [
+    ('TORONTO', [
         'ETOBICOKE', 'NORTH YORK', 'SCARBOROUGH',
         'YORK', 'EAST YORK', 'N YORK', 'E YORK',
         'N. YORK', 'E. YORK'  # With periods (will be normalized)
-    ],
-    'OTTAWA': [
+    ]),
+    ('OTTAWA', [
         'NEPEAN', 'GLOUCESTER', 'KANATA', 'ORLEANS',
         'VANIER', 'CUMBERLAND', 'OSGOODE', 'RIDEAU',
         'WEST CARLETON', 'GOULBOURN', 'ROCKCLIFFE PARK'
-    ],
-    'HAMILTON': [
+    ]),
+    ('HAMILTON', [
         'DUNDAS', 'FLAMBOROUGH', 'GLANBROOK', 'STONEY CREEK', 'ANCASTER'
-    ],
-    'GREATER SUDBURY': [
+    ]),
+    ('GREATER SUDBURY', [
         'SUDBURY', 'VALLEY EAST', 'RAYSIDE-BALFOUR', 'ONAPING FALLS',
         'WALDEN', 'NICKEL CENTRE', 'CAPREOL', 'N. MONAGHAN'
-    ],
-    'CHATHAM': [
+    ]),
+    ('CHATHAM', [
         'CHATHAM-KENT'  # Reverse - sometimes data has hyphenated form as original
-    ],
-    'CHATHAM-KENT': [
+    ]),
+    ('CHATHAM-KENT', [
         'CHATHAM', 'WALLACEBURG', 'TILBURY', 'BLENHEIM', 'DRESDEN', 'MERLIN'
-    ],
-    'KAWARTHA LAKES': [
+    ]),
+    ('KAWARTHA LAKES', [
         'LINDSAY', 'FENELON FALLS', 'BOBCAYGEON', 'OMEMEE'
-    ],
-    'MISSISSIPPI MILLS': [
+    ]),
+    ('MISSISSIPPI MILLS', [
         'ALMONTE', 'PAKENHAM', 'CLAYTON'
-    ],
-    'QUINTE WEST': [
+    ]),
+    ('QUINTE WEST', [
         'TRENTON', 'FRANKFORD', 'BATAWA', 'QUINTE W'  # Abbreviated form
-    ],
-    'FERGUS': [
+    ]),
+    ('FERGUS', [
         'CENTRE WELLINGTON',  # Google geocodes to Fergus, original has Centre Wellington
         'SALEM'
-    ],
-    'ELORA': [
+    ]),
+    ('ELORA', [
         'CENTRE WELLINGTON'  # Google geocodes to Elora, original has Centre Wellington
-    ],
-    'CENTRE WELLINGTON': [
+    ]),
+    ('CENTRE WELLINGTON', [
         'ELORA', 'FERGUS', 'SALEM'
-    ],
-    'ACTON': [
+    ]),
+    ('ACTON', [
         'HALTON HILLS'  # Bidirectional mapping
-    ],
-    'GEORGETOWN': [
+    ]),
+    ('GEORGETOWN', [
         'HALTON HILLS'  # Bidirectional mapping
-    ],
-    'HALTON HILLS': [
+    ]),
+    ('HALTON HILLS', [
         'GEORGETOWN', 'ACTON'
-    ],
-    'BRADFORD WEST GWILLIMBURY': [
+    ]),
+    ('BRADFORD WEST GWILLIMBURY', [
         'BRADFORD'
-    ],
-    'EAST GWILLIMBURY': [
-        'E. GWILLIMBURY'
-    ],
-    'NAPANEE': [
+    ]),
+    ('NAPANEE', [
         'GREATER NAPANEE'  # Google geocodes to Napanee, original has Greater Napanee
-    ],
-    'GREATER NAPANEE': [
+    ]),
+    ('GREATER NAPANEE', [
         'NAPANEE'
-    ],
-    'NORTH GRENVILLE': [
+    ]),
+    ('NORTH GRENVILLE', [
         'KEMPTVILLE'
-    ],
-    'SAUGEEN SHORES': [
+    ]),
+    ('SAUGEEN SHORES', [
         'PORT ELGIN', 'SOUTHAMPTON'
-    ],
-    'SAINT MARYS': [
+    ]),
+    ('SAINT MARYS', [
         'ST. MARYS', 'ST MARYS'
-    ],
-    'SAULT STE. MARIE': [
+    ]),
+    ('SAULT STE. MARIE', [
         'SAULT STE MARIE'
-    ],
-    'SAULT STE MARIE': [
+    ]),
+    ('SAULT STE MARIE', [
         'SAULT STE. MARIE'  # Bidirectional for period variation
-    ],
-    'PERTH': [
+    ]),
+    ('PERTH', [
         'N. PERTH', 'N PERTH', 'NORTH PERTH'
-    ],
-    'ANGUS': [
+    ]),
+    ('ANGUS', [
         'ESSA'  # Google geocodes to Angus, original has Essa
-    ],
-    'NOBLETON': [
+    ]),
+    ('NOBLETON', [
         'KING'  # Google geocodes to Nobleton, original has King
-    ],
-    'BELLE RIVER': [
+    ]),
+    ('BELLE RIVER', [
         'LAKESHORE'  # Google geocodes to Belle River, original has Lakeshore
-    ],
-    'INGLEWOOD': [
+    ]),
+    ('INGLEWOOD', [
         'CALEDON'  # Google geocodes to Inglewood, original has Caledon
-    ],
-    'BOLTON': [
+    ]),
+    ('BOLTON', [
         'CALEDON'  # Google geocodes to Bolton, original has Caledon
-    ],
-    'ALTON': [
+    ]),
+    ('ALTON', [
         'CALEDON'  # Google geocodes to Alton, original has Caledon
-    ],
-    'BOWMANVILLE': [
+    ]),
+    ('BOWMANVILLE', [
         'CLARINGTON', 'OSHAWA'  # Google geocodes to Bowmanville, original has Clarington
-    ],
-    'PORT STANLEY': [
+    ]),
+    ('PORT STANLEY', [
         'CENTRAL ELGIN'  # Google geocodes to Port Stanley, original has Central Elgin
-    ],
-    'MARKHAM': [
+    ]),
+    ('MARKHAM', [
         'E. YORK', 'E YORK'  # Some E. York addresses geocode to Markham (border issue)
-    ],
-    'EAST GWILLIMBURY': [
+    ]),
+    ('EAST GWILLIMBURY', [
         'E. GWILLIMBURY', 'E GWILLIMBURY'  # Abbreviation variations
-    ]
-}
+    ]),
+]
 
+CITY_AMALGAMATIONS = dict(_RAW_AMALGAMATIONS)
 
-def build_reverse_lookup():
-    """Build reverse lookup: former municipality → amalgamated city"""
-    reverse = {}
-    for amalgamated, former_list in CITY_AMALGAMATIONS.items():
-        for former in former_list:
-            reverse[former.upper().strip()] = amalgamated.upper()
-    return reverse
+# A repeated key would silently drop the earlier list of former municipalities
+assert len(CITY_AMALGAMATIONS) == len(_RAW_AMALGAMATIONS), "duplicate key in CITY_AMALGAMATIONS"
+
+
+# SQL twin of normalize_city(), applied to both city columns in the query
+NORMALIZED_CITY_SQL = "NULLIF(REPLACE(UPPER(BTRIM({col}, E' \\t\\r\\n')), '.', ''), '')"
+
+_STRIP_DOTS = str.maketrans('', '', '.')
 
 
 def normalize_city(city):
     """Normalize city name for comparison"""
     if not city:
         return None
-    return city.upper().strip().replace('.', '')
+    # trim before dropping periods, like the SQL twin ("X ." -> "X ")
+    return city.upper().strip().translate(_STRIP_DOTS)
 
 
-def check_amalgamation(original_city, google_city, reverse_lookup):
-    """
-    Check if original_city is a former municipality of google_city
+# (normalized former municipality, normalized amalgamated city); a former may
+# belong to several amalgamated cities, so every pair is kept
+AMALGAMATION_PAIRS = frozenset(
+    (normalize_city(former), normalize_city(amalgamated))
+    for amalgamated, former_list in CITY_AMALGAMATIONS.items()
+    for former in former_list
+)
 
-    Returns: (is_amalgamation, amalgamated_city)
-    """
-    original_norm = normalize_city(original_city)
-    google_norm = normalize_city(google_city)
 
-    if not original_norm or not google_norm:
-        return False, None
-
-    # Check if original city is a former municipality
-    if original_norm in reverse_lookup:
-        expected_amalgamated = reverse_lookup[original_norm]
-        # Check if Google returned the correct amalgamated city
-        if google_norm == expected_amalgamated:
-            return True, expected_amalgamated
-
-    return False, None
+def load_amalgamation_table(cur):
+    """Load the amalgamation map into the temp table `amal` for server-side joins"""
+    cur.execute("""
+        CREATE TEMP TABLE amal (
+            former TEXT,
+            amalgamated TEXT,
+            PRIMARY KEY (former, amalgamated)
+        ) ON COMMIT DROP
+    """)
+    execute_values(cur, "INSERT INTO amal (former, amalgamated) VALUES %s", sorted(AMALGAMATION_PAIRS))
 
 
 def add_column_if_not_exists(conn):
-    """Add is_amalgamation_match column if it doesn't exist"""
+    """Add is_amalgamation_match column and its partial index if they don't exist"""
     cur = conn.cursor()
 
     # Check if column exists
@@ -194,6 +194,21 @@ def add_column_if_not_exists(conn):
     else:
         print("✓ Column is_amalgamation_match already exists\n")
 
+    # Partial index over the rows still to analyze, so re-runs skip resolved
+    # ones instead of scanning the whole table (CONCURRENTLY needs autocommit)
+    conn.commit()
+    conn.autocommit = True
+    try:
+        cur.execute("""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_geo_needs_amal
+            ON google_geocoded_addresses (source_id)
+            WHERE is_amalgamation_match = FALSE
+                AND source_table = 'transaction_address_expansion_parse'
+                AND google_city IS NOT NULL
+        """)
+    finally:
+        conn.autocommit = False
+
     cur.close()
 
 
@@ -211,53 +226,49 @@ def analyze_amalgamations(dry_run=True):
     print("=" * 100)
     print()
 
-    # Build reverse lookup
-    reverse_lookup = build_reverse_lookup()
+    load_amalgamation_table(cur)
 
-    # Fetch all city mismatches
-    cur.execute("""
+    # Classify every city mismatch server-side; rows that only differ by case,
+    # whitespace or periods are the same city and aren't mismatches. A row is
+    # an amalgamation when (original, google) is a pair in `amal`.
+    original_norm_sql = NORMALIZED_CITY_SQL.format(col='p.original_city_raw')
+    google_norm_sql = NORMALIZED_CITY_SQL.format(col='g.google_city')
+    cur.execute(f"""
+        CREATE TEMP TABLE amal_mismatch ON COMMIT DROP AS
         SELECT
             g.id,
-            p.original_city_raw,
+            p.original_city_raw AS original_city,
             g.google_city,
-            p.expanded_full_address,
-            g.google_formatted_address
+            amal.amalgamated AS amalgamated_city
         FROM google_geocoded_addresses g
         JOIN transaction_address_expansion_parse p ON p.id = g.source_id
+        LEFT JOIN amal
+            ON amal.former = {original_norm_sql}
+            AND amal.amalgamated = {google_norm_sql}
         WHERE g.source_table = 'transaction_address_expansion_parse'
             AND p.original_city_raw IS NOT NULL
             AND g.google_city IS NOT NULL
             AND p.original_city_raw != g.google_city
+            AND {original_norm_sql} IS DISTINCT FROM {google_norm_sql}
             AND g.is_amalgamation_match = FALSE
-        ORDER BY p.original_city_raw, g.google_city
     """)
 
-    mismatches = cur.fetchall()
-    total_mismatches = len(mismatches)
+    cur.execute("""
+        SELECT
+            COUNT(*),
+            COUNT(*) FILTER (WHERE amalgamated_city IS NOT NULL)
+        FROM amal_mismatch
+    """)
+    total_mismatches, amalgamation_count = cur.fetchone()
+    non_amalgamation_count = total_mismatches - amalgamation_count
 
     print(f"Found {total_mismatches} city mismatches to analyze\n")
 
-    # Analyze each mismatch
-    amalgamations_found = []
-    non_amalgamations = []
-
-    for geocode_id, original_city, google_city, expanded_addr, google_formatted in mismatches:
-        is_amal, amalgamated_city = check_amalgamation(original_city, google_city, reverse_lookup)
-
-        if is_amal:
-            amalgamations_found.append({
-                'id': geocode_id,
-                'original_city': original_city,
-                'google_city': google_city,
-                'amalgamated_city': amalgamated_city,
-                'address': expanded_addr
-            })
-        else:
-            non_amalgamations.append({
-                'original_city': original_city,
-                'google_city': google_city,
-                'address': expanded_addr
-            })
+    if total_mismatches == 0:
+        conn.commit()
+        cur.close()
+        conn.close()
+        return 0, 0
 
     # Report Results
     print("=" * 100)
@@ -265,91 +276,85 @@ def analyze_amalgamations(dry_run=True):
     print("=" * 100)
     print()
 
-    print(f"✓ Confirmed Amalgamations: {len(amalgamations_found)} ({len(amalgamations_found)*100/total_mismatches:.1f}%)")
-    print(f"⚠️  Non-Amalgamations: {len(non_amalgamations)} ({len(non_amalgamations)*100/total_mismatches:.1f}%)")
+    print(f"✓ Confirmed Amalgamations: {amalgamation_count} ({amalgamation_count*100/total_mismatches:.1f}%)")
+    print(f"⚠️  Non-Amalgamations: {non_amalgamation_count} ({non_amalgamation_count*100/total_mismatches:.1f}%)")
     print()
 
     # Show confirmed amalgamations by city
-    if amalgamations_found:
+    if amalgamation_count:
         print("CONFIRMED AMALGAMATIONS BY CITY:")
         print("-" * 100)
 
-        # Group by amalgamated city
-        by_city = {}
-        for amal in amalgamations_found:
-            city = amal['amalgamated_city']
-            if city not in by_city:
-                by_city[city] = []
-            by_city[city].append(amal)
-
-        for city, records in sorted(by_city.items()):
-            # Group by original city
-            by_original = {}
-            for rec in records:
-                orig = rec['original_city']
-                if orig not in by_original:
-                    by_original[orig] = 0
-                by_original[orig] += 1
-
-            print(f"\n{city}:")
-            for orig, count in sorted(by_original.items()):
-                print(f"  {orig} → {city}: {count} addresses")
+        cur.execute("""
+            SELECT amalgamated_city, original_city, COUNT(*)
+            FROM amal_mismatch
+            WHERE amalgamated_city IS NOT NULL
+            GROUP BY amalgamated_city, original_city
+            ORDER BY amalgamated_city, original_city
+        """)
+
+        current_city = None
+        for city, orig, count in cur.fetchall():
+            if city != current_city:
+                print(f"\n{city}:")
+                current_city = city
+            print(f"  {orig} → {city}: {count} addresses")
 
         print()
 
     # Show sample non-amalgamations
-    if non_amalgamations:
+    if non_amalgamation_count:
         print("NON-AMALGAMATION MISMATCHES (Sample - may need manual review):")
         print("-" * 100)
 
-        # Group by original → google city
-        mismatch_counts = {}
-        for rec in non_amalgamations:
-            key = (rec['original_city'], rec['google_city'])
-            if key not in mismatch_counts:
-                mismatch_counts[key] = 0
-            mismatch_counts[key] += 1
-
-        # Show top 10
-        for (orig, google), count in sorted(mismatch_counts.items(), key=lambda x: x[1], reverse=True)[:10]:
+        # Top 10 original → google city pairs
+        cur.execute("""
+            SELECT original_city, google_city, COUNT(*) AS n
+            FROM amal_mismatch
+            WHERE amalgamated_city IS NULL
+            GROUP BY original_city, google_city
+            ORDER BY n DESC
+            LIMIT 10
+        """)
+        for orig, google, count in cur.fetchall():
             print(f"  {orig} → {google}: {count} addresses")
 
         print()
 
     # Apply changes if requested
-    if not dry_run and amalgamations_found:
+    if not dry_run and amalgamation_count:
         print("=" * 100)
         print("APPLYING CHANGES TO DATABASE")
         print("=" * 100)
         print()
 
-        ids_to_update = [amal['id'] for amal in amalgamations_found]
-
-        # Update in batches for safety
-        for geocode_id in ids_to_update:
-            cur.execute("""
-                UPDATE google_geocoded_addresses
-                SET is_amalgamation_match = TRUE
-                WHERE id = %s
-            """, (geocode_id,))
+        cur.execute("""
+            UPDATE google_geocoded_addresses g
+            SET is_amalgamation_match = TRUE
+            FROM amal_mismatch m
+            WHERE g.id = m.id
+                AND m.amalgamated_city IS NOT NULL
+        """)
+        updated = cur.rowcount
 
         conn.commit()
 
-        print(f"✓ Updated {len(ids_to_update)} records with is_amalgamation_match = TRUE")
+        print(f"✓ Updated {updated} records with is_amalgamation_match = TRUE")
         print()
 
-    elif dry_run and amalgamations_found:
+    elif dry_run and amalgamation_count:
         print("=" * 100)
         print("DRY RUN MODE - No changes made to database")
         print("=" * 100)
         print()
-        print(f"Run with --apply flag to update {len(amalgamations_found)} records")
+        print(f"Run with --apply flag to update {amalgamation_count} records")
         print()
 
+    conn.commit()  # drops the temp tables
     cur.close()
     conn.close()
 
-    return len(amalgamations_found), len(non_amalgamations)
+    return amalgamation_count, non_amalgamation_count
 
 
 if __name__ == "__main__":
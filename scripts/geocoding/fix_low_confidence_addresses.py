@@ -4,12 +4,66 @@ Re-geocodes addresses that failed with standard geocoding
 """
 import os
 import sys
-import time
+from concurrent.futures import ThreadPoolExecutor
+
+import orjson
 import psycopg2
-from psycopg2.extras import Json
+from psycopg2.extras import Json, execute_values
 
 sys.path.insert(0, '/Users/brandonolsen23/Development/cleo-project-REBOOT')
 from common.enhanced_geocoder import EnhancedGeocoder
+from common.google_geocoder import TokenBucket
+
+
+FLUSH_EVERY = 100
+PROGRESS_EVERY = 500
+GEOCODE_WORKERS = 8
+GOOGLE_MAX_QPS = float(os.getenv("GOOGLE_MAX_QPS", "20"))  # global cap shared by all workers (well under Google's 50 QPS)
+
+
+class OrJson(Json):
+    """psycopg2 Json adapter that serializes with orjson (much faster on Google's nested responses)."""
+
+    def dumps(self, obj):
+        return orjson.dumps(obj).decode()
+
+
+def flush_updates(cur, fixed_rows, failed_rows):
+    """Write buffered geocode results with one UPDATE per outcome."""
+    if fixed_rows:
+        execute_values(cur, """
+            UPDATE google_geocoded_addresses g
+            SET
+                google_formatted_address = v.formatted,
+                google_street_number = v.street_number,
+                google_street = v.street,
+                google_city = v.city,
+                google_province = v.province,
+                google_postal_code = v.postal,
+                google_latitude = v.lat,
+                google_longitude = v.lng,
+                google_place_id = v.place_id,
+                google_confidence = v.confidence,
+                google_raw_response = v.raw,
+                geocode_method = v.method,
+                needs_manual_review = FALSE
+            FROM (VALUES %s) AS v(id, formatted, street_number, street, city, province, postal,
+                                  lat, lng, place_id, confidence, raw, method)
+            WHERE g.id = v.id
+        """, fixed_rows,
+            template="(%s::uuid, %s, %s, %s, %s, %s, %s, %s::numeric, %s::numeric, %s, %s::text, %s::jsonb, %s)")
+    if failed_rows:
+        # Still failed - flag for manual review
+        execute_values(cur, """
+            UPDATE google_geocoded_addresses g
+            SET
+                needs_manual_review = TRUE,
+                geocode_method = v.method
+            FROM (VALUES %s) AS v(id, method)
+            WHERE g.id = v.id
+        """, failed_rows, template="(%s::uuid, %s)")
+    fixed_rows.clear()
+    failed_rows.clear()
 
 
 def fix_low_confidence_addresses():
@@ -17,7 +71,10 @@ def fix_low_confidence_addresses():
 
     conn = psycopg2.connect(os.environ['DATABASE_URL'])
     cur = conn.cursor()
-    geocoder = EnhancedGeocoder()
+    # The shared bucket caps global QPS; EnhancedGeocoder charges it per
+    # Google request, so a geocode + text-search fallback costs two tokens
+    limiter = TokenBucket(GOOGLE_MAX_QPS, burst=GEOCODE_WORKERS)
+    geocoder = EnhancedGeocoder(limiter=limiter)
 
     if not geocoder.available():
         print("❌ Google API key not found!")
@@ -50,75 +107,55 @@ def fix_low_confidence_addresses():
 
     fixed_count = 0
     still_failed = 0
-
-    for i, (geocode_id, input_addr, expanded_addr, original_addr, postal, formatted) in enumerate(addresses, 1):
-        print(f"[{i}/{total}] {expanded_addr}")
-        print(f"  Current: {formatted or 'NO FORMATTED ADDRESS'}")
-        print(f"  Postal: {postal or 'NO POSTAL'}")
-
-        # Use enhanced geocoder with fallback
-        result = geocoder.geocode_with_fallback(input_addr)
-
-        if result.get('components', {}).get('postal_code'):
-            # Success! Update the record
-            components = result['components']
-            location = result['location']
-
-            cur.execute("""
-                UPDATE google_geocoded_addresses
-                SET
-                    google_formatted_address = %s,
-                    google_street_number = %s,
-                    google_street = %s,
-                    google_city = %s,
-                    google_province = %s,
-                    google_postal_code = %s,
-                    google_latitude = %s,
-                    google_longitude = %s,
-                    google_place_id = %s,
-                    google_confidence = %s,
-                    google_raw_response = %s,
-                    geocode_method = %s,
-                    needs_manual_review = FALSE
-                WHERE id = %s
-            """, (
-                result.get('formatted_address'),
-                components.get('street_number'),
-                components.get('street'),
-                components.get('city'),
-                components.get('province'),
-                components.get('postal_code'),
-                location.get('lat'),
-                location.get('lng'),
-                result.get('place_id'),
-                result.get('confidence'),
-                Json(result.get('raw')),
-                result.get('method'),
-                geocode_id
-            ))
-
-            fixed_count += 1
-            print(f"  ✓ FIXED ({result.get('method')}): {result.get('formatted_address')}")
-            print(f"    Postal: {components.get('postal_code')}")
-        else:
-            # Still failed - flag for manual review
-            cur.execute("""
-                UPDATE google_geocoded_addresses
-                SET
-                    needs_manual_review = TRUE,
-                    geocode_method = %s
-                WHERE id = %s
-            """, (
-                result.get('method', 'geocoding'),
-                geocode_id
-            ))
-
-            still_failed += 1
-            print(f"  ✗ STILL FAILED - flagged for manual review")
-
-        conn.commit()
-        time.sleep(0.3)  # Rate limiting
-        print()
+    fixed_rows = []
+    failed_rows = []
+
+    # API calls run on the pool; results come back in input order and all DB
+    # writes stay on this thread's single connection.
+    with ThreadPoolExecutor(max_workers=GEOCODE_WORKERS) as executor:
+        results = executor.map(geocoder.geocode_with_fallback, (row[1] for row in addresses))
+
+        for i, ((geocode_id, input_addr, expanded_addr, original_addr, postal, formatted), result) in enumerate(
+                zip(addresses, results), 1):
+            if result.get('components', {}).get('postal_code'):
+                # Success! Update the record
+                components = result['components']
+                location = result['location']
+
+                fixed_rows.append((
+                    geocode_id,
+                    result.get('formatted_address'),
+                    components.get('street_number'),
+                    components.get('street'),
+                    components.get('city'),
+                    components.get('province'),
+                    components.get('postal_code'),
+                    location.get('lat'),
+                    location.get('lng'),
+                    result.get('place_id'),
+                    result.get('confidence'),
+                    OrJson(result.get('raw')),
+                    result.get('method'),
+                ))
+
+                fixed_count += 1
+            else:
+                # Still failed - flag for manual review
+                failed_rows.append((geocode_id, result.get('method', 'geocoding')))
+
+                still_failed += 1
+
+            # Write and commit in batches rather than once per address
+            if i % FLUSH_EVERY == 0:
+                flush_updates(cur, fixed_rows, failed_rows)
+                conn.commit()
+
+            # One summary line per PROGRESS_EVERY rows instead of per-address output
+            if i % PROGRESS_EVERY == 0 or i == total:
+                print(f"[{i}/{total}] ✓ fixed {fixed_count}, ✗ still failed {still_failed}", flush=True)
+
+    flush_updates(cur, fixed_rows, failed_rows)
+    conn.commit()
 
     print("=" * 100)
     print("RESULTS")
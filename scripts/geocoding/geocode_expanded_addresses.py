@@ -4,16 +4,32 @@ Stores results in google_geocoded_addresses and links in transaction_address_lin
 """
 import os
 import sys
-import time
+from itertools import islice
+
 import psycopg2
-from psycopg2.extras import Json
+from tqdm import tqdm
 
 sys.path.insert(0, '/Users/brandonolsen23/Development/cleo-project-REBOOT')
+from common.geocode_store import GeocodeCache, geocoded_row, write_geocoded
 from common.google_geocoder import GoogleGeocoder
 
 
-def geocode_expanded_addresses(limit=None):
-    """Geocode expanded addresses with Google API"""
+MAX_CONCURRENCY = 10  # Google requests in flight
+GOOGLE_MAX_QPS = float(os.getenv("GOOGLE_MAX_QPS", "20"))  # shared request rate cap
+FLUSH_EVERY = 500  # rows per COPY/commit
+STREAM_CHUNK = 1000  # rows fetched and geocoded per round
+
+
+def geocode_expanded_addresses(limit=None, verbose=False, after=None):
+    """
+    Geocode expanded addresses with Google API
+
+    Args:
+        limit: Optional cap on addresses to geocode
+        verbose: Also print every geocoded address (failures are always shown)
+        after: Only consider expansions created at or after this timestamp
+            (the resume point printed by the previous run)
+    """
 
     conn = psycopg2.connect(os.environ['DATABASE_URL'])
     cur = conn.cursor()
@@ -26,140 +42,87 @@ def geocode_expanded_addresses(limit=None):
     print(f"Geocoding expanded addresses...")
     print("=" * 100)
 
-    # Get expanded addresses that haven't been geocoded yet
-    query = """
+    # Source ids that already have a geocode, prefetched once so the selection
+    # below is a plain ordered scan instead of a NOT EXISTS anti-join
+    cur.execute("""
+        SELECT source_id FROM google_geocoded_addresses
+        WHERE source_table = 'transaction_address_expansion_parse'
+    """)
+    geocoded_ids = {source_id for (source_id,) in cur}
+
+    # Stream expanded addresses that haven't been geocoded yet, in (created_at, id)
+    # order from the resume point. The server-side cursor lives on its own
+    # read-only connection whose transaction stays open for the whole scan, so
+    # the batch commits on conn never force Postgres to materialize the rest
+    # of the result set (as a WITH HOLD cursor would)
+    read_conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    read_conn.set_session(readonly=True)
+    scan = read_conn.cursor(name='expanded_stream')
+    scan.itersize = STREAM_CHUNK
+    scan.execute("""
         SELECT p.id, p.transaction_id, p.expanded_full_address,
                p.is_multi_property, p.pattern_type, p.address_position,
-               p.original_address_raw
+               p.original_address_raw, p.created_at
         FROM transaction_address_expansion_parse p
-        WHERE NOT EXISTS (
-            SELECT 1 FROM google_geocoded_addresses g
-            WHERE g.source_table = 'transaction_address_expansion_parse'
-            AND g.source_id = p.id
-        )
-        ORDER BY p.created_at
-    """
+        WHERE %(after)s::timestamptz IS NULL OR p.created_at >= %(after)s::timestamptz
+        ORDER BY p.created_at, p.id
+    """, {'after': after})
 
-    if limit:
-        query += f" LIMIT {limit}"
+    pending = islice((row for row in scan if row[0] not in geocoded_ids), limit or None)
 
-    cur.execute(query)
-
-    addresses = cur.fetchall()
-    total = len(addresses)
-
-    print(f"Found {total} expanded addresses to geocode\n")
+    print(f"Streaming expanded addresses to geocode\n")
 
     success_count = 0
     failure_count = 0
     ontario_count = 0
+    total = 0
 
-    for i, (parsed_id, tx_id, expanded_addr, is_multi, pattern_type, addr_pos, original_addr) in enumerate(addresses, 1):
-        # Add "Ontario" to improve accuracy (key fix!)
-        geocode_input = f"{expanded_addr}, Ontario"
+    # Only cache misses (geocode_cache) go to Google
+    cache = GeocodeCache(cur)
 
-        print(f"[{i}/{total}] {geocode_input[:75]}")
+    def geocoded_stream():
+        """Geocode STREAM_CHUNK rows at a time as they arrive from the cursor."""
+        # One run for the whole stream so GOOGLE_MAX_QPS holds across chunks
+        with geocoder.open_run(max_concurrency=MAX_CONCURRENCY, max_qps=GOOGLE_MAX_QPS) as run:
+            for chunk in iter(lambda: list(islice(pending, STREAM_CHUNK)), []):
+                # Add "Ontario" to improve accuracy (key fix!), then geocode concurrently
+                inputs = [f"{row[2]}, Ontario" for row in chunk]
+                yield from zip(chunk, inputs, cache.geocode_iter(run, inputs))
 
-        # Geocode with Google
-        result = geocoder.geocode(geocode_input)
+    pending_geo = []
+    pending_links = []
 
-        geocoded_address_id = None
+    rows = tqdm(geocoded_stream(), total=limit, unit='addr', desc='   Geocoded',
+                mininterval=0.5, dynamic_ncols=True)
+    resume_at = None
+    for ((parsed_id, tx_id, expanded_addr, is_multi, pattern_type, addr_pos, original_addr, resume_at),
+            geocode_input, result) in rows:
+        total += 1
+
+        geo_row = geocoded_row('transaction_address_expansion_parse', parsed_id, geocode_input, result)
+        pending_geo.append(geo_row)
 
         if result:
             components = result.get('components', {})
-            location = result.get('location', {})
             province = components.get('province', '')
-
-            # Insert into google_geocoded_addresses
-            cur.execute("""
-                INSERT INTO google_geocoded_addresses (
-                    source_table,
-                    source_id,
-                    input_address,
-                    google_formatted_address,
-                    google_street_number,
-                    google_street,
-                    google_city,
-                    google_province,
-                    google_postal_code,
-                    google_latitude,
-                    google_longitude,
-                    google_place_id,
-                    google_confidence,
-                    geocode_success,
-                    google_raw_response
-                ) VALUES (
-                    'transaction_address_expansion_parse',
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-                )
-                RETURNING id
-            """, (
-                parsed_id,
-                geocode_input,
-                result.get('formatted_address'),
-                components.get('street_number'),
-                components.get('street'),
-                components.get('city'),
-                province,
-                components.get('postal_code'),
-                location.get('lat'),
-                location.get('lng'),
-                result.get('place_id'),
-                result.get('confidence'),
-                True,
-                Json(result.get('raw'))
-            ))
-
-            geocoded_address_id = cur.fetchone()[0]
             success_count += 1
 
             if province == 'ON':
                 ontario_count += 1
 
-            postal = components.get('postal_code', 'NO POSTAL')
-            print(f"  ✓ {components.get('city')}, {province} {postal}")
+            if verbose:
+                postal = components.get('postal_code', 'NO POSTAL')
+                tqdm.write(f"  ✓ {geocode_input[:75]}\n"
+                           f"    {components.get('city')}, {province} {postal}")
 
         else:
-            # Insert failure
-            cur.execute("""
-                INSERT INTO google_geocoded_addresses (
-                    source_table,
-                    source_id,
-                    input_address,
-                    geocode_success,
-                    geocode_error
-                ) VALUES (
-                    'transaction_address_expansion_parse',
-                    %s, %s, %s, %s
-                )
-                RETURNING id
-            """, (
-                parsed_id,
-                geocode_input,
-                False,
-                'No result from Google API'
-            ))
-
-            geocoded_address_id = cur.fetchone()[0]
             failure_count += 1
-            print(f"  ✗ FAILED")
+            tqdm.write(f"  ✗ FAILED: {geocode_input[:75]}")
 
         # Link to transaction
-        cur.execute("""
-            INSERT INTO transaction_address_links (
-                transaction_id,
-                geocoded_address_id,
-                is_multi_property,
-                original_address,
-                pattern_type,
-                address_position,
-                is_primary
-            ) VALUES (
-                %s, %s, %s, %s, %s, %s, %s
-            )
-        """, (
+        pending_links.append((
             tx_id,
-            geocoded_address_id,
+            geo_row[0],
             is_multi,
             original_addr,
             pattern_type,
@@ -167,13 +130,25 @@ def geocode_expanded_addresses(limit=None):
             addr_pos == 1  # First address is primary
         ))
 
-        conn.commit()
-
-        # Rate limiting - be nice to Google
-        if i % 10 == 0:
-            time.sleep(1)
-        else:
-            time.sleep(0.3)
+        # Write and commit in batches rather than once per address
+        if len(pending_geo) >= FLUSH_EVERY:
+            write_geocoded(cur, pending_geo, pending_links)
+            cache.flush()
+            conn.commit()
+            pending_geo.clear()
+            pending_links.clear()
+
+    write_geocoded(cur, pending_geo, pending_links)
+    cache.flush()
+    conn.commit()
+    scan.close()
+    read_conn.close()
+
+    if not total:
+        print("No expanded addresses left to geocode")
+        cur.close()
+        conn.close()
+        return
 
     print("\n" + "=" * 100)
     print("GEOCODING COMPLETE")
@@ -183,6 +158,7 @@ def geocode_expanded_addresses(limit=None):
     print(f"Failed: {failure_count} ({failure_count*100/total:.1f}%)")
     print(f"Ontario addresses: {ontario_count} ({ontario_count*100/total:.1f}%)")
     print(f"With postal codes: {success_count} (Google always returns postal for successful geocodes)")
+    print(f"Resume with: --after '{resume_at.isoformat()}'")
 
     cur.close()
     conn.close()
@@ -192,6 +168,10 @@ if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description='Geocode expanded addresses')
     parser.add_argument('--limit', type=int, default=None, help='Limit number of addresses (optional)')
+    parser.add_argument('--verbose', action='store_true', help='Print every geocoded address')
+    parser.add_argument('--after', default=None,
+                        help="Resume point: only expansions created at or after this timestamp "
+                             "(e.g. '2025-10-01 12:00:00')")
     args = parser.parse_args()
 
-    geocode_expanded_addresses(args.limit)
+    geocode_expanded_addresses(args.limit, args.verbose, args.after)
@@ -4,17 +4,30 @@ Stores results in google_geocoded_addresses table
 """
 import os
 import sys
-import time
 import psycopg2
-from psycopg2.extras import Json
+from tqdm import tqdm
 
 # Add project root to path
 sys.path.insert(0, '/Users/brandonolsen23/Development/cleo-project-REBOOT')
+from common.geocode_store import GeocodeCache, geocoded_row, write_geocoded
 from common.google_geocoder import GoogleGeocoder
 
 
-def geocode_transactions_batch(limit=100):
-    """Geocode a batch of transaction addresses"""
+MAX_CONCURRENCY = 10  # Google requests in flight
+GOOGLE_MAX_QPS = float(os.getenv("GOOGLE_MAX_QPS", "20"))  # shared request rate cap
+FLUSH_EVERY = 500  # rows per COPY/commit
+
+
+def geocode_transactions_batch(limit=100, verbose=False, after=None):
+    """
+    Geocode a batch of transaction addresses
+
+    Args:
+        limit: Number of transactions to geocode
+        verbose: Also print every geocoded address (failures are always shown)
+        after: Only consider transactions created at or before this timestamp
+            (the resume point printed by the previous run)
+    """
 
     conn = psycopg2.connect(os.environ['DATABASE_URL'])
     cur = conn.cursor()
@@ -27,17 +40,19 @@ def geocode_transactions_batch(limit=100):
     print(f"Starting geocoding of {limit} transaction addresses...")
     print("=" * 100)
 
-    # Get transactions that haven't been geocoded yet
+    # Get transactions that haven't been geocoded yet, walking (created_at, id)
+    # downwards from the resume point so each run only reads one bounded page
     cur.execute("""
-        SELECT t.id, t.address_raw, t.city_raw, t.property_id
+        SELECT t.id, t.address_raw, t.city_raw, t.property_id, t.created_at
         FROM transactions t
         LEFT JOIN google_geocoded_addresses g
             ON g.source_table = 'transactions' AND g.source_id = t.id
         WHERE g.id IS NULL
             AND t.address_raw IS NOT NULL
-        ORDER BY t.created_at DESC
-        LIMIT %s
-    """, (limit,))
+            AND (%(after)s::timestamptz IS NULL OR t.created_at <= %(after)s::timestamptz)
+        ORDER BY t.created_at DESC, t.id DESC
+        LIMIT %(limit)s
+    """, {'after': after, 'limit': limit})
 
     transactions = cur.fetchall()
     total = len(transactions)
@@ -48,92 +63,48 @@ def geocode_transactions_batch(limit=100):
     failure_count = 0
     ontario_count = 0
 
-    for i, (tx_id, address_raw, city_raw, property_id) in enumerate(transactions, 1):
-        # Build full address
-        input_address = f"{address_raw}, {city_raw}" if city_raw else address_raw
+    # Build full addresses and geocode them concurrently; results arrive in order
+    inputs = [
+        f"{address_raw}, {city_raw}" if city_raw else address_raw
+        for (_, address_raw, city_raw, _, _) in transactions
+    ]
+    # Only cache misses (geocode_cache) go to Google
+    cache = GeocodeCache(cur)
+    results = cache.geocode_iter(geocoder, inputs, max_concurrency=MAX_CONCURRENCY,
+                                 max_qps=GOOGLE_MAX_QPS)
 
-        print(f"[{i}/{total}] {input_address[:70]}")
+    pending_geo = []
 
-        # Geocode with Google
-        result = geocoder.geocode(input_address)
+    rows = tqdm(zip(transactions, inputs, results), total=total, unit='addr',
+                desc='   Geocoded', mininterval=0.5, dynamic_ncols=True)
+    for (tx_id, address_raw, city_raw, property_id, _), input_address, result in rows:
+        pending_geo.append(geocoded_row('transactions', tx_id, input_address, result))
 
         if result:
             components = result.get('components', {})
-            location = result.get('location', {})
-
-            # Insert successful result
-            cur.execute("""
-                INSERT INTO google_geocoded_addresses (
-                    source_table,
-                    source_id,
-                    input_address,
-                    google_formatted_address,
-                    google_street_number,
-                    google_street,
-                    google_city,
-                    google_province,
-                    google_postal_code,
-                    google_latitude,
-                    google_longitude,
-                    google_place_id,
-                    google_confidence,
-                    geocode_success,
-                    google_raw_response
-                ) VALUES (
-                    'transactions',
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-                )
-            """, (
-                tx_id,
-                input_address,
-                result.get('formatted_address'),
-                components.get('street_number'),
-                components.get('street'),
-                components.get('city'),
-                components.get('province'),
-                components.get('postal_code'),
-                location.get('lat'),
-                location.get('lng'),
-                result.get('place_id'),
-                result.get('confidence'),
-                True,
-                Json(result.get('raw'))
-            ))
-
             province = components.get('province', '')
-            print(f"  ✓ {result.get('formatted_address')[:60]}")
-            print(f"    {components.get('city')}, {province} {components.get('postal_code')}")
+            if verbose:
+                tqdm.write(f"  ✓ {input_address[:70]}\n"
+                           f"    {result.get('formatted_address')[:60]}\n"
+                           f"    {components.get('city')}, {province} {components.get('postal_code')}")
 
             success_count += 1
             if province == 'ON':
                 ontario_count += 1
         else:
-            # Insert failure
-            cur.execute("""
-                INSERT INTO google_geocoded_addresses (
-                    source_table,
-                    source_id,
-                    input_address,
-                    geocode_success,
-                    geocode_error
-                ) VALUES (
-                    'transactions', %s, %s, %s, %s
-                )
-            """, (
-                tx_id,
-                input_address,
-                False,
-                'No result from Google API'
-            ))
-
-            print(f"  ✗ FAILED")
+            tqdm.write(f"  ✗ FAILED: {input_address[:70]}")
             failure_count += 1
 
-        conn.commit()
+        # Write and commit in batches rather than once per address
+        if len(pending_geo) >= FLUSH_EVERY:
+            write_geocoded(cur, pending_geo)
+            cache.flush()
+            conn.commit()
+            pending_geo.clear()
 
-        # Rate limiting - be polite to Google
-        if i % 10 == 0:
-            time.sleep(1)
+    write_geocoded(cur, pending_geo)
+    cache.flush()
+    conn.commit()
 
     print("\n" + "=" * 100)
     print("BATCH COMPLETE")
@@ -143,6 +114,8 @@ def geocode_transactions_batch(limit=100):
     print(f"Failed: {failure_count} ({failure_count*100/total:.1f}%)")
     print(f"Ontario addresses: {ontario_count} ({ontario_count*100/total:.1f}%)")
     print(f"With postal codes: {success_count} ({success_count*100/total:.1f}%)")
+    if transactions:
+        print(f"Resume with: --after '{transactions[-1][4].isoformat()}'")
 
     cur.close()
     conn.close()
@@ -152,6 +125,10 @@ if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description='Geocode transaction addresses')
     parser.add_argument('--limit', type=int, default=100, help='Number of addresses to geocode')
+    parser.add_argument('--verbose', action='store_true', help='Print every geocoded address')
+    parser.add_argument('--after', default=None,
+                        help="Resume point: only transactions created at or before this timestamp "
+                             "(e.g. '2025-10-01 12:00:00')")
     args = parser.parse_args()
 
-    geocode_transactions_batch(args.limit)
+    geocode_transactions_batch(args.limit, args.verbose, args.after)
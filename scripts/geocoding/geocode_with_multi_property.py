@@ -4,17 +4,31 @@ Stores results in google_geocoded_addresses and links in transaction_address_lin
 """
 import os
 import sys
-import time
+from itertools import groupby
+
 import psycopg2
-from psycopg2.extras import Json
+from tqdm import tqdm
 
 sys.path.insert(0, '/Users/brandonolsen23/Development/cleo-project-REBOOT')
+from common.geocode_store import GeocodeCache, geocoded_row, write_geocoded
 from common.google_geocoder import GoogleGeocoder
-from common.multi_property_parser import MultiPropertyAddressParser
 
 
-def geocode_with_multi_property(limit=100):
-    """Geocode transactions, handling multi-property addresses"""
+MAX_CONCURRENCY = 10  # Google requests in flight
+GOOGLE_MAX_QPS = float(os.getenv("GOOGLE_MAX_QPS", "20"))  # shared request rate cap
+FLUSH_EVERY = 500  # rows per COPY/commit
+
+
+def geocode_with_multi_property(limit=100, verbose=False, after=None):
+    """
+    Geocode transactions, handling multi-property addresses
+
+    Args:
+        limit: Number of transactions to process
+        verbose: Also print every transaction and geocoded address (failures are always shown)
+        after: Only consider transactions created at or before this timestamp
+            (the resume point printed by the previous run)
+    """
 
     conn = psycopg2.connect(os.environ['DATABASE_URL'])
     cur = conn.cursor()
@@ -27,22 +41,46 @@ def geocode_with_multi_property(limit=100):
     print(f"Starting geocoding with multi-property parsing (limit: {limit})...")
     print("=" * 100)
 
-    # Get transactions that haven't been processed yet
-    # Skip transactions already in google_geocoded_addresses
+    # Get transactions that haven't been processed yet, with the addresses
+    # already expanded into transaction_address_expansion_parse by
+    # scripts/parsing/parse_transaction_addresses.py (unparsed ones wait for it)
+    # Skip transactions already in google_geocoded_addresses, and walk
+    # (created_at, id) downwards from the resume point so each run reads one page
     cur.execute("""
-        SELECT t.id, t.address_raw, t.city_raw
-        FROM transactions t
-        WHERE t.address_raw IS NOT NULL
-            AND NOT EXISTS (
-                SELECT 1 FROM google_geocoded_addresses g
-                WHERE g.source_table = 'transactions' AND g.source_id = t.id
-            )
-        ORDER BY t.created_at DESC
-        LIMIT %s
-    """, (limit,))
-
-    transactions = cur.fetchall()
-    total = len(transactions)
+        SELECT t.id, t.address_raw, t.city_raw, t.created_at,
+               p.is_multi_property, p.pattern_type, p.expanded_full_address, p.address_position
+        FROM (
+            SELECT t.id, t.address_raw, t.city_raw, t.created_at
+            FROM transactions t
+            WHERE t.address_raw IS NOT NULL
+                AND (%(after)s::timestamptz IS NULL OR t.created_at <= %(after)s::timestamptz)
+                AND EXISTS (
+                    SELECT 1 FROM transaction_address_expansion_parse p
+                    WHERE p.transaction_id = t.id
+                )
+                AND NOT EXISTS (
+                    SELECT 1 FROM google_geocoded_addresses g
+                    WHERE g.source_table = 'transactions' AND g.source_id = t.id
+                )
+            ORDER BY t.created_at DESC, t.id DESC
+            LIMIT %(limit)s
+        ) t
+        JOIN transaction_address_expansion_parse p ON p.transaction_id = t.id
+        ORDER BY t.created_at DESC, t.id DESC, p.address_position
+    """, {'after': after, 'limit': limit})
+
+    # Rebuild the MultiPropertyAddressParser.parse() shape from the stored rows
+    parsed_transactions = []
+    resume_at = None
+    for (tx_id, address_raw, city_raw, resume_at), rows in groupby(cur.fetchall(), key=lambda row: row[:4]):
+        rows = list(rows)
+        parsed_transactions.append((tx_id, address_raw, city_raw, {
+            'is_multi_property': rows[0][4],
+            'pattern_type': rows[0][5],
+            'original_address': f"{address_raw}, {city_raw}" if city_raw else address_raw,
+            'addresses': [{'full_address': row[6], 'position': row[7]} for row in rows],
+        }))
+    total = len(parsed_transactions)
 
     print(f"Found {total} transactions to process\n")
 
@@ -51,119 +89,57 @@ def geocode_with_multi_property(limit=100):
     multi_property_count = 0
     total_addresses_geocoded = 0
 
-    for i, (tx_id, address_raw, city_raw) in enumerate(transactions, 1):
-        print(f"[{i}/{total}] Processing: {address_raw}, {city_raw or 'NO CITY'}")
-
-        # Parse for multi-property
-        parsed = MultiPropertyAddressParser.parse(address_raw, city_raw)
+    # Add "Ontario" to improve accuracy
+    inputs = [
+        f"{addr_data['full_address']}, Ontario"
+        for _, _, _, parsed in parsed_transactions
+        for addr_data in parsed['addresses']
+    ]
+    # Only cache misses (geocode_cache) go to Google
+    cache = GeocodeCache(cur)
+    results = cache.geocode_iter(geocoder, inputs, max_concurrency=MAX_CONCURRENCY,
+                                 max_qps=GOOGLE_MAX_QPS)
+
+    pending_geo = []
+    pending_links = []
+
+    transactions = tqdm(parsed_transactions, unit='tx', desc='   Processed',
+                        mininterval=0.5, dynamic_ncols=True)
+    for tx_id, address_raw, city_raw, parsed in transactions:
+        if verbose:
+            tqdm.write(f"Processing: {address_raw}, {city_raw or 'NO CITY'}")
 
         if parsed['is_multi_property']:
             multi_property_count += 1
-            print(f"  ⚡ Multi-property ({parsed['pattern_type']}): {len(parsed['addresses'])} addresses")
+            if verbose:
+                tqdm.write(f"  ⚡ Multi-property ({parsed['pattern_type']}): {len(parsed['addresses'])} addresses")
 
         # Geocode each address
         for addr_data in parsed['addresses']:
-            full_address = addr_data['full_address']
-
-            # Add "Ontario" to improve accuracy
-            geocode_input = f"{full_address}, Ontario" if city_raw else f"{full_address}, Ontario"
-
-            print(f"    Geocoding: {geocode_input[:70]}")
+            geocode_input = f"{addr_data['full_address']}, Ontario"
 
-            result = geocoder.geocode(geocode_input)
+            result = next(results)
 
-            geocoded_address_id = None
+            geo_row = geocoded_row('transactions', tx_id, geocode_input, result)
+            pending_geo.append(geo_row)
 
             if result:
                 components = result.get('components', {})
-                location = result.get('location', {})
-
-                # Insert into google_geocoded_addresses
-                cur.execute("""
-                    INSERT INTO google_geocoded_addresses (
-                        source_table,
-                        source_id,
-                        input_address,
-                        google_formatted_address,
-                        google_street_number,
-                        google_street,
-                        google_city,
-                        google_province,
-                        google_postal_code,
-                        google_latitude,
-                        google_longitude,
-                        google_place_id,
-                        google_confidence,
-                        geocode_success,
-                        google_raw_response
-                    ) VALUES (
-                        'transactions',
-                        %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-                    )
-                    RETURNING id
-                """, (
-                    tx_id,
-                    geocode_input,
-                    result.get('formatted_address'),
-                    components.get('street_number'),
-                    components.get('street'),
-                    components.get('city'),
-                    components.get('province'),
-                    components.get('postal_code'),
-                    location.get('lat'),
-                    location.get('lng'),
-                    result.get('place_id'),
-                    result.get('confidence'),
-                    True,
-                    Json(result.get('raw'))
-                ))
-
-                geocoded_address_id = cur.fetchone()[0]
                 total_addresses_geocoded += 1
 
                 province = components.get('province', '')
-                print(f"      ✓ {components.get('city')}, {province} {components.get('postal_code')}")
+                if verbose:
+                    tqdm.write(f"    ✓ {geocode_input[:70]}\n"
+                               f"      {components.get('city')}, {province} {components.get('postal_code')}")
                 success_count += 1
             else:
-                # Insert failure
-                cur.execute("""
-                    INSERT INTO google_geocoded_addresses (
-                        source_table,
-                        source_id,
-                        input_address,
-                        geocode_success,
-                        geocode_error
-                    ) VALUES (
-                        'transactions', %s, %s, %s, %s
-                    )
-                    RETURNING id
-                """, (
-                    tx_id,
-                    geocode_input,
-                    False,
-                    'No result from Google API'
-                ))
-
-                geocoded_address_id = cur.fetchone()[0]
-                print(f"      ✗ FAILED")
+                tqdm.write(f"    ✗ FAILED: {geocode_input[:70]}")
                 failure_count += 1
 
             # Link transaction to geocoded address
-            cur.execute("""
-                INSERT INTO transaction_address_links (
-                    transaction_id,
-                    geocoded_address_id,
-                    is_multi_property,
-                    original_address,
-                    pattern_type,
-                    address_position,
-                    is_primary
-                ) VALUES (
-                    %s, %s, %s, %s, %s, %s, %s
-                )
-            """, (
+            pending_links.append((
                 tx_id,
-                geocoded_address_id,
+                geo_row[0],
                 parsed['is_multi_property'],
                 parsed['original_address'],
                 parsed['pattern_type'],
@@ -171,14 +147,19 @@ def geocode_with_multi_property(limit=100):
                 addr_data['position'] == 1  # First address is primary
             ))
 
+        # Write and commit in batches, never splitting a transaction's addresses
+        if len(pending_geo) >= FLUSH_EVERY:
+            write_geocoded(cur, pending_geo, pending_links)
+            cache.flush()
             conn.commit()
+            pending_geo.clear()
+            pending_links.clear()
 
-            # Rate limiting
-            time.sleep(0.5)
-
-        print()
+    write_geocoded(cur, pending_geo, pending_links)
+    cache.flush()
+    conn.commit()
 
-    print("=" * 100)
+    print("\n" + "=" * 100)
     print("PROCESSING COMPLETE")
     print("=" * 100)
     print(f"Transactions processed: {total}")
@@ -186,6 +167,8 @@ def geocode_with_multi_property(limit=100):
     print(f"Total addresses geocoded: {total_addresses_geocoded}")
     print(f"Successful geocodes: {success_count} ({success_count*100/total_addresses_geocoded:.1f}%)")
     print(f"Failed geocodes: {failure_count} ({failure_count*100/total_addresses_geocoded:.1f}%)")
+    if resume_at:
+        print(f"Resume with: --after '{resume_at.isoformat()}'")
 
     cur.close()
     conn.close()
@@ -195,6 +178,10 @@ if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description='Geocode with multi-property parsing')
     parser.add_argument('--limit', type=int, default=100, help='Number of transactions to process')
+    parser.add_argument('--verbose', action='store_true', help='Print every transaction and geocoded address')
+    parser.add_argument('--after', default=None,
+                        help="Resume point: only transactions created at or before this timestamp "
+                             "(e.g. '2025-10-01 12:00:00')")
     args = parser.parse_args()
 
-    geocode_with_multi_property(args.limit)
+    geocode_with_multi_property(args.limit, args.verbose, args.after)
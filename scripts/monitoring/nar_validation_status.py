@@ -15,11 +15,17 @@ Usage:
     # Watch mode (refresh every 5 seconds)
     watch -n 5 python3 scripts/monitoring/nar_validation_status.py
 
+Results are cached in /tmp/nar_status_cache.json for NAR_STATUS_CACHE_TTL
+seconds (default 10), so a single `watch -n 5` queries Postgres on about
+every other refresh and several terminals watching at once share one query.
+
 Date: 2025-10-03
 """
 
+import json
 import os
 import sys
+import time
 from datetime import datetime, timedelta
 
 # Add parent directory to path
@@ -28,173 +34,203 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../..'))
 from common.db import connect_with_retries
 
 
-def get_queue_status():
-    """Get current queue status."""
-    conn = connect_with_retries()
-    cursor = conn.cursor()
-
-    try:
-        cursor.execute("""
-            SELECT
-                status,
-                COUNT(*) as count,
-                AVG(attempts) as avg_attempts,
-                MIN(queued_at) as oldest,
-                MAX(queued_at) as newest
-            FROM nar_validation_queue
-            GROUP BY status
-        """)
-
-        rows = cursor.fetchall()
-        status = {}
-        for row in rows:
-            status[row[0]] = {
-                'count': row[1],
-                'avg_attempts': row[2] or 0,
-                'oldest': row[3],
-                'newest': row[4]
-            }
-
-        return status
-
-    finally:
-        cursor.close()
-        conn.close()
-
+STATUS_CACHE = '/tmp/nar_status_cache.json'
+# Seconds a snapshot is reused before re-querying; keep it above the watch
+# interval or a lone watcher never hits the cache
+STATUS_CACHE_TTL = float(os.getenv('NAR_STATUS_CACHE_TTL', '10'))
+# Timestamps are cached in this fixed format (see fetch_snapshot)
+STATUS_TS_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
 
-def get_recent_validations(limit: int = 10):
-    """Get recently completed validations."""
-    conn = connect_with_retries()
-    cursor = conn.cursor()
 
-    try:
-        cursor.execute(f"""
-            SELECT
-                p.address_line1,
-                q.city_before,
-                q.city_after,
-                q.confidence_score,
-                q.completed_at
-            FROM nar_validation_queue q
-            JOIN properties p ON q.property_id = p.id
-            WHERE q.status = 'completed'
-            ORDER BY q.completed_at DESC
-            LIMIT {limit}
-        """)
-
-        return cursor.fetchall()
+def fetch_snapshot(recent_limit: int = 10, days: int = 7):
+    """
+    Fetch every status section in one round-trip.
 
-    finally:
-        cursor.close()
-        conn.close()
+    The queue, health, cache, recent-validation and daily-stat queries run as
+    CTEs of a single statement, so a refresh costs one connect + one query.
 
+    Args:
+        recent_limit: Number of recent validations to return
+        days: Number of days of daily statistics to return
 
-def get_cache_stats():
-    """Get cache performance statistics."""
+    Returns:
+        JSON-ready dict of the raw aggregates (timestamps as STATUS_TS_FORMAT strings)
+    """
     conn = connect_with_retries()
     cursor = conn.cursor()
 
     try:
         cursor.execute("""
-            SELECT
-                COUNT(*) as total_entries,
-                SUM(lookup_count) as total_lookups,
-                AVG(lookup_count) as avg_lookups,
-                MAX(lookup_count) as max_lookups,
-                COUNT(*) FILTER (WHERE lookup_count > 1) as reused_entries
-            FROM nar_address_cache
-        """)
-
-        row = cursor.fetchone()
-
-        if row and row[0]:
-            return {
-                'total_entries': row[0],
-                'total_lookups': row[1],
-                'avg_lookups': row[2],
-                'max_lookups': row[3],
-                'reused_entries': row[4],
-                'reuse_rate': (row[4] / row[0] * 100) if row[0] > 0 else 0
-            }
-        else:
-            return None
+            WITH queue AS (
+                SELECT
+                    status,
+                    COUNT(*) as count,
+                    AVG(attempts) as avg_attempts,
+                    to_char(MIN(queued_at), 'YYYY-MM-DD HH24:MI:SS.US') as oldest,
+                    to_char(MAX(queued_at), 'YYYY-MM-DD HH24:MI:SS.US') as newest
+                FROM nar_validation_queue
+                GROUP BY status
+            ),
+            health AS (
+                SELECT
+                    COUNT(*) FILTER (
+                        WHERE status = 'processing'
+                          AND last_attempt_at < NOW() - INTERVAL '5 minutes'
+                    ) as stuck_count,
+                    COUNT(*) FILTER (WHERE status = 'failed') as failed_count,
+                    MAX(completed_at) FILTER (WHERE status = 'completed') as last_completed
+                FROM nar_validation_queue
+            ),
+            cache AS (
+                SELECT
+                    COUNT(*) as total_entries,
+                    SUM(lookup_count) as total_lookups,
+                    AVG(lookup_count) as avg_lookups,
+                    MAX(lookup_count) as max_lookups,
+                    COUNT(*) FILTER (WHERE lookup_count > 1) as reused_entries
+                FROM nar_address_cache
+            ),
+            recent AS (
+                SELECT
+                    p.address_line1,
+                    q.city_before,
+                    q.city_after,
+                    q.confidence_score,
+                    q.completed_at
+                FROM nar_validation_queue q
+                JOIN properties p ON q.property_id = p.id
+                WHERE q.status = 'completed'
+                ORDER BY q.completed_at DESC
+                LIMIT %(recent_limit)s
+            ),
+            daily AS (
+                SELECT
+                    date,
+                    total_validated,
+                    nar_found,
+                    high_confidence,
+                    cities_updated,
+                    postal_codes_updated,
+                    geocoding_updated
+                FROM nar_validation_stats
+                WHERE date >= CURRENT_DATE - make_interval(days => %(days)s)
+            )
+            SELECT json_build_object(
+                'queue', (SELECT json_agg(queue) FROM queue),
+                'stuck_count', health.stuck_count,
+                'failed_count', health.failed_count,
+                'last_completed', to_char(health.last_completed, 'YYYY-MM-DD HH24:MI:SS.US'),
+                'total_entries', cache.total_entries,
+                'total_lookups', cache.total_lookups,
+                'avg_lookups', cache.avg_lookups,
+                'max_lookups', cache.max_lookups,
+                'reused_entries', cache.reused_entries,
+                'recent', (SELECT json_agg(json_build_array(
+                    address_line1, city_before, city_after, confidence_score, completed_at
+                 ) ORDER BY completed_at DESC) FROM recent),
+                'daily', (SELECT json_agg(json_build_array(
+                    date, total_validated, nar_found, high_confidence,
+                    cities_updated, postal_codes_updated, geocoding_updated
+                 ) ORDER BY date DESC) FROM daily)
+            )
+            FROM health, cache
+        """, {'recent_limit': recent_limit, 'days': days})
+
+        return cursor.fetchone()[0]
 
     finally:
         cursor.close()
         conn.close()
 
 
-def get_daily_stats(days: int = 7):
-    """Get daily statistics for last N days."""
-    conn = connect_with_retries()
-    cursor = conn.cursor()
-
+def load_cached_snapshot(params: dict, max_age: float = STATUS_CACHE_TTL):
+    """Return the cached snapshot if it is younger than max_age and matches params."""
     try:
-        cursor.execute(f"""
-            SELECT
-                date,
-                total_validated,
-                nar_found,
-                high_confidence,
-                cities_updated,
-                postal_codes_updated,
-                geocoding_updated
-            FROM nar_validation_stats
-            WHERE date >= CURRENT_DATE - INTERVAL '{days} days'
-            ORDER BY date DESC
-        """)
-
-        return cursor.fetchall()
-
-    finally:
-        cursor.close()
-        conn.close()
-
+        if time.time() - os.path.getmtime(STATUS_CACHE) >= max_age:
+            return None
+        with open(STATUS_CACHE) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return cached['snapshot'] if cached.get('params') == params else None
 
-def get_service_health():
-    """Check service health indicators."""
-    conn = connect_with_retries()
-    cursor = conn.cursor()
 
+def save_snapshot(params: dict, snapshot: dict):
+    """Write the snapshot to STATUS_CACHE atomically (concurrent watchers never see a partial file)."""
+    tmp = f"{STATUS_CACHE}.{os.getpid()}"
     try:
-        # Check for stuck processing items
-        cursor.execute("""
-            SELECT COUNT(*)
-            FROM nar_validation_queue
-            WHERE status = 'processing'
-              AND last_attempt_at < NOW() - INTERVAL '5 minutes'
-        """)
-        stuck_count = cursor.fetchone()[0]
-
-        # Check for failed items
-        cursor.execute("""
-            SELECT COUNT(*)
-            FROM nar_validation_queue
-            WHERE status = 'failed'
-        """)
-        failed_count = cursor.fetchone()[0]
+        with open(tmp, 'w') as f:
+            json.dump({'params': params, 'snapshot': snapshot}, f)
+        os.replace(tmp, STATUS_CACHE)
+    except OSError:
+        pass
+
+
+def parse_cached_ts(value):
+    """Parse a STATUS_TS_FORMAT timestamp from the snapshot (None passes through)."""
+    return datetime.strptime(value, STATUS_TS_FORMAT) if value else None
+
+
+def collect_status(recent_limit: int = 10, days: int = 7):
+    """
+    Get every status section, from STATUS_CACHE when it is fresh enough.
+
+    With the default 10s TTL about every other refresh of a single
+    `watch -n 5` is served from the file, and concurrent watchers share one
+    snapshot instead of each touching Postgres.
+
+    Args:
+        recent_limit: Number of recent validations to return
+        days: Number of days of daily statistics to return
+
+    Returns:
+        Dict with queue, health, cache, recent and daily sections
+    """
+    params = {'recent_limit': recent_limit, 'days': days}
+    snapshot = load_cached_snapshot(params)
+    if snapshot is None:
+        snapshot = fetch_snapshot(recent_limit, days)
+        save_snapshot(params, snapshot)
+
+    queue = {}
+    for row in snapshot['queue'] or []:
+        queue[row['status']] = {
+            'count': row['count'],
+            'avg_attempts': row['avg_attempts'] or 0,
+            'oldest': parse_cached_ts(row['oldest']),
+            'newest': parse_cached_ts(row['newest'])
+        }
 
-        # Check last completed validation
-        cursor.execute("""
-            SELECT MAX(completed_at)
-            FROM nar_validation_queue
-            WHERE status = 'completed'
-        """)
-        last_completed = cursor.fetchone()[0]
-
-        return {
-            'stuck_count': stuck_count,
-            'failed_count': failed_count,
-            'last_completed': last_completed
+    cache = None
+    if snapshot['total_entries']:
+        cache = {
+            'total_entries': snapshot['total_entries'],
+            'total_lookups': snapshot['total_lookups'],
+            'avg_lookups': snapshot['avg_lookups'],
+            'max_lookups': snapshot['max_lookups'],
+            'reused_entries': snapshot['reused_entries'],
+            'reuse_rate': snapshot['reused_entries'] / snapshot['total_entries'] * 100
         }
 
-    finally:
-        cursor.close()
-        conn.close()
+    last_completed = snapshot['last_completed']
+
+    return {
+        'queue': queue,
+        'health': {
+            'stuck_count': snapshot['stuck_count'],
+            'failed_count': snapshot['failed_count'],
+            'last_completed': parse_cached_ts(last_completed)
+        },
+        'cache': cache,
+        'recent': [tuple(row) for row in snapshot['recent'] or []],
+        'daily': [tuple(row) for row in snapshot['daily'] or []],
+    }
 
 
 def print_status():
     """Print comprehensive service status."""
+    status = collect_status()
+
     print("=" * 80)
     print("NAR VALIDATION SERVICE - STATUS")
     print("=" * 80)
@@ -205,7 +241,7 @@ def print_status():
     print("📊 QUEUE STATUS")
     print("-" * 80)
 
-    queue_status = get_queue_status()
+    queue_status = status['queue']
 
     if queue_status:
         for status_name in ['pending', 'processing', 'completed', 'failed']:
@@ -228,7 +264,7 @@ def print_status():
     print("🏥 SERVICE HEALTH")
     print("-" * 80)
 
-    health = get_service_health()
+    health = status['health']
 
     if health['stuck_count'] > 0:
         print(f"  ⚠️  STUCK items: {health['stuck_count']} (processing > 5 min)")
@@ -257,7 +293,7 @@ def print_status():
     print("💾 CACHE PERFORMANCE")
     print("-" * 80)
 
-    cache = get_cache_stats()
+    cache = status['cache']
 
     if cache and cache['total_entries'] > 0:
         print(f"  Total cache entries:  {cache['total_entries']:>8,}")
@@ -274,7 +310,7 @@ def print_status():
     print("🔄 RECENT VALIDATIONS (Last 10)")
     print("-" * 80)
 
-    recent = get_recent_validations(limit=10)
+    recent = status['recent']
 
     if recent:
         for row in recent:
@@ -293,7 +329,7 @@ def print_status():
     print(f"  {'Date':<12s} {'Validated':>10s} {'Found':>8s} {'High Conf':>10s} {'Updated':>8s}")
     print("-" * 80)
 
-    daily = get_daily_stats(days=7)
+    daily = status['daily']
 
     if daily:
         for row in daily:
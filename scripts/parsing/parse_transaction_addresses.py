@@ -5,11 +5,37 @@ Populates transaction_address_expansion_parse table
 import os
 import sys
 import psycopg2
+from psycopg2.extras import execute_values
 
 sys.path.insert(0, '/Users/brandonolsen23/Development/cleo-project-REBOOT')
 from common.multi_property_parser import MultiPropertyAddressParser
 
 
+FLUSH_EVERY = 500  # expanded rows per multi-row INSERT/commit
+
+INSERT_EXPANSIONS = """
+    INSERT INTO transaction_address_expansion_parse (
+        transaction_id,
+        original_address_raw,
+        original_city_raw,
+        is_multi_property,
+        pattern_type,
+        expanded_street_number,
+        expanded_street_name,
+        expanded_full_address,
+        address_position,
+        is_primary
+    ) VALUES %s
+    ON CONFLICT (transaction_id, expanded_full_address) DO NOTHING
+"""
+
+
+def insert_expansions(cur, rows):
+    """Insert buffered expansion rows with one multi-row INSERT."""
+    if rows:
+        execute_values(cur, INSERT_EXPANSIONS, rows, page_size=len(rows))
+
+
 def parse_transaction_addresses(limit=100):
     """Parse and expand transaction addresses"""
 
@@ -40,6 +66,7 @@ def parse_transaction_addresses(limit=100):
     single_count = 0
     multi_count = 0
     total_expanded = 0
+    pending = []
 
     for i, (tx_id, address_raw, city_raw) in enumerate(transactions, 1):
         print(f"[{i}/{total}] {address_raw}, {city_raw or 'NO CITY'}")
@@ -53,25 +80,9 @@ def parse_transaction_addresses(limit=100):
         else:
             single_count += 1
 
-        # Insert each expanded address
+        # Buffer each expanded address
         for addr_data in parsed['addresses']:
-            cur.execute("""
-                INSERT INTO transaction_address_expansion_parse (
-                    transaction_id,
-                    original_address_raw,
-                    original_city_raw,
-                    is_multi_property,
-                    pattern_type,
-                    expanded_street_number,
-                    expanded_street_name,
-                    expanded_full_address,
-                    address_position,
-                    is_primary
-                ) VALUES (
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-                )
-                ON CONFLICT (transaction_id, expanded_full_address) DO NOTHING
-            """, (
+            pending.append((
                 tx_id,
                 address_raw,
                 city_raw,
@@ -87,7 +98,14 @@ def parse_transaction_addresses(limit=100):
             total_expanded += 1
             print(f"    [{addr_data['position']}] {addr_data['full_address']}")
 
-        conn.commit()
+        # Write and commit in batches, never splitting a transaction's addresses
+        if len(pending) >= FLUSH_EVERY:
+            insert_expansions(cur, pending)
+            conn.commit()
+            pending.clear()
+
+    insert_expansions(cur, pending)
+    conn.commit()
 
     print("\n" + "=" * 100)
     print("PARSING COMPLETE")
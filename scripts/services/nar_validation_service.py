@@ -132,7 +132,7 @@ class NARValidationService:
 
         try:
             # Fetch pending properties, prioritized by priority and queued_at
-            cursor.execute(f"""
+            cursor.execute("""
                 SELECT
                     q.id as queue_id,
                     q.property_id,
@@ -144,8 +144,8 @@ class NARValidationService:
                 JOIN properties p ON q.property_id = p.id
                 WHERE q.status = 'pending'
                 ORDER BY q.priority ASC, q.queued_at ASC
-                LIMIT {self.batch_size}
-            """)
+                LIMIT %s
+            """, (self.batch_size,))
 
             rows = cursor.fetchall()
 
@@ -0,0 +1,134 @@
+"""
+Parity tests for the fix_city()/hash_address_raw() SQL port
+
+Runs a fixed corpus through both the Python rules and the functions in
+config/supabase/migrations/20261016_city_fix_functions.sql. The migration and
+rule seeding happen inside a transaction that is rolled back afterwards.
+"""
+
+import os
+import unittest
+from itertools import product
+from pathlib import Path
+
+try:
+    import psycopg2
+except ImportError:  # pragma: no cover - optional in the test environment
+    psycopg2 = None
+
+from common.address import hash_address_raw
+from common.address_parser import parse_and_validate_city
+from common.ontario_cities import seed_city_fix_rules
+
+MIGRATION = (Path(__file__).resolve().parents[1] / "config" / "supabase" / "migrations"
+             / "20261016_city_fix_functions.sql")
+
+CITIES = [
+    "Toronto",
+    "TORONTO",
+    "  toronto  ",
+    "Mississauga\t",
+    "Toronto (Scarborough)",
+    "Ottawa (Kanata)",
+    "Scarborough",
+    "North York",
+    "Orleans",
+    "Orléans",
+    "orléans",
+    "Pikwàkanagàn",
+    "Unit 5",
+    "Suite #12",
+    "#42",
+    "123 Main St",
+    "Main Street",
+    "Highway 7",
+    "Apt 3B",
+    "St. Catharines",
+    "Straße",
+    "ﬁnch",
+    "Not A City",
+    "Brampton,",
+    "",
+]
+
+CANONICALS = [
+    None,
+    "",
+    "1 MAIN ST",
+    "1 MAIN ST, CA",
+    "1 MAIN ST, TORONTO, ON, CA",
+    "1 MAIN ST, BRAMPTON, ONTARIO, CA",
+    "9025 AIRPORT ROAD, UNIT 1, BRAMPTON, CA",
+    "1 MAIN ST, Toronto (Etobicoke), ON, CA",
+    "1 MAIN ST, ORLEANS, ON, CA",
+    "1 MAIN ST,orléans,on,CA",
+    "TORONTO, 1 MAIN ST, CA",
+    "1 MAIN ST, FOO, BAR, HAMILTON",
+    "1 MAIN ST, , TORONTO, ON, CA",
+    "1 MAIN ST, UNIT 4, ON, CA",
+]
+
+ADDRESSES = [
+    None,
+    "",
+    "123 Main St.",
+    "  45-B  King St W ",
+    "#5 - 100 Queen St",
+    "1 Rue de l'Église",
+    "12 Straße",
+    "ﬁrst Ave",
+    "7 Dıvision Rd",
+]
+
+HASH_CITIES = [None, "", "Toronto", "Orléans", "Saint-Jérôme", "ſudbury"]
+
+
+@unittest.skipUnless(psycopg2 and os.getenv("DATABASE_URL"), "requires psycopg2 and DATABASE_URL")
+class TestCityFixSqlParity(unittest.TestCase):
+    """SQL port must agree with common.address_parser / common.address."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.conn = psycopg2.connect(os.environ["DATABASE_URL"])
+        cls.cur = cls.conn.cursor()
+        cls.cur.execute(MIGRATION.read_text(encoding="utf-8"))
+        seed_city_fix_rules(cls.cur)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.rollback()
+        cls.cur.close()
+        cls.conn.close()
+
+    def test_fix_city_matches_parse_and_validate_city(self):
+        """fix_city() returns the same city for every (city, canonical) pair."""
+        pairs = list(product(CITIES, CANONICALS))
+        self.cur.execute("""
+            SELECT fix_city(t.city, t.canonical)
+            FROM unnest(%s::text[], %s::text[]) WITH ORDINALITY AS t(city, canonical, ord)
+            ORDER BY t.ord
+        """, ([c for c, _ in pairs], [k for _, k in pairs]))
+        sql_results = [r[0] for r in self.cur.fetchall()]
+
+        for (city, canonical), sql_city in zip(pairs, sql_results):
+            with self.subTest(city=city, canonical=canonical):
+                expected = parse_and_validate_city(address="", city_raw=city, canonical=canonical)
+                self.assertEqual(sql_city, expected)
+
+    def test_hash_address_raw_matches_python(self):
+        """hash_address_raw() in SQL produces the Python digest."""
+        pairs = list(product(ADDRESSES, HASH_CITIES))
+        self.cur.execute("""
+            SELECT hash_address_raw(t.address, t.city)
+            FROM unnest(%s::text[], %s::text[]) WITH ORDINALITY AS t(address, city, ord)
+            ORDER BY t.ord
+        """, ([a for a, _ in pairs], [c for _, c in pairs]))
+        sql_hashes = [r[0] for r in self.cur.fetchall()]
+
+        for (address, city), sql_hash in zip(pairs, sql_hashes):
+            with self.subTest(address=address, city=city):
+                self.assertEqual(sql_hash, hash_address_raw(address, city))
+
+
+if __name__ == "__main__":
+    unittest.main()
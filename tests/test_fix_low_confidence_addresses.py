@@ -0,0 +1,88 @@
+"""
+Tests for the batched writeback in fix_low_confidence_addresses
+"""
+
+import importlib.util
+import os
+import unittest
+import uuid
+from pathlib import Path
+
+try:
+    import psycopg2
+except ImportError:  # pragma: no cover - optional in the test environment
+    psycopg2 = None
+
+SCRIPT = Path(__file__).resolve().parents[1] / "scripts" / "geocoding" / "fix_low_confidence_addresses.py"
+
+
+def load_script():
+    spec = importlib.util.spec_from_file_location("fix_low_confidence_addresses", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@unittest.skipUnless(psycopg2 and os.getenv("DATABASE_URL"), "requires psycopg2 and DATABASE_URL")
+class TestFlushUpdates(unittest.TestCase):
+    """flush_updates against a temp google_geocoded_addresses table."""
+
+    def setUp(self):
+        self.script = load_script()
+        self.conn = psycopg2.connect(os.environ["DATABASE_URL"])
+        self.cur = self.conn.cursor()
+        # Temp table shadows the real one for this session only
+        self.cur.execute("""
+            CREATE TEMP TABLE google_geocoded_addresses (
+                id uuid PRIMARY KEY,
+                google_formatted_address text,
+                google_street_number text,
+                google_street text,
+                google_city text,
+                google_province text,
+                google_postal_code text,
+                google_latitude numeric,
+                google_longitude numeric,
+                google_place_id text,
+                google_confidence text,
+                google_raw_response jsonb,
+                geocode_method text,
+                needs_manual_review boolean
+            )
+        """)
+
+    def tearDown(self):
+        self.conn.rollback()
+        self.cur.close()
+        self.conn.close()
+
+    def fixed_row(self, row_id, confidence, method):
+        return (row_id, "1 Main St, Toronto, ON", "1", "Main St", "Toronto", "ON", "M5V 1A1",
+                43.65, -79.38, "place", confidence, self.script.OrJson({"status": "OK"}), method)
+
+    def test_mixed_string_and_int_confidence(self):
+        """Geocoding API ('high') and Text Search (90) results flush in one batch."""
+        ids = [str(uuid.uuid4()) for _ in range(3)]
+        self.cur.executemany("INSERT INTO google_geocoded_addresses (id) VALUES (%s)", [(i,) for i in ids])
+
+        fixed_rows = [
+            self.fixed_row(ids[0], "high", "geocoding"),
+            self.fixed_row(ids[1], 90, "text_search"),
+        ]
+        failed_rows = [(ids[2], "text_search_failed")]
+        self.script.flush_updates(self.cur, fixed_rows, failed_rows)
+
+        self.cur.execute("""
+            SELECT id::text, google_confidence, needs_manual_review
+            FROM google_geocoded_addresses
+        """)
+        rows = {r[0]: r[1:] for r in self.cur.fetchall()}
+        self.assertEqual(rows[ids[0]], ("high", False))
+        self.assertEqual(rows[ids[1]], ("90", False))
+        self.assertEqual(rows[ids[2]], (None, True))
+        self.assertEqual(fixed_rows, [])
+        self.assertEqual(failed_rows, [])
+
+
+if __name__ == "__main__":
+    unittest.main()